@@ -0,0 +1,97 @@
+"""
+Micro-benchmark of the sql_statements registry
+
+Compares the per-call latency of the "top materials by usage" query run as
+- inline: SQL rebuilt with an f-string LIMIT on every call (the old
+  Streamlit helpers), so every distinct limit is a new statement to compile
+  and plan;
+- registry: the registered text() with a bound :limit, compiled once;
+- prepared: the registered statement prepared on the server (PostgreSQL only).
+
+Usage:
+    python bench_sql_statements.py                       # temporary SQLite database
+    python bench_sql_statements.py --url postgresql://...  # an existing database
+    python bench_sql_statements.py --iterations 5000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+import sql_statements
+
+
+def create_sample_database(rows=2000):
+    """Temporary SQLite database with a medicinal_material table"""
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE medicinal_material ("
+            "id INTEGER PRIMARY KEY, name VARCHAR(100), usage_frequency INTEGER)"
+        ))
+        conn.execute(text("CREATE INDEX ix_usage ON medicinal_material (usage_frequency)"))
+        conn.execute(
+            text("INSERT INTO medicinal_material (name, usage_frequency) VALUES (:name, :usage)"),
+            [{'name': f"material {i}", 'usage': (i * 7919) % 500} for i in range(rows)]
+        )
+    return engine
+
+
+def run_inline(conn, limit):
+    return conn.execute(text(f"""
+        SELECT name, usage_frequency
+        FROM medicinal_material
+        ORDER BY usage_frequency DESC
+        LIMIT {limit}
+    """)).all()
+
+
+def run_registry(conn, limit):
+    return sql_statements.execute(conn, 'material_usage_top', {'limit': limit}, prepare=False).all()
+
+
+def run_prepared(conn, limit):
+    return sql_statements.execute(conn, 'material_usage_top', {'limit': limit}, prepare=True).all()
+
+
+def measure(engine, func, iterations, limits):
+    """Per-call latencies in microseconds, on one connection"""
+    timings = []
+    with engine.connect() as conn:
+        func(conn, limits[0])  # warm up the connection
+        for i in range(iterations):
+            limit = limits[i % len(limits)]
+            started = time.perf_counter()
+            func(conn, limit)
+            timings.append((time.perf_counter() - started) * 1e6)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark registered SQL statements")
+    parser.add_argument('--url', help="Database URL (default: temporary SQLite database)")
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--distinct-limits', type=int, default=50,
+                        help="Number of different LIMIT values to cycle through")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.url) if args.url else create_sample_database()
+    limits = list(range(1, args.distinct_limits + 1))
+
+    variants = [('inline', run_inline), ('registry', run_registry)]
+    if engine.dialect.name == 'postgresql':
+        variants.append(('prepared', run_prepared))
+
+    print(f"{engine.dialect.name}, {args.iterations} calls, {len(limits)} distinct limits")
+    print(f"{'variant':<10} {'mean us':>10} {'median us':>10} {'p95 us':>10}")
+    for name, func in variants:
+        timings = measure(engine, func, args.iterations, limits)
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        print(f"{name:<10} {statistics.mean(timings):>10.1f} {statistics.median(timings):>10.1f} {p95:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Set-based CSV import for medicinal materials and prescriptions
+
+Instead of looking up every name and committing every row, a file is parsed
+up front, the existing names are loaded with one query per table, and the
+new rows are written with executemany INSERT ... ON CONFLICT DO NOTHING
+statements. usage_frequency is recomputed with a single aggregate UPDATE
+once the prescription links are in place.
+
+The *_rows functions work on one chunk of parsed CSV rows inside the
+caller's transaction, so they can be reused by importers that commit per
+chunk.
+"""
+import csv
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from models import MedicinalMaterial, Prescription, EfficacyCategory, prescription_material, prescription_efficacy
+import data_events
+import material_stats  # noqa: F401  (refreshes material_statistic after bulk changes)
+import material_usage
+from csv_rows import MATERIAL_COLUMNS, parse_prescription_row
+
+logger = logging.getLogger(__name__)
+
+# Rows per executemany batch and names per IN (...) lookup
+CHUNK_SIZE = 1000
+
+# Tables written by a prescription import
+PRESCRIPTION_TABLES = ('prescription', 'efficacy_category', 'prescription_material',
+                       'prescription_efficacy', 'medicinal_material')
+
+
+def chunked(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def read_csv(file_path):
+    """Read a whole CSV file into a list of row dicts"""
+    with open(file_path, 'r', encoding='utf-8', newline='') as file:
+        return list(csv.DictReader(file))
+
+
+def insert_ignore(table, index_elements):
+    """
+    INSERT statement that skips rows violating a unique constraint
+
+    Args:
+        table: Table to insert into
+        index_elements (list): Columns of the unique constraint to check
+
+    Returns:
+        Insert: Dialect-specific statement (a plain INSERT on other databases)
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    return table.insert()
+
+
+def load_name_map(model, names=None):
+    """
+    Map names to ids with one query (one per CHUNK_SIZE names if names are given)
+
+    Args:
+        model: Model class with id and name columns
+        names (iterable, optional): Only look up these names
+
+    Returns:
+        dict: name -> id
+    """
+    if names is None:
+        return dict(db.session.query(model.name, model.id).all())
+
+    result = {}
+    for chunk in chunked(set(names)):
+        result.update(db.session.query(model.name, model.id).filter(model.name.in_(chunk)).all())
+    return result
+
+
+def ensure_categories(names):
+    """
+    Create the efficacy categories that do not exist yet
+
+    Args:
+        names (iterable): Category names
+
+    Returns:
+        dict: name -> id for all of the given names
+    """
+    names = set(names)
+    category_ids = load_name_map(EfficacyCategory, names)
+    missing = [{'name': name} for name in sorted(names - set(category_ids))]
+    if missing:
+        execute_many(insert_ignore(EfficacyCategory.__table__, ['name']), missing)
+        category_ids.update(load_name_map(EfficacyCategory, [c['name'] for c in missing]))
+    return category_ids
+
+
+def execute_many(statement, params):
+    """Execute a statement for a list of parameter dicts in CHUNK_SIZE batches"""
+    for chunk in chunked(params):
+        db.session.execute(statement, chunk)
+
+
+def import_material_rows(rows, existing=None):
+    """
+    Insert the new materials of a chunk of CSV rows
+
+    Args:
+        rows (list): Row dicts from csv.DictReader
+        existing (dict, optional): name -> id of materials already stored,
+            updated in place with the inserted materials
+
+    Returns:
+        tuple: (success_count, error_count, error_messages)
+    """
+    if existing is None:
+        existing = load_name_map(MedicinalMaterial, [(row.get('name') or '').strip() for row in rows])
+
+    error_messages = []
+    params = []
+    for row in rows:
+        name = (row.get('name') or '').strip()
+        if not name:
+            error_messages.append("Material row without a name")
+        elif name in existing:
+            error_messages.append(f"Material '{name}' already exists")
+        else:
+            existing[name] = None
+            values = {column: row.get(column) for column in MATERIAL_COLUMNS}
+            params.append(dict(values, name=name, usage_frequency=0))
+
+    if params:
+        table = MedicinalMaterial.__table__
+        execute_many(insert_ignore(table, ['name']), params)
+        existing.update(load_name_map(MedicinalMaterial, [p['name'] for p in params]))
+
+    return len(params), len(error_messages), error_messages
+
+
+def import_prescription_rows(rows, material_ids=None, existing=None):
+    """
+    Insert the new prescriptions of a chunk of CSV rows with their links
+
+    Efficacy categories that do not exist yet are created. usage_frequency
+    is not touched; call recompute_usage_frequency() with the returned
+    material ids once the links are written.
+
+    Args:
+        rows (list): Row dicts from csv.DictReader
+        material_ids (dict, optional): name -> id of all known materials
+        existing (dict, optional): name -> id of prescriptions already stored,
+            updated in place with the inserted prescriptions
+
+    Returns:
+        tuple: (success_count, error_count, error_messages, touched material ids)
+    """
+    if material_ids is None:
+        material_ids = load_name_map(MedicinalMaterial)
+    if existing is None:
+        existing = load_name_map(Prescription, [(row.get('name') or '').strip() for row in rows])
+
+    error_messages = []
+    parsed = []
+    for row in rows:
+        name = (row.get('name') or '').strip()
+        if not name:
+            error_messages.append("Prescription row without a name")
+            continue
+        if name in existing:
+            error_messages.append(f"Prescription '{name}' already exists")
+            continue
+        existing[name] = None
+        materials, categories = parse_prescription_row(row)
+        parsed.append((name, row, materials, categories))
+
+    # Only rejected rows count as errors; missing materials are reported but not fatal
+    error_count = len(error_messages)
+    if not parsed:
+        return 0, error_count, error_messages, set()
+
+    category_ids = ensure_categories(name for _, _, _, categories in parsed for name in categories)
+
+    now = datetime.now(timezone.utc)
+    execute_many(insert_ignore(Prescription.__table__, ['name']), [{
+        'name': name,
+        'description': row.get('description'),
+        'efficacy': row.get('efficacy'),
+        'evolution_history': {},
+        'created_at': now,
+        'updated_at': now
+    } for name, row, _, _ in parsed])
+    existing.update(load_name_map(Prescription, [name for name, _, _, _ in parsed]))
+
+    material_links = []
+    category_links = []
+    touched = set()
+    for name, _, materials, categories in parsed:
+        prescription_id = existing[name]
+        linked = set()
+        for material_name, amount, unit in materials:
+            material_id = material_ids.get(material_name)
+            if material_id is None:
+                error_messages.append(f"Material '{material_name}' not found for prescription '{name}'")
+            elif material_id not in linked:
+                linked.add(material_id)
+                material_links.append({'prescription_id': prescription_id, 'material_id': material_id,
+                                       'amount': amount, 'unit': unit})
+        touched |= linked
+
+        for category_id in {category_ids[category] for category in categories}:
+            category_links.append({'prescription_id': prescription_id, 'efficacy_category_id': category_id})
+
+    if material_links:
+        execute_many(prescription_material.insert(), material_links)
+    if category_links:
+        execute_many(prescription_efficacy.insert(), category_links)
+
+    return len(parsed), error_count, error_messages, touched
+
+
+def recompute_usage_frequency(material_ids=None):
+    """
+    Set usage_frequency to the number of prescriptions using each material
+
+    Args:
+        material_ids (iterable, optional): Only update these materials (all if None)
+    """
+    material_usage.recompute_usage_frequency(db.session.connection(), material_ids)
+
+
+def import_medicinal_materials(file_path):
+    """
+    Import medicinal materials from a CSV file in one transaction
+
+    Returns:
+        tuple: (success_count, error_count, error_messages)
+    """
+    rows = read_csv(file_path)
+    existing = load_name_map(MedicinalMaterial)
+
+    try:
+        success_count, error_count, error_messages = import_material_rows(rows, existing)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    data_events.notify_bulk_change('medicinal_material')
+    logger.info(f"Bulk imported {success_count} materials from {file_path}")
+    return success_count, error_count, error_messages
+
+
+def import_prescriptions(file_path):
+    """
+    Import prescriptions from a CSV file in one transaction
+
+    Returns:
+        tuple: (success_count, error_count, error_messages)
+    """
+    rows = read_csv(file_path)
+    material_ids = load_name_map(MedicinalMaterial)
+    existing = load_name_map(Prescription)
+
+    try:
+        success_count, error_count, error_messages, touched = import_prescription_rows(rows, material_ids, existing)
+        recompute_usage_frequency(touched)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    data_events.notify_bulk_change(*PRESCRIPTION_TABLES)
+    logger.info(f"Bulk imported {success_count} prescriptions from {file_path}")
+    return success_count, error_count, error_messages
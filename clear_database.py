@@ -1,4 +1,5 @@
 from app import app, db
+import data_events
 
 def clear_data():
     """Clear existing data in the database"""
@@ -16,8 +17,10 @@ def clear_data():
         db.session.execute(db.text('DELETE FROM prescription'))
         db.session.execute(db.text('DELETE FROM efficacy_category'))
         db.session.execute(db.text('DELETE FROM medicinal_material'))
+        db.session.execute(db.text('DELETE FROM material_statistic'))
         
         db.session.commit()
+        data_events.notify_bulk_change(*sorted(data_events.TRACKED_TABLES))
         print("Data cleared successfully")
     except Exception as e:
         db.session.rollback()
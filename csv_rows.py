@@ -0,0 +1,212 @@
+"""
+Parsing and validation of import CSV rows
+
+Nothing in this module touches the database or the Flask app, so its
+functions can run in worker processes (see import_pipeline).
+"""
+import csv
+import io
+import re
+
+# Columns of medicinal_materials.csv besides the name
+MATERIAL_COLUMNS = ('pinyin', 'english_name', 'province_origin', 'property', 'flavor', 'meridian', 'description')
+
+# Maximum lengths of the String columns in models.py
+MATERIAL_LIMITS = {
+    'name': 100, 'pinyin': 100, 'english_name': 200, 'province_origin': 50,
+    'property': 20, 'flavor': 100, 'meridian': 100
+}
+PRESCRIPTION_LIMITS = {'name': 100, 'efficacy': 200}
+CATEGORY_NAME_LIMIT = 100
+
+_AMOUNT = re.compile(r"^\s*([\d.]+)\s*(\S*)\s*$")
+
+
+def parse_amount(value):
+    """
+    Split an amount such as '10g' into its quantity and unit
+
+    Returns:
+        tuple: (amount, unit), either of which may be None
+    """
+    if not value:
+        return None, None
+    match = _AMOUNT.match(value)
+    if not match:
+        return value.strip(), None
+    return match.group(1), match.group(2) or None
+
+
+def parse_prescription_row(row):
+    """
+    Extract the material and category lists from a prescription row
+
+    Rows whose lists were written without quotes spill over into extra
+    columns; tokens of the form 'name:amount' are treated as materials and
+    everything else as efficacy categories in that case.
+
+    Args:
+        row (dict): Row from csv.DictReader
+
+    Returns:
+        tuple: (list of (material name, amount, unit), list of category names)
+    """
+    overflow = row.get(None)
+    if overflow:
+        tokens = [row.get('materials') or '', row.get('efficacy_categories') or ''] + list(overflow)
+        material_tokens = [token for token in tokens if ':' in token]
+        category_tokens = [token for token in tokens if token and ':' not in token]
+    else:
+        material_tokens = (row.get('materials') or '').split(',')
+        category_tokens = (row.get('efficacy_categories') or '').split(',')
+
+    materials = []
+    for token in material_tokens:
+        name, _, amount = token.partition(':')
+        name = name.strip()
+        if name:
+            materials.append((name, *parse_amount(amount)))
+
+    categories = [name.strip() for name in category_tokens if name.strip()]
+    return materials, categories
+
+
+def _check_lengths(values, limits):
+    for column, limit in limits.items():
+        value = values.get(column)
+        if value is not None and len(value) > limit:
+            return f"{column} is longer than {limit} characters"
+    return None
+
+
+def validate_material(row):
+    """
+    Normalize a material row
+
+    Returns:
+        tuple: (values dict or None, error message or None)
+    """
+    name = (row.get('name') or '').strip()
+    if not name:
+        return None, "name is required"
+
+    values = {'name': name}
+    for column in MATERIAL_COLUMNS:
+        if column in row:
+            value = row[column]
+            values[column] = value.strip() if value is not None else None
+
+    error = _check_lengths(values, MATERIAL_LIMITS)
+    return (None, error) if error else (values, None)
+
+
+def validate_prescription(row):
+    """
+    Normalize a prescription row and parse its material and category lists
+
+    Returns:
+        tuple: (values dict or None, error message or None)
+    """
+    name = (row.get('name') or '').strip()
+    if not name:
+        return None, "name is required"
+
+    materials, categories = parse_prescription_row(row)
+    values = {
+        'name': name,
+        'description': row.get('description'),
+        'efficacy': (row.get('efficacy') or '').strip() or None,
+        'materials': materials,
+        'categories': categories
+    }
+
+    error = _check_lengths(values, PRESCRIPTION_LIMITS)
+    if error is None:
+        too_long = [category for category in categories if len(category) > CATEGORY_NAME_LIMIT]
+        if too_long:
+            error = f"efficacy category '{too_long[0][:20]}...' is longer than {CATEGORY_NAME_LIMIT} characters"
+    return (None, error) if error else (values, None)
+
+
+VALIDATORS = {
+    'materials': validate_material,
+    'prescriptions': validate_prescription,
+}
+
+
+def split_lines(text, chunk_lines):
+    """
+    Split CSV text into chunks of whole records
+
+    Chunks are only cut where the number of quote characters seen so far is
+    even, so quoted fields spanning several lines stay in one chunk.
+
+    Args:
+        text (str): CSV data without the header line
+        chunk_lines (int): Approximate number of lines per chunk
+
+    Yields:
+        tuple: (zero-based index of the chunk's first line, chunk text)
+    """
+    # Only real line breaks end a line, as in the csv module (not U+2028, \x0c, ...)
+    lines = list(io.StringIO(text, newline=''))
+    start = 0
+    quotes = 0
+    for index, line in enumerate(lines):
+        quotes += line.count('"')
+        if index + 1 - start >= chunk_lines and quotes % 2 == 0:
+            yield start, ''.join(lines[start:index + 1])
+            start = index + 1
+    if start < len(lines):
+        yield start, ''.join(lines[start:])
+
+
+def parse_chunk(kind, header, first_line, text):
+    """
+    Parse and validate one chunk of CSV records
+
+    Args:
+        kind (str): 'materials' or 'prescriptions'
+        header (list): Column names
+        first_line (int): Line number of the chunk's first line in the upload
+        text (str): Chunk text
+
+    Returns:
+        tuple: (list of (line number, values), list of (line number, error message))
+    """
+    validate = VALIDATORS[kind]
+    rows = []
+    errors = []
+
+    reader = csv.reader(io.StringIO(text, newline=''))
+    line = first_line
+    while True:
+        try:
+            record = next(reader)
+        except StopIteration:
+            break
+        except csv.Error as e:
+            errors.append((line, str(e)))
+            line = first_line + reader.line_num
+            continue
+
+        record_line = line
+        line = first_line + reader.line_num
+        if not record:
+            continue
+
+        row = dict(zip(header, record))
+        if len(record) > len(header):
+            row[None] = record[len(header):]
+
+        try:
+            values, error = validate(row)
+        except Exception as e:
+            values, error = None, str(e)
+
+        if error:
+            errors.append((record_line, error))
+        else:
+            rows.append((record_line, values))
+
+    return rows, errors
@@ -0,0 +1,256 @@
+"""
+Change notifications for committed writes to the prescription data
+
+SQLAlchemy session events are used to capture the rows that a transaction
+inserts, updates or deletes. Once the transaction commits, the captured
+changes are handed to subscribers so in-process caches can patch themselves
+instead of rereading whole tables. Writes that bypass the ORM (raw SQL,
+bulk imports) should call notify_bulk_change() after committing; writes
+seen to come from another process are reported with notify_remote_change().
+
+Flush handlers registered with on_flush() see the same changes while the
+transaction is still open, so they can keep derived tables in step with
+the write that caused them.
+"""
+import logging
+import threading
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Tables whose changes are reported to subscribers
+TRACKED_TABLES = {
+    'medicinal_material',
+    'prescription',
+    'efficacy_category',
+    'material_interaction',
+    'prescription_material',
+    'prescription_efficacy',
+}
+
+_PENDING_KEY = 'data_events.pending'
+
+_subscribers = []
+_subscribers_lock = threading.Lock()
+
+_flush_handlers = []
+
+
+class Change:
+    """
+    A single row-level change captured at flush time
+
+    Attributes:
+        table (str): Name of the table that changed
+        op (str): 'insert', 'update', 'delete' or 'bulk'
+        row_id (int): Primary key of the row (None for association rows and bulk changes)
+        values (dict): Column values known at flush time
+        previous (dict): Old values of the columns changed by an update, where
+            they were loaded before the change
+        changed (tuple): Names of the columns changed by an update
+        remote (bool): Whether the change was committed by another process
+            (see notify_remote_change)
+    """
+    __slots__ = ('table', 'op', 'row_id', 'values', 'previous', 'changed', 'remote')
+
+    def __init__(self, table, op, row_id=None, values=None, previous=None, changed=(), remote=False):
+        self.table = table
+        self.op = op
+        self.row_id = row_id
+        self.values = values or {}
+        self.previous = previous or {}
+        self.changed = tuple(changed)
+        self.remote = remote
+
+    def __repr__(self):
+        return f"<Change {self.op} {self.table} {self.row_id or self.values}>"
+
+
+def subscribe(callback):
+    """
+    Register a callback that receives the changes of every committed transaction
+
+    Args:
+        callback (callable): Called with a list of Change objects
+    """
+    with _subscribers_lock:
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    """Remove a previously registered callback"""
+    with _subscribers_lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def on_flush(callback):
+    """
+    Register a callback run inside the transaction after every flush
+
+    The callback receives the session and the changes of that flush. It may
+    execute SQL on session.connection(); an exception aborts the flush.
+
+    Args:
+        callback (callable): Called with (session, list of Change objects)
+    """
+    with _subscribers_lock:
+        if callback not in _flush_handlers:
+            _flush_handlers.append(callback)
+
+
+def notify_bulk_change(*tables):
+    """
+    Tell subscribers that tables were rewritten outside the ORM
+
+    Subscribers are expected to treat a 'bulk' change as a full invalidation
+    of whatever they derive from these tables.
+
+    Args:
+        *tables (str): Names of the tables that changed
+    """
+    _dispatch([Change(table, 'bulk') for table in tables])
+
+
+def notify_remote_change(*tables):
+    """
+    Tell subscribers that another process committed changes to tables
+
+    Subscribers receive 'bulk' changes flagged remote. In-process caches
+    should invalidate as for any bulk change; handlers that maintain derived
+    tables should skip them, since the writing process already did.
+
+    Args:
+        *tables (str): Names of the tables that changed (all tracked tables if none)
+    """
+    _dispatch([Change(table, 'bulk', remote=True) for table in (tables or sorted(TRACKED_TABLES))])
+
+
+def _dispatch(changes):
+    if not changes:
+        return
+
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+
+    for callback in subscribers:
+        try:
+            callback(changes)
+        except Exception as e:
+            logger.error(f"Error in data change subscriber {callback!r}: {e}")
+
+
+def _loaded_values(state, mapper):
+    """Column values currently loaded on an instance, keyed by attribute name"""
+    return {
+        attr.key: state.dict[attr.key]
+        for attr in mapper.column_attrs
+        if attr.key in state.dict
+    }
+
+
+def _column_history(state, mapper):
+    """
+    Columns modified since the instance was loaded
+
+    Returns:
+        tuple: (dict of loaded old values, list of all modified column names)
+    """
+    previous = {}
+    changed = []
+    for attr in mapper.column_attrs:
+        history = state.attrs[attr.key].history
+        if history.deleted:
+            previous[attr.key] = history.deleted[0]
+        if history.added or history.deleted:
+            changed.append(attr.key)
+    return previous, changed
+
+
+def _association_changes(state, mapper, seen):
+    """Association rows added or removed through many-to-many collections"""
+    changes = []
+    for rel in mapper.relationships:
+        if rel.secondary is None or rel.secondary.name not in TRACKED_TABLES:
+            continue
+
+        history = state.attrs[rel.key].history
+        if not history.added and not history.deleted:
+            continue
+
+        parent_col, parent_fk = rel.synchronize_pairs[0]
+        child_col, child_fk = rel.secondary_synchronize_pairs[0]
+        parent_id = state.dict.get(mapper.get_property_by_column(parent_col).key)
+
+        for op, related in (('insert', history.added), ('delete', history.deleted)):
+            for obj in related:
+                if obj is None:
+                    continue
+                child_state = inspect(obj)
+                child_id = child_state.dict.get(child_state.mapper.get_property_by_column(child_col).key)
+                values = {parent_fk.key: parent_id, child_fk.key: child_id}
+
+                # Both sides of a back_populates pair report the same row
+                key = (rel.secondary.name, op, tuple(sorted(values.items())))
+                if key in seen:
+                    continue
+                seen.add(key)
+                changes.append(Change(rel.secondary.name, op, values=values))
+
+    return changes
+
+
+def _capture_changes(session):
+    changes = []
+    seen = set()
+
+    for op, instances in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in instances:
+            state = inspect(obj)
+            mapper = state.mapper
+            table = mapper.local_table.name
+            if table not in TRACKED_TABLES:
+                continue
+            if op == 'update' and not session.is_modified(obj):
+                continue
+
+            values = _loaded_values(state, mapper)
+            row_id = values.get('id')
+            previous, changed = _column_history(state, mapper) if op == 'update' else (None, ())
+
+            if op != 'update' or changed:
+                changes.append(Change(table, op, row_id, values, previous, changed))
+            if op != 'delete':
+                changes.extend(_association_changes(state, mapper, seen))
+
+    return changes
+
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    try:
+        changes = _capture_changes(session)
+    except Exception as e:
+        # Never let change tracking break a write; fall back to a full invalidation
+        logger.error(f"Error capturing data changes: {e}")
+        changes = [Change(table, 'bulk') for table in TRACKED_TABLES]
+
+    if changes:
+        session.info.setdefault(_PENDING_KEY, []).extend(changes)
+
+        for handler in list(_flush_handlers):
+            handler(session, changes)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    _dispatch(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -1,14 +1,19 @@
 import pandas as pd
 import numpy as np
-from sqlalchemy import func, desc
-from app import db
-from models import MedicinalMaterial, Prescription, EfficacyCategory
-import io
-import csv
+from models import MedicinalMaterial, EfficacyCategory
+from material_attributes import material_ids_with
+from repository import Repository
+from db_routing import read_engine
+import data_events
+import search_backend
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Cached dashboard and statistics queries; any committed change invalidates them
+repository = Repository(read_engine)
+data_events.subscribe(repository.apply_changes)
+
 def get_province_statistics():
     """
     Get statistics on the number of medicinal materials produced in each province
@@ -16,14 +21,7 @@ def get_province_statistics():
     Returns:
         dict: Dictionary with province names as keys and counts as values
     """
-    results = db.session.query(
-        MedicinalMaterial.province_origin, 
-        func.count(MedicinalMaterial.id)
-    ).group_by(MedicinalMaterial.province_origin).all()
-    
-    # Convert to dictionary for easier processing
-    province_stats = {province: count for province, count in results if province}
-    return province_stats
+    return repository.distribution('province')
 
 def get_material_usage_frequency():
     """
@@ -32,12 +30,7 @@ def get_material_usage_frequency():
     Returns:
         list: List of dictionaries with material name and usage count
     """
-    results = db.session.query(
-        MedicinalMaterial.name, 
-        MedicinalMaterial.usage_frequency
-    ).order_by(desc(MedicinalMaterial.usage_frequency)).all()
-    
-    return [{"name": name, "value": count} for name, count in results]
+    return [{"name": row['name'], "value": row['usage_frequency']} for row in repository.material_usage()]
 
 def get_property_distribution():
     """
@@ -46,12 +39,7 @@ def get_property_distribution():
     Returns:
         dict: Dictionary with property names as keys and counts as values
     """
-    results = db.session.query(
-        MedicinalMaterial.property,
-        func.count(MedicinalMaterial.id)
-    ).group_by(MedicinalMaterial.property).all()
-    
-    return {prop: count for prop, count in results if prop}
+    return repository.distribution('property')
 
 def get_flavor_distribution():
     """
@@ -60,12 +48,7 @@ def get_flavor_distribution():
     Returns:
         dict: Dictionary with flavor names as keys and counts as values
     """
-    results = db.session.query(
-        MedicinalMaterial.flavor,
-        func.count(MedicinalMaterial.id)
-    ).group_by(MedicinalMaterial.flavor).all()
-    
-    return {flavor: count for flavor, count in results if flavor}
+    return repository.distribution('flavor')
 
 def get_meridian_distribution():
     """
@@ -74,12 +57,7 @@ def get_meridian_distribution():
     Returns:
         dict: Dictionary with meridian names as keys and counts as values
     """
-    results = db.session.query(
-        MedicinalMaterial.meridian,
-        func.count(MedicinalMaterial.id)
-    ).group_by(MedicinalMaterial.meridian).all()
-    
-    return {meridian: count for meridian, count in results if meridian}
+    return repository.distribution('meridian')
 
 def get_top_prescriptions_by_efficacy(efficacy_name, limit=10):
     """
@@ -126,200 +104,54 @@ def get_top_materials_by_efficacy(efficacy_name, limit=10):
     sorted_materials = sorted(material_counts.items(), key=lambda x: x[1], reverse=True)
     return [{"name": name, "count": count} for name, count in sorted_materials[:limit]]
 
-def process_material_upload(file_data):
+def search_prescriptions(query_params, page=1, per_page=search_backend.DEFAULT_PER_PAGE, cursor=None):
     """
-    Process CSV upload for medicinal materials
-    
-    Args:
-        file_data: File-like object containing CSV data
-        
-    Returns:
-        tuple: (success_count, error_count, error_messages)
-    """
-    success_count = 0
-    error_count = 0
-    error_messages = []
-    
-    try:
-        # Convert file data to string and create a StringIO object
-        if isinstance(file_data, bytes):
-            file_data = file_data.decode('utf-8')
-        
-        csv_data = io.StringIO(file_data)
-        reader = csv.DictReader(csv_data)
-        
-        for row in reader:
-            try:
-                # Check if material already exists
-                material = MedicinalMaterial.query.filter_by(name=row.get('name')).first()
-                
-                if material:
-                    # Update existing material
-                    material.pinyin = row.get('pinyin', material.pinyin)
-                    material.english_name = row.get('english_name', material.english_name)
-                    material.province_origin = row.get('province_origin', material.province_origin)
-                    material.property = row.get('property', material.property)
-                    material.flavor = row.get('flavor', material.flavor)
-                    material.meridian = row.get('meridian', material.meridian)
-                    material.description = row.get('description', material.description)
-                else:
-                    # Create new material
-                    material = MedicinalMaterial(
-                        name=row.get('name'),
-                        pinyin=row.get('pinyin'),
-                        english_name=row.get('english_name'),
-                        province_origin=row.get('province_origin'),
-                        property=row.get('property'),
-                        flavor=row.get('flavor'),
-                        meridian=row.get('meridian'),
-                        description=row.get('description'),
-                        usage_frequency=0
-                    )
-                    db.session.add(material)
-                
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                error_messages.append(f"Error on row {success_count + error_count}: {str(e)}")
-        
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        error_count += 1
-        error_messages.append(f"General error: {str(e)}")
+    Search prescriptions based on query parameters
     
-    return success_count, error_count, error_messages
-
-def process_prescription_upload(file_data):
-    """
-    Process CSV upload for prescriptions
+    Uses the trigram / full-text indexes of search_backend where the
+    database has them, and returns the best matches first.
     
     Args:
-        file_data: File-like object containing CSV data
+        query_params (dict): Dictionary of query parameters
+        page (int): 1-based page number
+        per_page (int): Number of results per page
+        cursor (str): next_cursor of the previous page, for keyset paging
         
     Returns:
-        tuple: (success_count, error_count, error_messages)
+        dict: items (matching prescriptions on the page), total, page, per_page, pages, next_cursor
     """
-    success_count = 0
-    error_count = 0
-    error_messages = []
-    
-    try:
-        # Convert file data to string and create a StringIO object
-        if isinstance(file_data, bytes):
-            file_data = file_data.decode('utf-8')
-        
-        csv_data = io.StringIO(file_data)
-        reader = csv.DictReader(csv_data)
-        
-        for row in reader:
-            try:
-                # Check if prescription already exists
-                prescription = Prescription.query.filter_by(name=row.get('name')).first()
-                
-                if not prescription:
-                    # Create new prescription
-                    prescription = Prescription(
-                        name=row.get('name'),
-                        description=row.get('description'),
-                        efficacy=row.get('efficacy'),
-                        evolution_history={}
-                    )
-                    db.session.add(prescription)
-                    db.session.flush()  # To get the prescription ID
-                
-                # Process the materials in this prescription
-                materials_str = row.get('materials', '')
-                if materials_str:
-                    # Assuming materials are in format: "name1:amount1,name2:amount2"
-                    materials_list = materials_str.split(',')
-                    
-                    for material_info in materials_list:
-                        if ':' in material_info:
-                            material_name, amount = material_info.split(':')
-                            material = MedicinalMaterial.query.filter_by(name=material_name.strip()).first()
-                            
-                            if material:
-                                # Check if already in prescription
-                                if material not in prescription.materials:
-                                    prescription.materials.append(material)
-                                    
-                                # Increment usage frequency
-                                material.usage_frequency += 1
-                            else:
-                                error_messages.append(f"Material not found: {material_name}")
-                
-                # Process efficacy categories
-                efficacy_cats = row.get('efficacy_categories', '')
-                if efficacy_cats:
-                    categories = efficacy_cats.split(',')
-                    
-                    for cat_name in categories:
-                        cat_name = cat_name.strip()
-                        category = EfficacyCategory.query.filter_by(name=cat_name).first()
-                        
-                        if not category:
-                            # Create if it doesn't exist
-                            category = EfficacyCategory(name=cat_name)
-                            db.session.add(category)
-                            db.session.flush()
-                        
-                        if category not in prescription.efficacy_categories:
-                            prescription.efficacy_categories.append(category)
-                
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                error_messages.append(f"Error on row {success_count + error_count}: {str(e)}")
-        
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        error_count += 1
-        error_messages.append(f"General error: {str(e)}")
-    
-    return success_count, error_count, error_messages
+    return search_backend.search_prescriptions(query_params, page=page, per_page=per_page, cursor=cursor)
 
-def search_prescriptions(query_params):
+def search_materials(query_params):
     """
-    Search prescriptions based on query parameters
+    Search medicinal materials based on query parameters
+    
+    Flavor and meridian match single values (e.g. 'Lung' matches a material
+    with meridian 'Lung/Spleen') through the indexed junction tables.
     
     Args:
         query_params (dict): Dictionary of query parameters
         
     Returns:
-        list: List of matching prescriptions
+        list: List of matching materials
     """
-    prescription_query = Prescription.query
+    material_query = MedicinalMaterial.query
     
-    # Filter by name if provided
     if query_params.get('name'):
-        prescription_query = prescription_query.filter(
-            Prescription.name.ilike(f"%{query_params['name']}%")
+        material_query = material_query.filter(
+            MedicinalMaterial.name.ilike(f"%{query_params['name']}%")
         )
     
-    # Filter by efficacy if provided
-    if query_params.get('efficacy'):
-        prescription_query = prescription_query.filter(
-            Prescription.efficacy.ilike(f"%{query_params['efficacy']}%")
-        )
+    if query_params.get('property'):
+        material_query = material_query.filter(MedicinalMaterial.property == query_params['property'])
     
-    # Filter by material if provided
-    if query_params.get('material'):
-        material_name = query_params['material']
-        prescription_query = prescription_query.join(
-            Prescription.materials
-        ).filter(
-            MedicinalMaterial.name.ilike(f"%{material_name}%")
-        )
+    if query_params.get('province'):
+        material_query = material_query.filter(MedicinalMaterial.province_origin == query_params['province'])
     
-    # Filter by efficacy category if provided
-    if query_params.get('category'):
-        category_name = query_params['category']
-        prescription_query = prescription_query.join(
-            Prescription.efficacy_categories
-        ).filter(
-            EfficacyCategory.name.ilike(f"%{category_name}%")
-        )
+    for attribute in ('flavor', 'meridian'):
+        if query_params.get(attribute):
+            material_query = material_query.filter(
+                MedicinalMaterial.id.in_(material_ids_with(attribute, query_params[attribute]))
+            )
     
-    return prescription_query.all()
+    return material_query.order_by(MedicinalMaterial.name).all()
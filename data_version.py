@@ -0,0 +1,100 @@
+"""
+Shared data version counter
+
+Every committed change to the prescription data increments the single row
+of the data_version table: ORM writes in the same transaction as the
+change, bulk writes (reported through data_events.notify_bulk_change) in a
+transaction of their own right after. The app module imports this module,
+so every process that writes through it (the web app, the import scripts,
+the maintenance scripts) keeps the counter current, and readers in other
+processes can tell that the data changed (see http_cache and repository).
+"""
+import logging
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from models import DataVersion
+import data_events
+
+logger = logging.getLogger(__name__)
+
+_BUMPED_KEY = 'data_version.bumped'
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+
+def bump_version(connection):
+    """
+    Increment the data version inside a transaction
+
+    Args:
+        connection: Connection of the transaction that changed the data
+
+    Returns:
+        int: The new version
+    """
+    table = DataVersion.__table__
+    now = datetime.now(timezone.utc)
+    result = connection.execute(
+        update(table).where(table.c.id == 1).values(version=table.c.version + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(id=1, version=1, updated_at=now))
+    return connection.execute(select(table.c.version).where(table.c.id == 1)).scalar()
+
+
+def on_local_commit(callback):
+    """
+    Register a callback run with each version committed by this process
+
+    Args:
+        callback (callable): Called with the new version (int)
+    """
+    with _listeners_lock:
+        if callback not in _listeners:
+            _listeners.append(callback)
+
+
+def _committed(version):
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for callback in listeners:
+        try:
+            callback(version)
+        except Exception as e:
+            logger.error(f"Error in data version listener {callback!r}: {e}")
+
+
+def _on_flush(session, changes):
+    # One bump per transaction is enough; the new version becomes visible when it commits
+    if not session.info.get(_BUMPED_KEY):
+        session.info[_BUMPED_KEY] = bump_version(session.connection())
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    version = session.info.pop(_BUMPED_KEY, None)
+    if version is not None:
+        _committed(version)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop(_BUMPED_KEY, None)
+
+
+def _on_commit(changes):
+    # Bulk writes bypass the flush handler; bump in a transaction of our own
+    if any(change.op == 'bulk' and not change.remote for change in changes):
+        with db.engine.begin() as connection:
+            version = bump_version(connection)
+        _committed(version)
+
+
+data_events.on_flush(_on_flush)
+data_events.subscribe(_on_commit)
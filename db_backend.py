@@ -0,0 +1,156 @@
+"""
+Database backend selection and tuning
+
+The app runs on PostgreSQL (DATABASE_URL) or, when no URL is configured, on
+the SQLite file in the instance folder, which needs no network at all and
+suits local development and read-mostly analytics nodes.
+
+SQLite connections are tuned on connect: WAL journaling (readers do not
+block the writer), memory-mapped I/O, a larger page cache, in-memory temp
+tables, a busy timeout instead of immediate "database is locked" errors,
+and foreign key enforcement to match PostgreSQL.
+
+A read replica, or a local SQLite snapshot of the data, can be configured
+next to the primary database; db_routing sends read-only work to it.
+"""
+import logging
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+# SQLite file used when DATABASE_URL is not set, relative to the instance folder
+SQLITE_FILENAME = os.environ.get("SQLITE_FILENAME", "chinese_medicine.db")
+
+# Bytes of the SQLite file mapped into memory
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# SQLite page cache in KiB
+SQLITE_CACHE_KB = int(os.environ.get("SQLITE_CACHE_KB", str(64 * 1024)))
+
+# Milliseconds a connection waits for a lock held by another connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}",
+    f"PRAGMA cache_size = -{SQLITE_CACHE_KB}",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+    "PRAGMA foreign_keys = ON",
+]
+
+# Engine options for PostgreSQL, sized for Neon's connection pooler
+POSTGRES_ENGINE_OPTIONS = {
+    # Connection pooling settings
+    "pool_size": 5,  # Limit pool size for Neon's connection pooler
+    "max_overflow": 10,  # Allow up to 10 overflow connections
+    "pool_timeout": 30,  # Timeout for getting a connection from the pool
+    "pool_recycle": 300,  # Recycle connections every 5 minutes
+    "pool_pre_ping": True,  # Verify connections before using them
+
+    # Connection settings
+    "connect_args": {
+        "connect_timeout": 30,  # Longer timeout for initial connection
+        "keepalives": 1,        # Enable keepalives
+        "keepalives_idle": 30,  # Send keepalive every 30 seconds
+        "keepalives_interval": 10,  # Retry interval
+        "keepalives_count": 5   # Number of retries
+    }
+}
+
+
+def _normalize_url(url):
+    # Some hosts still hand out the scheme SQLAlchemy 1.4 dropped
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def database_url(instance_path):
+    """
+    URL of the database to use
+
+    Args:
+        instance_path (str): Flask instance folder holding the SQLite file
+
+    Returns:
+        str: DATABASE_URL, or the SQLite file in the instance folder if it is not set
+    """
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        return _normalize_url(url)
+
+    os.makedirs(instance_path, exist_ok=True)
+    path = os.path.join(instance_path, SQLITE_FILENAME)
+    logger.info(f"DATABASE_URL is not set, using SQLite database {path}")
+    return f"sqlite:///{path}"
+
+
+def engine_options(url):
+    """
+    SQLAlchemy engine options for a database URL
+
+    Returns:
+        dict: Options for create_engine / SQLALCHEMY_ENGINE_OPTIONS
+    """
+    backend = make_url(url).get_backend_name()
+    if backend == 'postgresql':
+        return {**POSTGRES_ENGINE_OPTIONS, "connect_args": dict(POSTGRES_ENGINE_OPTIONS["connect_args"])}
+    if backend == 'sqlite':
+        return {
+            # Connections are shared with the import worker thread; SQLite serializes writes itself
+            "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
+    return {"pool_pre_ping": True}
+
+
+def replica_bind(instance_path):
+    """
+    Flask-SQLAlchemy bind config of the read replica (see db_routing)
+
+    DATABASE_REPLICA_URL names a replica of the primary database;
+    otherwise DATABASE_REPLICA_SNAPSHOT names a SQLite snapshot file
+    (relative to the instance folder), which is opened read-only.
+
+    Args:
+        instance_path (str): Flask instance folder
+
+    Returns:
+        dict: Bind config with the URL and engine options, or None without a replica
+    """
+    url = os.environ.get("DATABASE_REPLICA_URL")
+    if url:
+        url = _normalize_url(url)
+        return {"url": url, **engine_options(url)}
+
+    snapshot = os.environ.get("DATABASE_REPLICA_SNAPSHOT")
+    if snapshot:
+        path = os.path.join(instance_path, snapshot)
+        url = f"sqlite:///file:{path}?mode=ro&uri=true"
+        # No pooling: a snapshot replaced on disk is picked up by the next connection
+        return {"url": url, **engine_options(url), "poolclass": NullPool}
+
+    return None
+
+
+@event.listens_for(Engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    # Applies to every SQLite engine of the process (the app, Streamlit, scripts)
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            try:
+                cursor.execute(pragma)
+            except sqlite3.Error as e:
+                logger.debug(f"Could not apply {pragma}: {e}")
+    finally:
+        cursor.close()
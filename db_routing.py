@@ -0,0 +1,183 @@
+"""
+Read/write routing of database sessions
+
+db.session runs everything on the primary database (DATABASE_URL), except
+queries made inside using_replica() or a function decorated with
+read_only: those go to the replica configured in db_backend, either a
+replica of the primary (DATABASE_REPLICA_URL) or a read-only SQLite
+snapshot file (DATABASE_REPLICA_SNAPSHOT, written by this module's
+command line). Read-only views, the dashboard and statistics queries and
+model training use it, so analytics load does not compete with imports
+and data entry. Without a replica everything runs on the primary and
+read_only has no effect. Caches that are loaded once per process and then
+only patched by change events (the knowledge graph) load from the primary
+with using_primary(), since nothing would correct a load from a lagging
+replica.
+
+Flushes and INSERT/UPDATE/DELETE statements always go to the primary, even
+inside a read-only block, and once a session has flushed, its reads stay on
+the primary until it is closed (the end of the request), so it reads its
+own writes. Otherwise reads on the replica do not see changes committed
+moments ago on the primary; only use it where slightly stale data is
+acceptable.
+
+Usage:
+    python db_routing.py snapshot.db   # copy the primary database into instance/snapshot.db
+"""
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+# Flask-SQLAlchemy bind key of the replica engine
+REPLICA_BIND_KEY = 'replica'
+
+# Rows copied per INSERT when writing a snapshot
+SNAPSHOT_CHUNK_SIZE = 1000
+
+# Tables left empty in snapshots: account data stays on the primary
+SNAPSHOT_SKIP_TABLES = {'user', 'user_activity'}
+
+# Key in session.info set once the session has written to the primary
+_WROTE_KEY = 'db_routing.wrote'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+class RoutingSession(Session):
+    """
+    Session that sends the reads of read-only blocks to the replica engine
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _use_replica.get() and not self._on_primary(clause):
+            replica = self._db.engines.get(REPLICA_BIND_KEY)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _on_primary(self, clause):
+        return self._flushing or self.info.get(_WROTE_KEY) or isinstance(clause, UpdateBase)
+
+    def close(self):
+        self.info.pop(_WROTE_KEY, None)
+        super().close()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    session.info[_WROTE_KEY] = True
+
+
+@contextmanager
+def using_replica():
+    """Run the queries of db.session in this block on the replica, if there is one"""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+@contextmanager
+def using_primary():
+    """Run the queries of db.session in this block on the primary, even inside a read-only block"""
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def read_only(func):
+    """Decorate a view or loader whose queries may run on the replica"""
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        with using_replica():
+            return func(*args, **kwargs)
+    return decorated_function
+
+
+def read_engine():
+    """
+    Engine for read-only work outside db.session
+
+    Returns:
+        Engine: The replica engine, or the primary one if no replica is configured
+    """
+    from app import db
+
+    replica = db.engines.get(REPLICA_BIND_KEY)
+    return replica if replica is not None else db.engine
+
+
+def write_snapshot(source, path):
+    """
+    Copy the application tables of a database into a new SQLite file
+
+    The file is written next to the target and moved into place when
+    complete, so processes reading the previous snapshot are not disturbed.
+
+    Args:
+        source (Engine): Database to copy
+        path (str): Snapshot file to create or replace
+
+    Returns:
+        int: Number of rows copied
+    """
+    from sqlalchemy import create_engine
+    from app import db
+    import search_backend
+
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    target = create_engine(f"sqlite:///{partial}")
+    copied = 0
+    try:
+        db.metadata.create_all(target)
+        with source.connect() as src, target.begin() as dst:
+            for table in db.metadata.sorted_tables:
+                if table.name in SNAPSHOT_SKIP_TABLES:
+                    continue
+                result = src.execution_options(yield_per=SNAPSHOT_CHUNK_SIZE).execute(table.select())
+                for rows in result.mappings().partitions():
+                    dst.execute(table.insert(), [dict(row) for row in rows])
+                    copied += len(rows)
+                logger.info(f"Copied {table.name}")
+
+            # Search indexes, then a rollback journal so the file can be opened read-only
+            search_backend.install(dst)
+        with target.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode = DELETE")
+    finally:
+        target.dispose()
+
+    os.replace(partial, path)
+    return copied
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python db_routing.py SNAPSHOT_FILE")
+        sys.exit(1)
+
+    from app import app, db
+
+    with app.app_context():
+        path = os.path.join(app.instance_path, sys.argv[1])
+        print(f"Writing snapshot of {db.engine.url.render_as_string(hide_password=True)} to {path}...")
+        copied = write_snapshot(db.engine, path)
+        print(f"Snapshot written with {copied} rows. Set DATABASE_REPLICA_SNAPSHOT={sys.argv[1]} to use it.")
+
+if __name__ == "__main__":
+    main()
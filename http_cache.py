@@ -0,0 +1,172 @@
+"""
+HTTP caching for the read-only JSON APIs
+
+Every committed change to the prescription data, by any process,
+increments the shared data version (see data_version). Responses of
+endpoints decorated with cached_response() are keyed on that version:
+
+- The ETag is derived from the version and the request URL, so a client
+  that sends a matching If-None-Match gets a 304 before the view runs.
+- Response bodies are kept in a small in-process LRU cache per version, so
+  other clients asking for the same URL are served without recomputing.
+
+Because the version lives in the database, it also tells a process when
+another process (an import script, another web worker) has changed the
+data: its in-process caches are then invalidated through
+data_events.notify_remote_change().
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response, request
+from sqlalchemy import select
+
+from app import app, db
+from models import DataVersion
+import data_events
+import data_version
+from db_routing import using_replica
+
+logger = logging.getLogger(__name__)
+
+# Number of responses kept in memory (0 disables the server-side cache)
+RESPONSE_CACHE_SIZE = int(os.environ.get("HTTP_CACHE_SIZE", "256"))
+
+# Cache-Control of cached responses; no-cache makes browsers revalidate with the ETag every time
+CACHE_CONTROL = os.environ.get("HTTP_CACHE_CONTROL", "no-cache")
+
+# Seconds a version read from the database is reused before reading it again
+VERSION_TTL = float(os.environ.get("HTTP_CACHE_VERSION_TTL", "1"))
+
+_lock = threading.Lock()
+_responses = OrderedDict()
+_known_version = None
+_checked = (0.0, 0, None)  # (monotonic time, version, updated_at)
+
+
+def _read_version():
+    # Read where the cached views read, so a lagging replica is never cached under a newer version
+    table = DataVersion.__table__
+    with using_replica():
+        row = db.session.execute(select(table.c.version, table.c.updated_at).where(table.c.id == 1)).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+
+def _observe(version):
+    """Record a version seen in the database; report it if another process made it"""
+    global _known_version
+    with _lock:
+        remote = _known_version is not None and version > _known_version
+        if _known_version is None or version > _known_version:
+            _known_version = version
+    if remote:
+        logger.info(f"Data version {version} was committed by another process; invalidating caches")
+        data_events.notify_remote_change()
+
+
+def current_version():
+    """
+    Current data version, read from the database at most every VERSION_TTL seconds
+
+    Returns:
+        tuple: (version, updated_at)
+    """
+    global _checked
+    checked_at, version, updated_at = _checked
+    if time.monotonic() - checked_at < VERSION_TTL:
+        return version, updated_at
+
+    version, updated_at = _read_version()
+    _checked = (time.monotonic(), version, updated_at)
+    _observe(version)
+    return version, updated_at
+
+
+def _etag(key, version):
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return f"{version}-{digest}"
+
+
+def _cache_key():
+    args = '&'.join(f"{name}={value}" for name, value in sorted(request.args.items(multi=True)))
+    return f"{request.path}?{args}"
+
+
+def cached_response(view):
+    """
+    Decorate a read-only view whose response depends only on its URL and the data
+
+    Responses get a strong ETag, Last-Modified and Cache-Control; requests
+    with a matching If-None-Match get a 304, and successful responses are
+    kept in the in-process cache until the data version changes.
+    """
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        version, updated_at = current_version()
+        key = _cache_key()
+        etag = _etag(key, version)
+
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            with _lock:
+                cached = _responses.get((key, version))
+                if cached is not None:
+                    _responses.move_to_end((key, version))
+
+            if cached is not None:
+                body, mimetype = cached
+                response = app.response_class(body, mimetype=mimetype)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if RESPONSE_CACHE_SIZE > 0 and not response.direct_passthrough:
+                    with _lock:
+                        _responses[(key, version)] = (response.get_data(), response.mimetype)
+                        while len(_responses) > RESPONSE_CACHE_SIZE:
+                            _responses.popitem(last=False)
+
+        response.set_etag(etag)
+        if updated_at is not None:
+            response.last_modified = updated_at
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return response
+    return decorated_function
+
+
+def clear():
+    """Drop all cached responses"""
+    with _lock:
+        _responses.clear()
+
+
+def _local_commit(version):
+    """Record a version committed by this process"""
+    global _known_version, _checked
+    with _lock:
+        previous = _known_version
+        if _known_version is None or version > _known_version:
+            _known_version = version
+        _checked = (0.0, 0, None)
+    if previous is not None and version - 1 > previous:
+        # Versions in between were committed elsewhere
+        data_events.notify_remote_change()
+
+
+data_version.on_local_commit(_local_commit)
+
+
+@app.before_request
+def _check_data_version():
+    # Lets in-process caches notice changes committed by other processes
+    try:
+        current_version()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Could not read the data version: {e}")
@@ -4,6 +4,8 @@ import sys
 from datetime import datetime
 from app import app, db
 from models import MedicinalMaterial, Prescription, EfficacyCategory, DataImport
+import bulk_import
+import data_events
 
 def import_medicinal_materials(file_path):
     """Import medicinal materials from CSV file"""
@@ -93,9 +95,8 @@ def import_prescriptions(file_path):
                             if material_name:
                                 material = MedicinalMaterial.query.filter_by(name=material_name).first()
                                 if material:
-                                    prescription.materials.append(material)
-                                    # Increment usage frequency
-                                    material.usage_frequency += 1
+                                    if material not in prescription.materials:
+                                        prescription.materials.append(material)
                                 else:
                                     error_messages.append(f"Material '{material_name}' not found for prescription '{row['name']}'")
                     
@@ -109,7 +110,8 @@ def import_prescriptions(file_path):
                                 if not category:
                                     category = EfficacyCategory(name=category_name)
                                     db.session.add(category)
-                                prescription.efficacy_categories.append(category)
+                                if category not in prescription.efficacy_categories:
+                                    prescription.efficacy_categories.append(category)
                     
                     db.session.add(prescription)
                     db.session.commit()
@@ -128,6 +130,18 @@ def import_prescriptions(file_path):
         log_import('prescriptions.csv', 'Prescriptions', 0, 1, [error_message])
         return 0, 1, [error_message]
 
+def bulk_import_file(import_func, file_path, filename, import_type):
+    """Run a set-based import from bulk_import and log it"""
+    try:
+        success_count, error_count, error_messages = import_func(file_path)
+    except Exception as e:
+        error_message = f"Error importing file: {str(e)}"
+        log_import(filename, import_type, 0, 1, [error_message])
+        return 0, 1, [error_message]
+    
+    log_import(filename, import_type, success_count, error_count, error_messages)
+    return success_count, error_count, error_messages
+
 def log_import(filename, import_type, success_count, error_count, error_messages):
     """Log the import in the database"""
     status = "success" if error_count == 0 else "partial" if success_count > 0 else "error"
@@ -152,19 +166,32 @@ def log_import(filename, import_type, success_count, error_count, error_messages
 def main():
     with app.app_context():
         # First, clear the existing data if requested
-        if len(sys.argv) > 1 and sys.argv[1] == '--clear':
+        if '--clear' in sys.argv[1:]:
             clear_data()
         
+        # --bulk imports each file with a few set-based statements instead of per-row commits
+        bulk = '--bulk' in sys.argv[1:]
+        
         # Import the data
         materials_path = os.path.join('data', 'medicinal_materials.csv')
         prescriptions_path = os.path.join('data', 'prescriptions.csv')
         
         print("Importing medicinal materials...")
-        m_success, m_error, m_messages = import_medicinal_materials(materials_path)
+        if bulk:
+            m_success, m_error, m_messages = bulk_import_file(
+                bulk_import.import_medicinal_materials, materials_path,
+                'medicinal_materials.csv', 'Medicinal Materials')
+        else:
+            m_success, m_error, m_messages = import_medicinal_materials(materials_path)
         print(f"Successfully imported {m_success} materials with {m_error} errors")
         
         print("Importing prescriptions...")
-        p_success, p_error, p_messages = import_prescriptions(prescriptions_path)
+        if bulk:
+            p_success, p_error, p_messages = bulk_import_file(
+                bulk_import.import_prescriptions, prescriptions_path,
+                'prescriptions.csv', 'Prescriptions')
+        else:
+            p_success, p_error, p_messages = import_prescriptions(prescriptions_path)
         print(f"Successfully imported {p_success} prescriptions with {p_error} errors")
         
         # Print any errors
@@ -194,8 +221,10 @@ def clear_data():
         db.session.execute(db.text('DELETE FROM prescription'))
         db.session.execute(db.text('DELETE FROM efficacy_category'))
         db.session.execute(db.text('DELETE FROM medicinal_material'))
+        db.session.execute(db.text('DELETE FROM material_statistic'))
         
         db.session.commit()
+        data_events.notify_bulk_change(*sorted(data_events.TRACKED_TABLES))
         print("Data cleared successfully")
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,228 @@
+"""
+Background processing of uploaded CSV files
+
+An upload is recorded as a DataImport row with status 'queued' and its
+file is stored in the import_upload table, so a worker on any host can
+read it; the request returns right away. A worker thread claims queued
+jobs one at a time, runs them through import_pipeline and records progress
+and the outcome on the DataImport row. The data_import table is the queue,
+so jobs survive restarts and every web process can run a worker: a job is
+claimed with a conditional UPDATE, so only one worker processes it. While a
+job is processed its updated_at is refreshed periodically, so a long import
+is not mistaken for one whose worker died.
+
+Job statuses: queued -> processing -> success / partial / error
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, update
+
+from app import app, db
+from models import DataImport, ImportUpload
+from import_pipeline import run_upload
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for jobs queued by other processes
+POLL_INTERVAL = float(os.environ.get("IMPORT_JOB_POLL_INTERVAL", "5"))
+
+# Jobs left 'processing' without a heartbeat for longer than this are assumed to have crashed and are queued again
+STALE_AFTER = timedelta(seconds=int(os.environ.get("IMPORT_JOB_STALE_SECONDS", "3600")))
+
+# Seconds between heartbeats (updated_at refreshes) of a job being processed; keep well below STALE_AFTER
+HEARTBEAT_INTERVAL = float(os.environ.get("IMPORT_JOB_HEARTBEAT_SECONDS", "60"))
+
+# Upload kinds accepted by the pipeline
+JOB_KINDS = ('materials', 'prescriptions')
+
+UNFINISHED_STATUSES = ('queued', 'processing')
+
+
+def enqueue_upload(file_data, filename, import_type):
+    """
+    Store an upload and queue it for import
+
+    Args:
+        file_data (bytes): Uploaded file contents
+        filename (str): Original file name
+        import_type (str): 'materials' or 'prescriptions'
+
+    Returns:
+        DataImport: The queued job
+    """
+    if import_type not in JOB_KINDS:
+        raise ValueError(f"Unknown import type: {import_type}")
+
+    job = DataImport(filename=filename, import_type=import_type, rows_imported=0,
+                     rows_processed=0, status='queued')
+    db.session.add(job)
+
+    try:
+        db.session.flush()
+        db.session.add(ImportUpload(import_id=job.id, data=file_data))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    import_worker.wake()
+    return job
+
+
+def job_to_dict(job):
+    """JSON representation of a job for the status API"""
+    return {
+        'id': job.id,
+        'filename': job.filename,
+        'import_type': job.import_type,
+        'status': job.status,
+        'finished': job.status not in UNFINISHED_STATUSES,
+        'rows_processed': job.rows_processed or 0,
+        'rows_imported': job.rows_imported or 0,
+        'errors': job.error_message.split('\n') if job.error_message else [],
+        'created_at': job.import_date.isoformat() if job.import_date else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None
+    }
+
+
+class ImportWorker:
+    """
+    Daemon thread that processes queued import jobs
+
+    The thread is started on the first enqueue_upload() or start() call in
+    each process.
+    """
+    def __init__(self, poll_interval=POLL_INTERVAL, heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker thread if it is not running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='import-worker', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Start the worker if needed and make it look for jobs now"""
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        with app.app_context():
+            while True:
+                # Jobs of workers that died in any process are picked up without a restart
+                self._requeue_stale()
+                try:
+                    while self._process_next():
+                        pass
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error in import worker: {e}")
+                finally:
+                    db.session.remove()
+
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _requeue_stale(self):
+        """Queue jobs again whose worker died while processing them"""
+        cutoff = datetime.now(timezone.utc) - STALE_AFTER
+        try:
+            result = db.session.execute(
+                update(DataImport)
+                .where(DataImport.status == 'processing', DataImport.updated_at < cutoff)
+                .values(status='queued')
+            )
+            db.session.commit()
+            if result.rowcount:
+                logger.warning(f"Queued {result.rowcount} stale import jobs again")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Could not requeue stale import jobs: {e}")
+
+    def _claim(self, job_id):
+        """Mark a queued job as processing; False if another worker got it first"""
+        result = db.session.execute(
+            update(DataImport)
+            .where(DataImport.id == job_id, DataImport.status == 'queued')
+            .values(status='processing', updated_at=datetime.now(timezone.utc))
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _heartbeat(self, job_id, stop):
+        """Refresh updated_at of a processing job until stop is set"""
+        with app.app_context():
+            while not stop.wait(self.heartbeat_interval):
+                try:
+                    # Own transaction: the import itself may hold the session's transaction open
+                    with db.engine.begin() as connection:
+                        connection.execute(
+                            update(DataImport)
+                            .where(DataImport.id == job_id, DataImport.status == 'processing')
+                            .values(updated_at=datetime.now(timezone.utc))
+                        )
+                except Exception as e:
+                    logger.warning(f"Could not record heartbeat of import job {job_id}: {e}")
+
+    def _process_next(self):
+        """Process the oldest queued job; False if there was none"""
+        job_id = db.session.query(DataImport.id).filter_by(status='queued').order_by(DataImport.id).limit(1).scalar()
+        if job_id is None:
+            return False
+        if self._claim(job_id):
+            self.process(job_id)
+        return True
+
+    def process(self, job_id):
+        """
+        Import the stored upload of a claimed job
+
+        Args:
+            job_id (int): DataImport id
+        """
+        job = db.session.get(DataImport, job_id)
+        logger.info(f"Processing import job {job_id} ({job.import_type}, {job.filename})")
+
+        def on_parsed(rows, rejected):
+            job.rows_processed = rows + rejected
+            db.session.commit()
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job_id, stop), name=f'import-heartbeat-{job_id}', daemon=True
+        )
+        heartbeat.start()
+        try:
+            try:
+                upload = db.session.get(ImportUpload, job_id)
+                if upload is None:
+                    raise ValueError("The uploaded file is missing")
+                file_data = upload.data
+                db.session.expunge(upload)
+                success_count, error_count, error_messages = run_upload(file_data, job.import_type, on_parsed)
+            except Exception as e:
+                db.session.rollback()
+                success_count, error_count, error_messages = 0, 1, [f"Error processing file: {str(e)}"]
+
+            job.rows_imported = success_count
+            job.status = "success" if error_count == 0 else "partial" if success_count > 0 else "error"
+            job.error_message = "\n".join(error_messages) if error_messages else None
+            db.session.execute(delete(ImportUpload).where(ImportUpload.import_id == job_id))
+            db.session.commit()
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        logger.info(f"Import job {job_id} finished: {job.status}, {success_count} rows imported")
+
+
+# Shared worker for this process
+import_worker = ImportWorker()
@@ -0,0 +1,278 @@
+"""
+Staged pipeline for CSV uploads
+
+1. Parse and validate: the upload is split into chunks of whole records
+   that are parsed and validated by csv_rows.parse_chunk. Scripts can
+   parse large uploads in a process pool (parallel=True); the web app's
+   import worker parses in its own thread, since forking a process that
+   runs other threads can copy their held locks into the children.
+2. Deduplicate: rows are keyed by name; later rows with the same name are
+   reported and skipped.
+3. Write: all rows are written with set-based statements from bulk_import
+   in a single transaction.
+
+Errors are reported with the line number of the offending row in the
+uploaded file (the header is line 1).
+"""
+import csv
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import bindparam, select
+
+from app import db
+from models import MedicinalMaterial, Prescription, prescription_material, prescription_efficacy
+import bulk_import
+import csv_rows
+import data_events
+
+logger = logging.getLogger(__name__)
+
+# Lines per parse chunk
+CHUNK_LINES = int(os.environ.get("IMPORT_CHUNK_LINES", "5000"))
+
+# Uploads smaller than this are parsed in the calling thread even when parallel parsing is requested
+PARALLEL_MIN_BYTES = int(os.environ.get("IMPORT_PARALLEL_MIN_BYTES", str(1024 * 1024)))
+
+# Worker processes for parsing (0 disables the pool)
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Shared process pool, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Never fork: the parent may run other threads holding locks. Workers only
+            # import csv_rows, which has no app or database state.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _executor = ProcessPoolExecutor(max_workers=IMPORT_WORKERS, mp_context=context)
+        return _executor
+
+
+def parse_upload(file_data, kind, parallel=False):
+    """
+    Parse and validate an uploaded CSV file
+
+    Args:
+        file_data (bytes or str): Uploaded file contents
+        kind (str): 'materials' or 'prescriptions'
+        parallel (bool): Parse large uploads in the process pool
+
+    Returns:
+        tuple: (list of (line number, values), list of (line number, error message)),
+            both in file order
+    """
+    if isinstance(file_data, bytes):
+        file_data = file_data.decode('utf-8-sig')
+
+    header_line, _, body = file_data.partition('\n')
+    header = [column.strip() for column in next(csv.reader([header_line]), [])]
+    if 'name' not in header:
+        return [], [(1, "The header must contain a 'name' column")]
+
+    # Data starts on line 2
+    chunks = [(kind, header, start + 2, text) for start, text in csv_rows.split_lines(body, CHUNK_LINES)]
+
+    if parallel and len(file_data) >= PARALLEL_MIN_BYTES and IMPORT_WORKERS > 0 and len(chunks) > 1:
+        results = _get_executor().map(csv_rows.parse_chunk, *zip(*chunks))
+    else:
+        results = (csv_rows.parse_chunk(*chunk) for chunk in chunks)
+
+    rows = []
+    errors = []
+    for chunk_rows, chunk_errors in results:
+        rows.extend(chunk_rows)
+        errors.extend(chunk_errors)
+    return rows, errors
+
+
+def deduplicate(rows):
+    """
+    Keep the first row for every name
+
+    Returns:
+        tuple: (unique rows, list of (line number, error message))
+    """
+    first_lines = {}
+    unique = []
+    errors = []
+    for line, values in rows:
+        name = values['name']
+        if name in first_lines:
+            errors.append((line, f"'{name}' is a duplicate of line {first_lines[name]}"))
+        else:
+            first_lines[name] = line
+            unique.append((line, values))
+    return unique, errors
+
+
+def write_materials(rows):
+    """
+    Insert new materials and update existing ones
+
+    Only the columns present in the upload are updated on existing materials.
+
+    Args:
+        rows (list): (line number, values) tuples from validate_material
+
+    Returns:
+        set: Ids of the written materials
+    """
+    table = MedicinalMaterial.__table__
+    existing = bulk_import.load_name_map(MedicinalMaterial, [values['name'] for _, values in rows])
+
+    new_rows = [dict({c: None for c in csv_rows.MATERIAL_COLUMNS}, **values, usage_frequency=0)
+                for _, values in rows if values['name'] not in existing]
+    if new_rows:
+        bulk_import.execute_many(bulk_import.insert_ignore(table, ['name']), new_rows)
+
+    # Group updates by the set of columns they carry so each group is one executemany
+    updates = {}
+    for _, values in rows:
+        if values['name'] in existing:
+            columns = tuple(sorted(column for column in values if column != 'name'))
+            if columns:
+                params = {f"v_{column}": values[column] for column in columns}
+                params['b_name'] = values['name']
+                updates.setdefault(columns, []).append(params)
+
+    for columns, params in updates.items():
+        statement = table.update().where(table.c.name == bindparam('b_name')).values(
+            {column: bindparam(f"v_{column}") for column in columns}
+        )
+        bulk_import.execute_many(statement, params)
+
+    return set(bulk_import.load_name_map(MedicinalMaterial, [values['name'] for _, values in rows]).values())
+
+
+def write_prescriptions(rows):
+    """
+    Insert new prescriptions and add missing material and category links
+
+    Existing prescriptions keep their description and efficacy; materials
+    and categories listed for them are added if they are not linked yet.
+
+    Args:
+        rows (list): (line number, values) tuples from validate_prescription
+
+    Returns:
+        tuple: (list of (line number, warning message), set of touched material ids)
+    """
+    names = [values['name'] for _, values in rows]
+    existing = bulk_import.load_name_map(Prescription, names)
+
+    new_rows = [{
+        'name': values['name'],
+        'description': values['description'],
+        'efficacy': values['efficacy'],
+        'evolution_history': {}
+    } for _, values in rows if values['name'] not in existing]
+    if new_rows:
+        bulk_import.execute_many(bulk_import.insert_ignore(Prescription.__table__, ['name']), new_rows)
+    prescription_ids = bulk_import.load_name_map(Prescription, names)
+
+    material_ids = bulk_import.load_name_map(
+        MedicinalMaterial, [material[0] for _, values in rows for material in values['materials']]
+    )
+    category_ids = bulk_import.ensure_categories(
+        category for _, values in rows for category in values['categories']
+    )
+
+    # Links that already exist for the uploaded prescriptions, one query per table
+    ids = list(prescription_ids.values())
+    pm = prescription_material.c
+    pe = prescription_efficacy.c
+    linked_materials = set()
+    linked_categories = set()
+    for chunk in bulk_import.chunked(ids):
+        linked_materials.update(db.session.execute(
+            select(pm.prescription_id, pm.material_id).where(pm.prescription_id.in_(chunk))
+        ).all())
+        linked_categories.update(db.session.execute(
+            select(pe.prescription_id, pe.efficacy_category_id).where(pe.prescription_id.in_(chunk))
+        ).all())
+
+    warnings = []
+    material_links = []
+    category_links = []
+    touched = set()
+    for line, values in rows:
+        prescription_id = prescription_ids.get(values['name'])
+        if prescription_id is None:
+            warnings.append((line, f"Prescription '{values['name']}' could not be saved"))
+            continue
+
+        for material_name, amount, unit in values['materials']:
+            material_id = material_ids.get(material_name)
+            if material_id is None:
+                warnings.append((line, f"Material not found: {material_name}"))
+            elif (prescription_id, material_id) not in linked_materials:
+                linked_materials.add((prescription_id, material_id))
+                material_links.append({'prescription_id': prescription_id, 'material_id': material_id,
+                                       'amount': amount, 'unit': unit})
+                touched.add(material_id)
+
+        for category in values['categories']:
+            key = (prescription_id, category_ids[category])
+            if key not in linked_categories:
+                linked_categories.add(key)
+                category_links.append({'prescription_id': key[0], 'efficacy_category_id': key[1]})
+
+    if material_links:
+        bulk_import.execute_many(prescription_material.insert(), material_links)
+    if category_links:
+        bulk_import.execute_many(prescription_efficacy.insert(), category_links)
+
+    return warnings, touched
+
+
+def run_upload(file_data, kind, on_parsed=None, parallel=False):
+    """
+    Parse, validate, deduplicate and write an uploaded CSV file
+
+    Args:
+        file_data (bytes or str): Uploaded file contents
+        kind (str): 'materials' or 'prescriptions'
+        on_parsed (callable, optional): Called with (rows to write, rejected rows)
+            before the write stage starts; it may commit the session
+        parallel (bool): Parse large uploads in a process pool (for scripts only)
+
+    Returns:
+        tuple: (success_count, error_count, error_messages)
+    """
+    rows, errors = parse_upload(file_data, kind, parallel)
+    rows, duplicate_errors = deduplicate(rows)
+    errors.extend(duplicate_errors)
+    warnings = []
+
+    if on_parsed is not None:
+        on_parsed(len(rows), len(errors))
+
+    if rows:
+        try:
+            if kind == 'materials':
+                write_materials(rows)
+                tables = ('medicinal_material',)
+            else:
+                warnings, touched = write_prescriptions(rows)
+                bulk_import.recompute_usage_frequency(touched)
+                tables = bulk_import.PRESCRIPTION_TABLES
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error writing {kind} upload: {e}")
+            return 0, len(errors) + 1, [f"Line {line}: {message}" for line, message in sorted(errors)] + [
+                f"General error: {str(e)}"
+            ]
+        data_events.notify_bulk_change(*tables)
+
+    messages = [f"Line {line}: {message}" for line, message in sorted(errors + warnings)]
+    return len(rows), len(errors), messages
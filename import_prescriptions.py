@@ -3,6 +3,7 @@ import os
 from datetime import datetime
 from app import app, db
 from models import MedicinalMaterial, Prescription, EfficacyCategory, DataImport
+import material_usage  # noqa: F401  (keeps usage_frequency in step with new links)
 
 def import_prescriptions(file_path):
     """Import prescriptions from CSV file"""
@@ -44,9 +45,8 @@ def import_prescriptions(file_path):
                             if material_name:
                                 material = MedicinalMaterial.query.filter_by(name=material_name).first()
                                 if material:
-                                    prescription.materials.append(material)
-                                    # Increment usage frequency
-                                    material.usage_frequency += 1
+                                    if material not in prescription.materials:
+                                        prescription.materials.append(material)
                                 else:
                                     error_messages.append(f"Material '{material_name}' not found for prescription '{row['name']}'")
                     
@@ -60,7 +60,8 @@ def import_prescriptions(file_path):
                                 if not category:
                                     category = EfficacyCategory(name=category_name)
                                     db.session.add(category)
-                                prescription.efficacy_categories.append(category)
+                                if category not in prescription.efficacy_categories:
+                                    prescription.efficacy_categories.append(category)
                     
                     db.session.add(prescription)
                     db.session.commit()
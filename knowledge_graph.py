@@ -1,218 +1,732 @@
-import networkx as nx
-import json
+import logging
+import threading
+from collections import Counter
 from app import db
-from models import MedicinalMaterial, Prescription, MaterialInteraction
+from models import MedicinalMaterial, Prescription, MaterialInteraction, prescription_material
+import data_events
+from db_routing import using_primary
+
+logger = logging.getLogger(__name__)
+
+# Tables the knowledge graph is derived from, in the order their changes are applied
+# (edges can only be added once both of their nodes exist)
+GRAPH_TABLES = {
+    'medicinal_material': 0,
+    'prescription': 0,
+    'prescription_material': 1,
+    'material_interaction': 1
+}
+
+
+def _material_node(material_id, values):
+    return {
+        'id': f"m_{material_id}",
+        'name': values.get('name'),
+        'type': 'material',
+        'property': values.get('property') or '',
+        'flavor': values.get('flavor') or '',
+        'meridian': values.get('meridian') or ''
+    }
+
+
+def _prescription_node(prescription_id, values):
+    return {
+        'id': f"p_{prescription_id}",
+        'name': values.get('name'),
+        'type': 'prescription',
+        'efficacy': values.get('efficacy') or ''
+    }
+
+
+def _edge_key(a, b):
+    """Undirected key for the edge between two node ids"""
+    return (a, b) if a <= b else (b, a)
+
+
+class KnowledgeGraphStore:
+    """
+    Process-level knowledge graph of materials, prescriptions and interactions
+
+    The graph is loaded from the database on first use and then patched in
+    place from the change notifications published by data_events, so reads
+    do not touch the database. Node and link dicts are never mutated once
+    published; patches replace them, which keeps previously returned
+    snapshots consistent. Writes made by other processes are not seen
+    until invalidate() is called.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._nodes = None          # node id -> node dict
+        self._links = {}            # edge key -> link dict
+        self._adjacency = {}        # node id -> set of neighbor node ids
+        self._interaction_edges = {}  # interaction id -> edge key
+        self._snapshot = None
+
+    @property
+    def is_loaded(self):
+        return self._nodes is not None
+
+    def invalidate(self):
+        """Drop the in-memory graph so the next read reloads it"""
+        with self._lock:
+            self._nodes = None
+            self._links = {}
+            self._adjacency = {}
+            self._interaction_edges = {}
+            self._snapshot = None
+
+    def get_graph(self):
+        """
+        Get the full graph, loading it from the database if needed
+
+        Returns:
+            dict: Graph data with 'nodes' and 'links' lists
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if self._snapshot is None:
+                self._snapshot = {
+                    'nodes': list(self._nodes.values()),
+                    'links': list(self._links.values())
+                }
+            return self._snapshot
+
+    def _ensure_loaded(self):
+        if self._nodes is None:
+            # From the primary even in read-only views: the graph lives as long as the
+            # process and is only patched by later changes, so a lagging load would stay stale
+            with using_primary():
+                self._load()
+
+    def _load(self):
+        """Load the whole graph with one query per table"""
+        self._nodes = {}
+        self._links = {}
+        self._adjacency = {}
+        self._interaction_edges = {}
+        self._snapshot = None
+
+        materials = db.session.query(
+            MedicinalMaterial.id, MedicinalMaterial.name, MedicinalMaterial.property,
+            MedicinalMaterial.flavor, MedicinalMaterial.meridian
+        ).all()
+        for row in materials:
+            self._put_node(_material_node(row.id, row._mapping))
+
+        prescriptions = db.session.query(
+            Prescription.id, Prescription.name, Prescription.efficacy
+        ).all()
+        for row in prescriptions:
+            self._put_node(_prescription_node(row.id, row._mapping))
+
+        contains = db.session.query(
+            prescription_material.c.prescription_id, prescription_material.c.material_id
+        ).all()
+        for prescription_id, material_id in contains:
+            self._put_contains(prescription_id, material_id)
+
+        interactions = db.session.query(
+            MaterialInteraction.id, MaterialInteraction.material1_id, MaterialInteraction.material2_id,
+            MaterialInteraction.interaction_type, MaterialInteraction.description
+        ).all()
+        for row in interactions:
+            self._put_interaction(row.id, row._mapping)
+
+        logger.info(f"Knowledge graph loaded with {len(self._nodes)} nodes and {len(self._links)} links")
+
+    def _put_node(self, node):
+        self._nodes[node['id']] = node
+        self._adjacency.setdefault(node['id'], set())
+
+    def _remove_node(self, node_id):
+        if node_id not in self._nodes:
+            return
+        del self._nodes[node_id]
+        for neighbor in self._adjacency.pop(node_id, set()):
+            self._links.pop(_edge_key(node_id, neighbor), None)
+            self._adjacency.get(neighbor, set()).discard(node_id)
+
+    def _put_link(self, source, target, link_type, description=''):
+        # Skip dangling edges, e.g. rows referencing a deleted material
+        if source not in self._nodes or target not in self._nodes:
+            return
+        self._links[_edge_key(source, target)] = {
+            'source': source,
+            'target': target,
+            'type': link_type or '',
+            'description': description or ''
+        }
+        self._adjacency[source].add(target)
+        self._adjacency[target].add(source)
+
+    def _remove_link(self, source, target):
+        if self._links.pop(_edge_key(source, target), None) is not None:
+            self._adjacency.get(source, set()).discard(target)
+            self._adjacency.get(target, set()).discard(source)
+
+    def _put_contains(self, prescription_id, material_id):
+        self._put_link(f"p_{prescription_id}", f"m_{material_id}", 'contains')
+
+    def _put_interaction(self, interaction_id, values):
+        source = f"m_{values['material1_id']}"
+        target = f"m_{values['material2_id']}"
+        self._put_link(source, target, values.get('interaction_type'), values.get('description'))
+        self._interaction_edges[interaction_id] = _edge_key(source, target)
+
+    def _remove_interaction(self, interaction_id):
+        key = self._interaction_edges.pop(interaction_id, None)
+        # Another interaction may have replaced the link for the same pair
+        if key is not None and key not in self._interaction_edges.values():
+            self._remove_link(*key)
+
+    def neighborhood(self, center, hops=1, edge_types=None, max_nodes=None, induced=False):
+        """
+        Get the k-hop neighborhood of a node from the adjacency index
+
+        See get_neighborhood() for the arguments.
+
+        Returns:
+            dict: Subgraph data
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if center not in self._nodes:
+                return {'nodes': [], 'links': []}
+
+            def expand(frontier):
+                for node in frontier:
+                    for neighbor in self._adjacency.get(node, ()):
+                        yield self._links[_edge_key(node, neighbor)]
+
+            order, links = _expand_neighborhood(center, hops, edge_types, max_nodes, expand)
+            if induced:
+                included = set(order)
+                for node in order:
+                    for neighbor in self._adjacency.get(node, ()):
+                        if neighbor in included:
+                            key = _edge_key(node, neighbor)
+                            links[key] = self._links[key]
+
+            return {
+                'nodes': [self._nodes[node] for node in order],
+                'links': list(links.values())
+            }
+
+    def apply_changes(self, changes):
+        """
+        Patch the graph with committed changes
+
+        Args:
+            changes (list): data_events.Change objects
+        """
+        with self._lock:
+            if self._nodes is None:
+                return
+
+            changes = sorted(
+                (change for change in changes if change.table in GRAPH_TABLES),
+                key=lambda change: GRAPH_TABLES[change.table]
+            )
+            for change in changes:
+                if change.op == 'bulk':
+                    self.invalidate()
+                    return
+                self._apply_change(change)
+
+            self._snapshot = None
+
+    def _apply_change(self, change):
+        if change.table == 'medicinal_material':
+            node_id = f"m_{change.row_id}"
+            if change.op == 'delete':
+                self._remove_node(node_id)
+            else:
+                values = dict(self._nodes.get(node_id, {}))
+                values.update(change.values)
+                self._put_node(_material_node(change.row_id, values))
+
+        elif change.table == 'prescription':
+            node_id = f"p_{change.row_id}"
+            if change.op == 'delete':
+                self._remove_node(node_id)
+            else:
+                values = dict(self._nodes.get(node_id, {}))
+                values.update(change.values)
+                self._put_node(_prescription_node(change.row_id, values))
+
+        elif change.table == 'prescription_material':
+            prescription_id = change.values.get('prescription_id')
+            material_id = change.values.get('material_id')
+            if change.op == 'delete':
+                self._remove_link(f"p_{prescription_id}", f"m_{material_id}")
+            else:
+                self._put_contains(prescription_id, material_id)
+
+        elif change.table == 'material_interaction':
+            if change.op in ('update', 'delete'):
+                self._remove_interaction(change.row_id)
+            if change.op != 'delete':
+                values = dict(change.previous)
+                values.update(change.values)
+                if values.get('material1_id') is not None and values.get('material2_id') is not None:
+                    self._put_interaction(change.row_id, values)
+
+
+# Shared graph for this process, kept current by committed changes
+graph_store = KnowledgeGraphStore()
+data_events.subscribe(graph_store.apply_changes)
+
 
 def build_knowledge_graph():
     """
     Build a knowledge graph of Chinese medicine materials and prescriptions
-    
+
+    The graph is served from the process-level graph store, which is only
+    loaded from the database on first use.
+
     Returns:
         dict: Graph data in a format suitable for visualization
     """
-    # Create a NetworkX graph
-    G = nx.Graph()
-    
-    # Add nodes for materials
-    materials = MedicinalMaterial.query.all()
-    for material in materials:
-        G.add_node(f"m_{material.id}", 
-                  name=material.name,
-                  type="material",
-                  property=material.property,
-                  flavor=material.flavor,
-                  meridian=material.meridian)
-    
-    # Add nodes for prescriptions
-    prescriptions = Prescription.query.all()
-    for prescription in prescriptions:
-        G.add_node(f"p_{prescription.id}", 
-                  name=prescription.name,
-                  type="prescription",
-                  efficacy=prescription.efficacy)
-    
-    # Add edges between prescriptions and materials
-    for prescription in prescriptions:
-        for material in prescription.materials:
-            G.add_edge(f"p_{prescription.id}", f"m_{material.id}", type="contains")
-    
-    # Add edges between materials (interactions)
-    interactions = MaterialInteraction.query.all()
-    for interaction in interactions:
-        G.add_edge(f"m_{interaction.material1_id}", 
-                  f"m_{interaction.material2_id}", 
-                  type=interaction.interaction_type,
-                  description=interaction.description)
-    
-    # Convert to a format suitable for visualization (D3.js)
-    nodes = []
-    for node, data in G.nodes(data=True):
-        node_type = data['type']
-        node_data = {
-            'id': node,
-            'name': data['name'],
-            'type': node_type
-        }
-        
-        # Add type-specific attributes
-        if node_type == 'material':
-            node_data.update({
-                'property': data.get('property', ''),
-                'flavor': data.get('flavor', ''),
-                'meridian': data.get('meridian', '')
-            })
-        elif node_type == 'prescription':
-            node_data.update({
-                'efficacy': data.get('efficacy', '')
-            })
-        
-        nodes.append(node_data)
-    
+    return graph_store.get_graph()
+
+def _expand_neighborhood(center, hops, edge_types, max_nodes, expand):
+    """
+    Breadth-first expansion shared by the in-memory and SQL neighborhood lookups
+
+    Args:
+        center (str): Node id to start from
+        hops (int): Number of hops to expand
+        edge_types (set): Allowed link types, or None for all
+        max_nodes (int): Maximum number of nodes to include, or None
+        expand (callable): Returns the links incident to a set of frontier nodes
+
+    Returns:
+        tuple: (list of node ids in discovery order, dict of edge key -> link)
+    """
+    included = {center}
+    order = [center]
+    links = {}
+
+    frontier = {center}
+    for _ in range(hops):
+        if not frontier:
+            break
+
+        next_frontier = set()
+        # Sort so that node caps keep the same neighbors whichever backend is used
+        for link in sorted(expand(frontier), key=lambda link: (link['source'], link['target'])):
+            if edge_types and link['type'] not in edge_types:
+                continue
+
+            source, target = link['source'], link['target']
+            for node, neighbor in ((source, target), (target, source)):
+                if node not in frontier:
+                    continue
+                if neighbor not in included:
+                    if max_nodes and len(included) >= max_nodes:
+                        continue
+                    included.add(neighbor)
+                    order.append(neighbor)
+                    next_frontier.add(neighbor)
+                links[_edge_key(source, target)] = link
+
+        frontier = next_frontier
+
+    return order, links
+
+
+def _split_node_ids(node_ids):
+    """Split 'm_<id>' / 'p_<id>' node ids into material and prescription ids"""
+    material_ids, prescription_ids = set(), set()
+    for node_id in node_ids:
+        prefix, _, raw_id = node_id.partition('_')
+        if prefix == 'm':
+            material_ids.add(int(raw_id))
+        elif prefix == 'p':
+            prescription_ids.add(int(raw_id))
+    return material_ids, prescription_ids
+
+
+def _contains_link(prescription_id, material_id):
+    return {
+        'source': f"p_{prescription_id}",
+        'target': f"m_{material_id}",
+        'type': 'contains',
+        'description': ''
+    }
+
+
+def _interaction_link(row):
+    return {
+        'source': f"m_{row.material1_id}",
+        'target': f"m_{row.material2_id}",
+        'type': row.interaction_type or '',
+        'description': row.description or ''
+    }
+
+
+def _query_incident_links(frontier, edge_types=None):
+    """Links incident to the frontier nodes, read with targeted queries on the edge tables"""
+    material_ids, prescription_ids = _split_node_ids(frontier)
     links = []
-    for source, target, data in G.edges(data=True):
-        links.append({
-            'source': source,
-            'target': target,
-            'type': data.get('type', ''),
-            'description': data.get('description', '')
-        })
-    
+
+    if not edge_types or 'contains' in edge_types:
+        pm = prescription_material.c
+        conditions = []
+        if prescription_ids:
+            conditions.append(pm.prescription_id.in_(prescription_ids))
+        if material_ids:
+            conditions.append(pm.material_id.in_(material_ids))
+        if conditions:
+            rows = db.session.query(pm.prescription_id, pm.material_id).filter(db.or_(*conditions)).all()
+            links.extend(_contains_link(p_id, m_id) for p_id, m_id in rows)
+
+    interaction_types = set(edge_types or ()) - {'contains'}
+    if material_ids and (not edge_types or interaction_types):
+        query = db.session.query(
+            MaterialInteraction.material1_id, MaterialInteraction.material2_id,
+            MaterialInteraction.interaction_type, MaterialInteraction.description
+        ).filter(db.or_(
+            MaterialInteraction.material1_id.in_(material_ids),
+            MaterialInteraction.material2_id.in_(material_ids)
+        ))
+        if interaction_types:
+            query = query.filter(MaterialInteraction.interaction_type.in_(interaction_types))
+        links.extend(_interaction_link(row) for row in query.all())
+
+    return links
+
+
+def _query_links_between(node_ids):
+    """All links whose endpoints are both in node_ids"""
+    material_ids, prescription_ids = _split_node_ids(node_ids)
+    links = []
+
+    if material_ids and prescription_ids:
+        pm = prescription_material.c
+        rows = db.session.query(pm.prescription_id, pm.material_id).filter(
+            pm.prescription_id.in_(prescription_ids),
+            pm.material_id.in_(material_ids)
+        ).all()
+        links.extend(_contains_link(p_id, m_id) for p_id, m_id in rows)
+
+    if len(material_ids) > 1:
+        rows = db.session.query(
+            MaterialInteraction.material1_id, MaterialInteraction.material2_id,
+            MaterialInteraction.interaction_type, MaterialInteraction.description
+        ).filter(
+            MaterialInteraction.material1_id.in_(material_ids),
+            MaterialInteraction.material2_id.in_(material_ids)
+        ).all()
+        links.extend(_interaction_link(row) for row in rows)
+
+    return links
+
+
+def _query_nodes(node_ids):
+    """Node dicts for the given node ids, keyed by node id"""
+    material_ids, prescription_ids = _split_node_ids(node_ids)
+    nodes = {}
+
+    if material_ids:
+        rows = db.session.query(
+            MedicinalMaterial.id, MedicinalMaterial.name, MedicinalMaterial.property,
+            MedicinalMaterial.flavor, MedicinalMaterial.meridian
+        ).filter(MedicinalMaterial.id.in_(material_ids)).all()
+        for row in rows:
+            node = _material_node(row.id, row._mapping)
+            nodes[node['id']] = node
+
+    if prescription_ids:
+        rows = db.session.query(
+            Prescription.id, Prescription.name, Prescription.efficacy
+        ).filter(Prescription.id.in_(prescription_ids)).all()
+        for row in rows:
+            node = _prescription_node(row.id, row._mapping)
+            nodes[node['id']] = node
+
+    return nodes
+
+
+def get_neighborhood(node_id, hops=1, edge_types=None, max_nodes=None, induced=False):
+    """
+    Get the k-hop neighborhood of a node
+
+    Uses the adjacency index of the in-memory graph store when it is loaded,
+    otherwise targeted queries on prescription_material and material_interaction,
+    so the cost scales with the size of the neighborhood rather than the database.
+
+    Args:
+        node_id (str): Node id of the center, e.g. 'm_12' or 'p_3'
+        hops (int): Number of hops to expand
+        edge_types (iterable, optional): Link types to follow ('contains' or an interaction type)
+        max_nodes (int, optional): Maximum number of nodes in the result
+        induced (bool): Also include every link between the collected nodes
+
+    Returns:
+        dict: Subgraph data
+    """
+    edge_types = set(edge_types) if edge_types else None
+
+    if graph_store.is_loaded:
+        return graph_store.neighborhood(node_id, hops, edge_types, max_nodes, induced)
+
+    center = _query_nodes([node_id]).get(node_id)
+    if center is None:
+        return {'nodes': [], 'links': []}
+
+    order, links = _expand_neighborhood(
+        node_id, hops, edge_types, max_nodes,
+        lambda frontier: _query_incident_links(frontier, edge_types)
+    )
+    if induced:
+        for link in _query_links_between(order):
+            links[_edge_key(link['source'], link['target'])] = link
+
+    nodes = _query_nodes(order[1:])
+    nodes[node_id] = center
     return {
-        'nodes': nodes,
-        'links': links
+        'nodes': [nodes[n] for n in order if n in nodes],
+        'links': list(links.values())
     }
 
-def get_material_subgraph(material_id):
+
+def get_material_subgraph(material_id, hops=1, edge_types=None, max_nodes=None):
     """
     Get a subgraph centered on a specific material
     
     Args:
         material_id (int): ID of the material
+        hops (int): Number of hops to expand
+        edge_types (iterable, optional): Link types to follow
+        max_nodes (int, optional): Maximum number of nodes in the result
         
     Returns:
         dict: Subgraph data
     """
-    # Get the full graph
-    full_graph = build_knowledge_graph()
-    
-    # Find the material node
-    material_node_id = f"m_{material_id}"
-    
-    # Create a new graph with just the material and its immediate connections
-    nodes = []
-    links = []
-    
-    # Find the material node
-    material_node = None
-    for node in full_graph['nodes']:
-        if node['id'] == material_node_id:
-            material_node = node
-            nodes.append(node)
-            break
-    
-    if not material_node:
-        return {'nodes': [], 'links': []}
-    
-    # Find immediate connections
-    connected_node_ids = set()
-    for link in full_graph['links']:
-        if link['source'] == material_node_id:
-            connected_node_ids.add(link['target'])
-            links.append(link)
-        elif link['target'] == material_node_id:
-            connected_node_ids.add(link['source'])
-            links.append(link)
-    
-    # Add connected nodes
-    for node in full_graph['nodes']:
-        if node['id'] in connected_node_ids:
-            nodes.append(node)
-    
-    return {
-        'nodes': nodes,
-        'links': links
-    }
+    return get_neighborhood(f"m_{material_id}", hops, edge_types, max_nodes)
 
-def get_prescription_subgraph(prescription_id):
+def get_prescription_subgraph(prescription_id, max_nodes=None):
     """
     Get a subgraph centered on a specific prescription
+
+    Contains the prescription, its materials and the interactions between them.
     
     Args:
         prescription_id (int): ID of the prescription
+        max_nodes (int, optional): Maximum number of nodes in the result
         
     Returns:
         dict: Subgraph data
     """
-    # Get the full graph
-    full_graph = build_knowledge_graph()
-    
-    # Find the prescription node
-    prescription_node_id = f"p_{prescription_id}"
-    
-    # Create a new graph with just the prescription and its materials
-    nodes = []
-    links = []
-    
-    # Find the prescription node
-    prescription_node = None
-    for node in full_graph['nodes']:
-        if node['id'] == prescription_node_id:
-            prescription_node = node
-            nodes.append(node)
-            break
-    
-    if not prescription_node:
-        return {'nodes': [], 'links': []}
-    
-    # Find materials in this prescription
-    material_node_ids = set()
-    for link in full_graph['links']:
-        if link['source'] == prescription_node_id and link['type'] == 'contains':
-            material_node_ids.add(link['target'])
-            links.append(link)
-        elif link['target'] == prescription_node_id and link['type'] == 'contains':
-            material_node_ids.add(link['source'])
-            links.append(link)
-    
-    # Add material nodes
-    for node in full_graph['nodes']:
-        if node['id'] in material_node_ids:
-            nodes.append(node)
-    
-    # Add interactions between materials
-    for link in full_graph['links']:
-        if (link['source'] in material_node_ids and link['target'] in material_node_ids):
-            links.append(link)
-    
-    return {
-        'nodes': nodes,
-        'links': links
-    }
+    return get_neighborhood(f"p_{prescription_id}", 1, {'contains'}, max_nodes, induced=True)
+
+class PrescriptionIndex:
+    """
+    Inverted index from material id to the ids of the prescriptions containing it
+
+    Loaded from prescription_material with a single query on first use and
+    patched from data_events notifications, like the graph store.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = None       # material id -> set of prescription ids
+        self._materials_of = {}     # prescription id -> set of material ids
+
+    @property
+    def is_loaded(self):
+        return self._postings is not None
 
-def get_related_prescriptions(material_ids):
+    def invalidate(self):
+        """Drop the index so the next lookup reloads it"""
+        with self._lock:
+            self._postings = None
+            self._materials_of = {}
+
+    def _ensure_loaded(self):
+        if self._postings is not None:
+            return
+
+        self._postings = {}
+        self._materials_of = {}
+        # From the primary, like the graph store
+        with using_primary():
+            rows = db.session.query(
+                prescription_material.c.material_id, prescription_material.c.prescription_id
+            ).all()
+        for material_id, prescription_id in rows:
+            self._add(material_id, prescription_id)
+
+    def _add(self, material_id, prescription_id):
+        if material_id is None or prescription_id is None:
+            return
+        self._postings.setdefault(material_id, set()).add(prescription_id)
+        self._materials_of.setdefault(prescription_id, set()).add(material_id)
+
+    def _remove(self, material_id, prescription_id):
+        self._postings.get(material_id, set()).discard(prescription_id)
+        self._materials_of.get(prescription_id, set()).discard(material_id)
+
+    def find(self, material_ids, min_matches=None):
+        """
+        Find prescriptions containing at least min_matches of the given materials
+
+        Args:
+            material_ids (iterable): Material IDs to look for
+            min_matches (int, optional): Required number of matching materials,
+                defaults to all of them
+
+        Returns:
+            list: Matching prescription IDs, best matches first, then by ID
+        """
+        material_ids = set(material_ids)
+        if not material_ids:
+            return []
+        required = len(material_ids) if min_matches is None else max(min_matches, 1)
+        if required > len(material_ids):
+            return []
+
+        with self._lock:
+            self._ensure_loaded()
+            postings = sorted(
+                (self._postings.get(material_id, set()) for material_id in material_ids),
+                key=len
+            )
+
+            if required == len(postings):
+                # Intersect starting from the rarest material so the working set stays small
+                result = set(postings[0])
+                for posting in postings[1:]:
+                    if not result:
+                        break
+                    result &= posting
+                return sorted(result)
+
+            counts = Counter()
+            for posting in postings:
+                counts.update(posting)
+
+        matches = [(count, prescription_id) for prescription_id, count in counts.items() if count >= required]
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return [prescription_id for _, prescription_id in matches]
+
+    def apply_changes(self, changes):
+        """
+        Patch the index with committed changes
+
+        Args:
+            changes (list): data_events.Change objects
+        """
+        with self._lock:
+            if self._postings is None:
+                return
+
+            for change in changes:
+                if change.op == 'bulk' and change.table in ('prescription_material', 'prescription', 'medicinal_material'):
+                    self.invalidate()
+                    return
+
+                if change.table == 'prescription_material':
+                    material_id = change.values.get('material_id')
+                    prescription_id = change.values.get('prescription_id')
+                    if change.op == 'delete':
+                        self._remove(material_id, prescription_id)
+                    else:
+                        self._add(material_id, prescription_id)
+
+                elif change.table == 'prescription' and change.op == 'delete':
+                    for material_id in self._materials_of.pop(change.row_id, set()):
+                        self._postings.get(material_id, set()).discard(change.row_id)
+
+                elif change.table == 'medicinal_material' and change.op == 'delete':
+                    for prescription_id in self._postings.pop(change.row_id, set()):
+                        self._materials_of.get(prescription_id, set()).discard(change.row_id)
+
+
+# Shared material -> prescription index for this process
+prescription_index = PrescriptionIndex()
+data_events.subscribe(prescription_index.apply_changes)
+
+
+def query_prescription_ids(material_ids, min_matches=None):
+    """
+    SQL equivalent of PrescriptionIndex.find()
+
+    Uses GROUP BY prescription_id HAVING COUNT(DISTINCT material_id) >= n on
+    prescription_material, for callers that must not rely on in-process state.
+
+    Args:
+        material_ids (iterable): Material IDs to look for
+        min_matches (int, optional): Required number of matching materials,
+            defaults to all of them
+
+    Returns:
+        list: Matching prescription IDs, best matches first, then by ID
+    """
+    material_ids = set(material_ids)
+    if not material_ids:
+        return []
+    required = len(material_ids) if min_matches is None else max(min_matches, 1)
+
+    pm = prescription_material.c
+    matched = db.func.count(db.distinct(pm.material_id))
+    rows = db.session.query(pm.prescription_id).filter(
+        pm.material_id.in_(material_ids)
+    ).group_by(pm.prescription_id).having(
+        matched >= required
+    ).order_by(matched.desc(), pm.prescription_id).all()
+
+    return [prescription_id for prescription_id, in rows]
+
+
+def find_prescription_ids(material_ids, mode='all', min_matches=None, use_index=True):
+    """
+    Find prescriptions by the materials they contain
+
+    Args:
+        material_ids (iterable): Material IDs to look for
+        mode (str): 'all' to require every material, 'any' for at least one,
+            'at_least' for at least min_matches of them
+        min_matches (int, optional): Required number of matches for 'at_least'
+        use_index (bool): Use the in-memory index instead of querying the database
+
+    Returns:
+        list: Matching prescription IDs, best matches first, then by ID
     """
-    Find prescriptions that contain all of the given materials
+    if mode == 'all':
+        min_matches = None
+    elif mode == 'any':
+        min_matches = 1
+    elif mode == 'at_least':
+        if not min_matches:
+            raise ValueError("min_matches is required when mode is 'at_least'")
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+
+    if use_index:
+        return prescription_index.find(material_ids, min_matches)
+    return query_prescription_ids(material_ids, min_matches)
+
+
+def get_related_prescriptions(material_ids, mode='all', min_matches=None):
+    """
+    Find prescriptions that contain the given materials
     
     Args:
         material_ids (list): List of material IDs
+        mode (str): 'all' (default), 'any' or 'at_least', see find_prescription_ids()
+        min_matches (int, optional): Required number of matches for 'at_least'
         
     Returns:
         list: List of prescription objects
     """
     if not material_ids:
         return []
-    
-    # Convert to set for faster lookups
-    material_ids = set(material_ids)
-    
-    # Get all prescriptions
-    prescriptions = Prescription.query.all()
-    
-    # Filter prescriptions containing all the materials
-    related_prescriptions = []
-    for prescription in prescriptions:
-        material_ids_in_prescription = {material.id for material in prescription.materials}
-        if material_ids.issubset(material_ids_in_prescription):
-            related_prescriptions.append(prescription)
-    
-    return related_prescriptions
+
+    prescription_ids = find_prescription_ids(material_ids, mode, min_matches)
+    if not prescription_ids:
+        return []
+
+    prescriptions = Prescription.query.filter(Prescription.id.in_(prescription_ids)).all()
+    by_id = {prescription.id: prescription for prescription in prescriptions}
+    return [by_id[prescription_id] for prescription_id in prescription_ids if prescription_id in by_id]
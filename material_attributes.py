@@ -0,0 +1,136 @@
+"""
+Normalized flavors and meridians of medicinal materials
+
+MedicinalMaterial.flavor and .meridian hold combined values such as
+'bitter/sweet' or 'Spleen/Stomach'. Their individual values are mirrored
+into the indexed material_flavor and material_meridian tables, so counts
+and filters per flavor or meridian are index lookups instead of LIKE scans.
+ORM writes keep the tables in step inside the same transaction; bulk
+changes rebuild them after they commit.
+"""
+import logging
+import re
+
+from sqlalchemy import delete, select
+
+from app import db
+from models import MedicinalMaterial, material_flavor, material_meridian
+import data_events
+
+logger = logging.getLogger(__name__)
+
+# medicinal_material column -> (junction table, value column)
+ATTRIBUTE_TABLES = {
+    'flavor': (material_flavor, 'flavor'),
+    'meridian': (material_meridian, 'meridian'),
+}
+
+# Separators used between values in the combined columns
+_SEPARATORS = re.compile(r"\s*[/,;、，；]\s*")
+
+# Length of the value columns in the junction tables
+VALUE_LIMIT = 50
+
+
+def split_values(value):
+    """
+    Split a combined attribute value into its parts
+
+    Args:
+        value (str): e.g. 'bitter/sweet' or 'Spleen, Stomach'
+
+    Returns:
+        list: Distinct non-empty parts in their original order
+    """
+    if not value:
+        return []
+    parts = []
+    for part in _SEPARATORS.split(value.strip()):
+        part = part.strip()[:VALUE_LIMIT]
+        if part and part not in parts:
+            parts.append(part)
+    return parts
+
+
+def _rows(column, material_id, value):
+    _, value_column = ATTRIBUTE_TABLES[column]
+    return [{'material_id': material_id, value_column: part} for part in split_values(value)]
+
+
+def sync_materials(connection, changes):
+    """
+    Apply material inserts, updates and deletes to the junction tables
+
+    Args:
+        connection: Connection of the transaction to write in
+        changes (list): data_events.Change objects
+    """
+    for column, (table, _) in ATTRIBUTE_TABLES.items():
+        stale_ids = set()
+        rows = []
+        for change in changes:
+            if change.table != 'medicinal_material' or change.row_id is None:
+                continue
+            if change.op == 'delete' or (change.op == 'update' and column in change.changed):
+                stale_ids.add(change.row_id)
+            if change.op == 'insert' or (change.op == 'update' and column in change.changed):
+                rows.extend(_rows(column, change.row_id, change.values.get(column)))
+
+        if stale_ids:
+            connection.execute(delete(table).where(table.c.material_id.in_(sorted(stale_ids))))
+        if rows:
+            connection.execute(table.insert(), rows)
+
+
+def refresh_material_attributes(connection):
+    """
+    Rebuild the junction tables from medicinal_material
+
+    Args:
+        connection: Connection of the transaction to write in
+    """
+    materials = connection.execute(
+        select(MedicinalMaterial.id, MedicinalMaterial.flavor, MedicinalMaterial.meridian)
+    ).all()
+
+    for column, (table, _) in ATTRIBUTE_TABLES.items():
+        connection.execute(delete(table))
+        rows = [row for material in materials for row in _rows(column, material.id, getattr(material, column))]
+        if rows:
+            connection.execute(table.insert(), rows)
+
+    logger.info(f"Rebuilt flavor and meridian tables for {len(materials)} materials")
+
+
+def material_ids_with(column, value):
+    """
+    Select of the ids of materials having a flavor or meridian
+
+    Args:
+        column (str): 'flavor' or 'meridian'
+        value (str): Single flavor or meridian, e.g. 'Lung'
+
+    Returns:
+        Select: Subquery usable with MedicinalMaterial.id.in_()
+    """
+    table, value_column = ATTRIBUTE_TABLES[column]
+    return select(table.c.material_id).where(table.c[value_column] == value)
+
+
+def _on_flush(session, changes):
+    if any(change.table == 'medicinal_material' and change.op == 'bulk' for change in changes):
+        refresh_material_attributes(session.connection())
+    elif any(change.table == 'medicinal_material' for change in changes):
+        sync_materials(session.connection(), changes)
+
+
+def _on_commit(changes):
+    # Bulk writes bypass the flush handler; rebuild in a transaction of our own
+    if any(change.table == 'medicinal_material' and change.op == 'bulk' and not change.remote
+           for change in changes):
+        with db.engine.begin() as connection:
+            refresh_material_attributes(connection)
+
+
+data_events.on_flush(_on_flush)
+data_events.subscribe(_on_commit)
@@ -0,0 +1,185 @@
+"""
+Materialized distributions of medicinal material attributes
+
+The number of materials per province, property, flavor and meridian value
+is kept in the material_statistic table; flavors and meridians are counted
+per individual value ('bitter/sweet' counts for bitter and for sweet). ORM
+writes to medicinal_material adjust the counts inside the same transaction
+(a data_events flush handler); bulk changes trigger a full refresh after
+they commit. Reading a distribution is a lookup of one row per distinct
+value.
+"""
+import logging
+from collections import Counter
+
+from sqlalchemy import delete, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from models import MedicinalMaterial, MaterialStatistic
+from material_attributes import ATTRIBUTE_TABLES, refresh_material_attributes, split_values
+import data_events
+
+logger = logging.getLogger(__name__)
+
+# Dimension name -> medicinal_material column
+STAT_DIMENSIONS = {
+    'province': 'province_origin',
+    'property': 'property',
+    'flavor': 'flavor',
+    'meridian': 'meridian',
+}
+
+
+def _stat_values(dimension, value):
+    """Values a material counts for; NULL and empty strings count for nothing"""
+    if STAT_DIMENSIONS[dimension] in ATTRIBUTE_TABLES:
+        return split_values(value)
+    return [value] if value else []
+
+
+def statistic_deltas(changes):
+    """
+    Count adjustments for a list of changes
+
+    Args:
+        changes (list): data_events.Change objects
+
+    Returns:
+        Counter: (dimension, value) -> delta, or None if a change cannot be
+            applied incrementally (bulk changes, old values that were not loaded)
+    """
+    deltas = Counter()
+    for change in changes:
+        if change.table != 'medicinal_material':
+            continue
+        if change.op == 'bulk':
+            return None
+
+        for dimension, column in STAT_DIMENSIONS.items():
+            added = removed = ()
+            if change.op == 'insert':
+                added = _stat_values(dimension, change.values.get(column))
+            elif change.op == 'delete':
+                if column not in change.values:
+                    return None
+                removed = _stat_values(dimension, change.values[column])
+            elif column in change.changed:
+                if column not in change.previous:
+                    return None
+                removed = _stat_values(dimension, change.previous[column])
+                added = _stat_values(dimension, change.values.get(column))
+
+            for value in added:
+                deltas[(dimension, value)] += 1
+            for value in removed:
+                deltas[(dimension, value)] -= 1
+
+    return Counter({key: delta for key, delta in deltas.items() if delta})
+
+
+def apply_deltas(connection, deltas):
+    """
+    Add count adjustments to material_statistic
+
+    Args:
+        connection: Connection of the transaction to write in
+        deltas (Counter): (dimension, value) -> delta
+    """
+    if not deltas:
+        return
+
+    table = MaterialStatistic.__table__
+    params = [{'dimension': dimension, 'value': value, 'count': delta}
+              for (dimension, value), delta in sorted(deltas.items())]
+
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert(table) if dialect == 'postgresql' else sqlite.insert(table)
+        statement = insert.on_conflict_do_update(
+            index_elements=['dimension', 'value'],
+            set_={'count': table.c.count + insert.excluded.count}
+        )
+        connection.execute(statement, params)
+        return
+
+    for row in params:
+        result = connection.execute(
+            table.update()
+            .where(table.c.dimension == row['dimension'], table.c.value == row['value'])
+            .values(count=table.c.count + row['count'])
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert(), row)
+
+
+def refresh_material_statistics(connection):
+    """
+    Recompute all counts from medicinal_material
+
+    Flavor and meridian counts are read from the junction tables, which must
+    be current (see material_attributes.refresh_material_attributes).
+
+    Args:
+        connection: Connection of the transaction to write in
+    """
+    table = MaterialStatistic.__table__
+    material = MedicinalMaterial.__table__
+
+    connection.execute(delete(table))
+    for dimension, column_name in STAT_DIMENSIONS.items():
+        if column_name in ATTRIBUTE_TABLES:
+            junction, value_column = ATTRIBUTE_TABLES[column_name]
+            column = junction.c[value_column]
+        else:
+            column = material.c[column_name]
+        counts = (
+            select(literal(dimension), column, func.count())
+            .where(column.is_not(None), column != '')
+            .group_by(column)
+        )
+        connection.execute(table.insert().from_select(['dimension', 'value', 'count'], counts))
+
+    logger.info("Refreshed material statistics")
+
+
+def backfill_material_statistics():
+    """
+    Fill the summary tables if they have never been filled
+
+    Databases created before material_statistic, material_flavor and
+    material_meridian existed have materials but empty summary tables, so
+    distributions and the flavor and meridian filters would find nothing.
+
+    Returns:
+        bool: Whether the tables were filled
+    """
+    with db.engine.begin() as connection:
+        if connection.execute(select(MaterialStatistic.dimension).limit(1)).first() is not None:
+            return False
+        if connection.execute(select(MedicinalMaterial.id).limit(1)).first() is None:
+            return False
+        refresh_material_attributes(connection)
+        refresh_material_statistics(connection)
+    logger.info("Filled the empty material summary tables")
+    return True
+
+
+def _on_flush(session, changes):
+    deltas = statistic_deltas(changes)
+    if deltas is None:
+        refresh_material_statistics(session.connection())
+    elif deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def _on_commit(changes):
+    # Bulk writes bypass the flush handler; refresh in a transaction of our own
+    if any(change.table == 'medicinal_material' and change.op == 'bulk' and not change.remote
+           for change in changes):
+        with db.engine.begin() as connection:
+            refresh_material_statistics(connection)
+
+
+data_events.on_flush(_on_flush)
+data_events.subscribe(_on_commit)
@@ -0,0 +1,165 @@
+"""
+Denormalized usage_frequency of medicinal materials
+
+MedicinalMaterial.usage_frequency is the number of prescriptions that use
+a material. It is derived from prescription_material, never incremented by
+callers:
+
+- ORM writes recompute the counts of the materials whose links changed,
+  inside the same transaction (a data_events flush handler).
+- Set-based imports call recompute_usage_frequency() with the materials
+  they touched.
+- migrate_db installs database triggers that adjust the count on every
+  link insert and delete, which also covers raw SQL and concurrent writers.
+
+Running this module recomputes every count:
+
+    python material_usage.py
+"""
+import logging
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import Session
+
+from app import app, db
+from models import MedicinalMaterial, Prescription, prescription_material
+import data_events
+
+logger = logging.getLogger(__name__)
+
+# Number of material ids per UPDATE
+CHUNK_SIZE = 1000
+
+_DELETED_LINKS_KEY = 'material_usage.deleted_links'
+
+POSTGRES_TRIGGERS = [
+    """CREATE OR REPLACE FUNCTION material_usage_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            UPDATE medicinal_material SET usage_frequency = usage_frequency - 1 WHERE id = OLD.material_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE medicinal_material SET usage_frequency = usage_frequency + 1 WHERE id = NEW.material_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS material_usage_sync ON prescription_material",
+    """CREATE TRIGGER material_usage_sync
+        AFTER INSERT OR DELETE OR UPDATE OF material_id ON prescription_material
+        FOR EACH ROW EXECUTE FUNCTION material_usage_sync()""",
+]
+
+_INCREMENT = "UPDATE medicinal_material SET usage_frequency = usage_frequency + 1 WHERE id = new.material_id;"
+_DECREMENT = "UPDATE medicinal_material SET usage_frequency = usage_frequency - 1 WHERE id = old.material_id;"
+
+SQLITE_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS material_usage_ai AFTER INSERT ON prescription_material BEGIN {_INCREMENT} END",
+    f"CREATE TRIGGER IF NOT EXISTS material_usage_ad AFTER DELETE ON prescription_material BEGIN {_DECREMENT} END",
+    f"CREATE TRIGGER IF NOT EXISTS material_usage_au AFTER UPDATE OF material_id ON prescription_material "
+    f"BEGIN {_DECREMENT} {_INCREMENT} END",
+]
+
+
+def recompute_usage_frequency(connection, material_ids=None):
+    """
+    Set usage_frequency to the number of prescriptions using each material
+
+    Each UPDATE computes the counts and writes them in one statement; rows
+    whose count is already right are not rewritten.
+
+    Args:
+        connection: Connection of the transaction to write in
+        material_ids (iterable, optional): Only update these materials (all if None)
+
+    Returns:
+        int: Number of materials whose count changed
+    """
+    material = MedicinalMaterial.__table__
+    pm = prescription_material.c
+    usage = select(func.count()).where(pm.material_id == material.c.id).scalar_subquery()
+    statement = (
+        material.update()
+        .where(material.c.usage_frequency.is_distinct_from(usage))
+        .values(usage_frequency=usage)
+    )
+
+    if material_ids is None:
+        return connection.execute(statement).rowcount
+
+    material_ids = sorted(i for i in set(material_ids) if i is not None)
+    updated = 0
+    for start in range(0, len(material_ids), CHUNK_SIZE):
+        chunk = material_ids[start:start + CHUNK_SIZE]
+        updated += connection.execute(statement.where(material.c.id.in_(chunk))).rowcount
+    return updated
+
+
+def install_triggers(connection):
+    """
+    Create the triggers that keep usage_frequency in step with prescription_material
+
+    Existing counts are recomputed first, since the triggers only apply deltas.
+
+    Args:
+        connection: Connection of the transaction to run the DDL in
+
+    Returns:
+        bool: False if the database has no supported trigger syntax
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        statements = POSTGRES_TRIGGERS
+    elif dialect == 'sqlite':
+        statements = SQLITE_TRIGGERS
+    else:
+        return False
+
+    recompute_usage_frequency(connection)
+    for statement in statements:
+        connection.execute(text(statement))
+    return True
+
+
+@event.listens_for(Session, 'before_flush')
+def _before_flush(session, flush_context, instances):
+    # The links of a deleted prescription are gone after the flush; note their materials now
+    deleted_ids = [obj.id for obj in session.deleted if isinstance(obj, Prescription) and obj.id is not None]
+    if deleted_ids:
+        pm = prescription_material.c
+        material_ids = session.execute(
+            select(pm.material_id).where(pm.prescription_id.in_(deleted_ids))
+        ).scalars().all()
+        session.info.setdefault(_DELETED_LINKS_KEY, set()).update(material_ids)
+
+
+def _on_flush(session, changes):
+    material_ids = session.info.pop(_DELETED_LINKS_KEY, set())
+    for change in changes:
+        if change.table == 'prescription_material' and change.op != 'bulk':
+            material_ids.add(change.values.get('material_id'))
+        elif change.table == 'medicinal_material' and change.op == 'insert':
+            material_ids.add(change.row_id)
+    material_ids.discard(None)
+
+    if material_ids:
+        recompute_usage_frequency(session.connection(), material_ids)
+
+
+data_events.on_flush(_on_flush)
+
+
+def main():
+    with app.app_context():
+        try:
+            updated = recompute_usage_frequency(db.session.connection())
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error recomputing usage frequency: {e}")
+            return
+        data_events.notify_bulk_change('medicinal_material')
+        print(f"Usage frequency recomputed; {updated} materials changed.")
+
+if __name__ == "__main__":
+    main()
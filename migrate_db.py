@@ -1,26 +1,182 @@
 """
 Script to migrate the database schema
+
+Usage:
+    python migrate_db.py           # apply missing columns, tables, keys and indexes
+    python migrate_db.py --check   # EXPLAIN the hot queries and check they use their indexes
 """
+import sys
 from app import app, db
-from sqlalchemy import text
+from sqlalchemy import inspect, text
+from material_attributes import refresh_material_attributes
+from material_stats import refresh_material_statistics
+import search_backend
+import material_usage
+
+# Columns added to existing tables after their first release: (table, column, DDL type)
+ADDED_COLUMNS = [
+    ('data_import', 'rows_processed', 'INTEGER DEFAULT 0'),
+    ('data_import', 'checkpoint_offset', 'BIGINT DEFAULT 0'),
+    ('data_import', 'updated_at', 'TIMESTAMP'),
+]
+
+def table_exists(table):
+    """Whether the database has a table (works on PostgreSQL and SQLite)"""
+    return inspect(db.session.connection()).has_table(table)
+
+def column_exists(table, column):
+    """Whether a table of the database has a column (works on PostgreSQL and SQLite)"""
+    columns = inspect(db.session.connection()).get_columns(table)
+    return any(c['name'] == column for c in columns)
+
+def add_missing_columns():
+    """Add the columns in ADDED_COLUMNS that the database does not have yet"""
+    for table, column, ddl in ADDED_COLUMNS:
+        if not column_exists(table, column):
+            print(f"Adding {table}.{column} column...")
+            db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            print(f"{table}.{column} column added.")
+        else:
+            print(f"{table}.{column} column already exists.")
+
+# Lookup indexes on foreign keys and hot ORDER BY columns: (name, table, columns)
+INDEXES = [
+    ('ix_prescription_material_material_id', 'prescription_material', 'material_id'),
+    ('ix_prescription_efficacy_efficacy_category_id', 'prescription_efficacy', 'efficacy_category_id'),
+    ('ix_medicinal_material_usage_frequency', 'medicinal_material', 'usage_frequency'),
+    ('ix_prescription_created_at', 'prescription', 'created_at'),
+    ('ix_material_interaction_material1_id', 'material_interaction', 'material1_id'),
+    ('ix_material_interaction_material2_id', 'material_interaction', 'material2_id'),
+    ('ix_data_import_status', 'data_import', 'status'),
+]
+
+# Association tables and the columns of their composite primary key
+ASSOCIATION_KEYS = [
+    ('prescription_material', ('prescription_id', 'material_id')),
+    ('prescription_efficacy', ('prescription_id', 'efficacy_category_id')),
+]
+
+# Hot queries and the indexes they are expected to use: (description, SQL, acceptable index names)
+HOT_QUERIES = [
+    ("Materials of a prescription",
+     "SELECT material_id FROM prescription_material WHERE prescription_id = 1",
+     ('prescription_material_pkey', 'uq_prescription_material', 'sqlite_autoindex_prescription_material')),
+    ("Prescriptions using a material",
+     "SELECT prescription_id FROM prescription_material WHERE material_id = 1",
+     ('ix_prescription_material_material_id',)),
+    ("Categories of a prescription",
+     "SELECT efficacy_category_id FROM prescription_efficacy WHERE prescription_id = 1",
+     ('prescription_efficacy_pkey', 'uq_prescription_efficacy', 'sqlite_autoindex_prescription_efficacy')),
+    ("Prescriptions in a category",
+     "SELECT prescription_id FROM prescription_efficacy WHERE efficacy_category_id = 1",
+     ('ix_prescription_efficacy_efficacy_category_id',)),
+    ("Most used materials",
+     "SELECT id, name FROM medicinal_material ORDER BY usage_frequency DESC LIMIT 10",
+     ('ix_medicinal_material_usage_frequency',)),
+    ("Recent prescriptions",
+     "SELECT id, name FROM prescription ORDER BY created_at DESC LIMIT 10",
+     ('ix_prescription_created_at',)),
+    ("Materials with a meridian",
+     "SELECT material_id FROM material_meridian WHERE meridian = 'Lung'",
+     ('ix_material_meridian_meridian',)),
+]
+
+def has_primary_key(table):
+    """Whether a table has a primary key (or, on SQLite, the unique index added in its place)"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        result = db.session.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table "
+            "AND (name LIKE 'sqlite_autoindex_%' OR name = 'uq_' || :table)"
+        ), {'table': table})
+        return result.scalar() is not None
+    
+    result = db.session.execute(text(
+        "SELECT constraint_name FROM information_schema.table_constraints "
+        "WHERE table_name = :table AND constraint_type = 'PRIMARY KEY'"
+    ), {'table': table})
+    return result.scalar() is not None
+
+def add_association_keys():
+    """Remove duplicate association rows and add composite primary keys (unique indexes on SQLite)"""
+    dialect = db.session.get_bind().dialect.name
+    
+    for table, columns in ASSOCIATION_KEYS:
+        if has_primary_key(table):
+            print(f"{table} key already exists.")
+            continue
+        
+        not_null = " OR ".join(f"{column} IS NULL" for column in columns)
+        same_key = " AND ".join(f"a.{column} = b.{column}" for column in columns)
+        key = ", ".join(columns)
+        
+        print(f"Removing incomplete and duplicate rows from {table}...")
+        db.session.execute(text(f"DELETE FROM {table} WHERE {not_null}"))
+        if dialect == 'postgresql':
+            db.session.execute(text(
+                f"DELETE FROM {table} a USING {table} b WHERE a.ctid < b.ctid AND {same_key}"
+            ))
+            print(f"Adding {table} primary key...")
+            db.session.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({key})"))
+        else:
+            db.session.execute(text(
+                f"DELETE FROM {table} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {table} GROUP BY {key})"
+            ))
+            print(f"Adding {table} unique index...")
+            db.session.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table} ON {table} ({key})"))
+        print(f"{table} key added.")
+
+def create_indexes():
+    """Create the indexes in INDEXES that the database does not have yet"""
+    for name, table, columns in INDEXES:
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+        print(f"Index {name} on {table} ({columns}) is in place.")
+
+def _query_plan(sql):
+    """Query plan of a statement as text"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # Tiny tables are always scanned sequentially; ask whether the index can be used at all
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+        rows = db.session.execute(text(f"EXPLAIN {sql}")).all()
+        return "\n".join(row[0] for row in rows)
+    
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    return "\n".join(str(row[-1]) for row in rows)
+
+def check_query_plans():
+    """
+    Check with EXPLAIN that the hot queries use their indexes
+    
+    Returns:
+        bool: True if every query uses one of its expected indexes
+    """
+    all_ok = True
+    with app.app_context():
+        try:
+            for description, sql, index_names in HOT_QUERIES:
+                plan = _query_plan(sql)
+                used = [name for name in index_names if name in plan]
+                if used:
+                    print(f"OK       {description}: uses {used[0]}")
+                else:
+                    all_ok = False
+                    print(f"MISSING  {description}: expected one of {', '.join(index_names)}")
+                    print("         " + plan.replace("\n", "\n         "))
+        finally:
+            db.session.rollback()
+    return all_ok
 
 def migrate_db():
     """Migrate the database schema to add missing columns"""
     with app.app_context():
         try:
             print("Checking if user table exists...")
-            result = db.session.execute(text("SELECT to_regclass('user')"))
-            user_table_exists = result.scalar() is not None
+            user_table_exists = table_exists('user')
             
             if user_table_exists:
                 print("User table exists. Checking columns...")
                 
                 # Check if is_admin column exists
-                result = db.session.execute(text(
-                    "SELECT column_name FROM information_schema.columns "
-                    "WHERE table_name = 'user' AND column_name = 'is_admin'"
-                ))
-                is_admin_exists = result.scalar() is not None
+                is_admin_exists = column_exists('user', 'is_admin')
                 
                 if not is_admin_exists:
                     print("Adding is_admin column...")
@@ -32,11 +188,7 @@ def migrate_db():
                     print("is_admin column already exists.")
                 
                 # Check if is_active column exists
-                result = db.session.execute(text(
-                    "SELECT column_name FROM information_schema.columns "
-                    "WHERE table_name = 'user' AND column_name = 'is_active'"
-                ))
-                is_active_exists = result.scalar() is not None
+                is_active_exists = column_exists('user', 'is_active')
                 
                 if not is_active_exists:
                     print("Adding is_active column...")
@@ -48,27 +200,20 @@ def migrate_db():
                     print("is_active column already exists.")
                 
                 # Check if preferences column exists
-                result = db.session.execute(text(
-                    "SELECT column_name FROM information_schema.columns "
-                    "WHERE table_name = 'user' AND column_name = 'preferences'"
-                ))
-                preferences_exists = result.scalar() is not None
+                preferences_exists = column_exists('user', 'preferences')
                 
                 if not preferences_exists:
                     print("Adding preferences column...")
+                    json_type = 'JSONB' if db.session.get_bind().dialect.name == 'postgresql' else 'JSON'
                     db.session.execute(text(
-                        "ALTER TABLE \"user\" ADD COLUMN preferences JSONB DEFAULT '{\"language\": \"zh\", \"theme\": \"light\"}'"
+                        f"ALTER TABLE \"user\" ADD COLUMN preferences {json_type} DEFAULT '{{\"language\": \"zh\", \"theme\": \"light\"}}'"
                     ))
                     print("preferences column added.")
                 else:
                     print("preferences column already exists.")
                 
                 # Check if last_login column exists
-                result = db.session.execute(text(
-                    "SELECT column_name FROM information_schema.columns "
-                    "WHERE table_name = 'user' AND column_name = 'last_login'"
-                ))
-                last_login_exists = result.scalar() is not None
+                last_login_exists = column_exists('user', 'last_login')
                 
                 if not last_login_exists:
                     print("Adding last_login column...")
@@ -79,6 +224,38 @@ def migrate_db():
                 else:
                     print("last_login column already exists.")
                 
+                # Columns added to other tables
+                add_missing_columns()
+                
+                # Tables added since the last migration
+                print("Creating missing tables...")
+                db.create_all()
+                
+                # Keys and indexes added since the first release
+                add_association_keys()
+                create_indexes()
+                
+                # Trigram and full-text indexes for prescription search
+                print("Installing search indexes...")
+                if search_backend.install(db.session.connection()):
+                    print("Search indexes are in place.")
+                else:
+                    print("No text index support for this database; search uses LIKE.")
+                
+                # Database-maintained usage counts
+                print("Installing usage_frequency triggers...")
+                if material_usage.install_triggers(db.session.connection()):
+                    print("usage_frequency triggers are in place.")
+                else:
+                    print("No trigger support for this database; recomputing usage_frequency instead.")
+                    material_usage.recompute_usage_frequency(db.session.connection())
+                
+                # Fill derived tables from medicinal_material
+                print("Rebuilding material flavor and meridian tables...")
+                refresh_material_attributes(db.session.connection())
+                print("Refreshing material statistics...")
+                refresh_material_statistics(db.session.connection())
+                
                 # Commit all changes
                 db.session.commit()
                 print("Database migration completed successfully.")
@@ -92,4 +269,6 @@ def migrate_db():
             print(f"Error during migration: {e}")
 
 if __name__ == "__main__":
+    if '--check' in sys.argv[1:]:
+        sys.exit(0 if check_query_plans() else 1)
     migrate_db()
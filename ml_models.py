@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.cluster import KMeans
 from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
@@ -7,8 +8,18 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics.pairwise import cosine_similarity
 from collections import Counter
 import logging
-from app import db
-from models import MedicinalMaterial, Prescription, MaterialInteraction, FormulaOptimization
+import os
+import threading
+import time
+from app import app, db
+from models import (
+    MedicinalMaterial, Prescription, MaterialInteraction, FormulaOptimization, EfficacyCategory,
+    prescription_material, prescription_efficacy
+)
+from model_registry import model_registry, MODEL_TABLES
+from text_index import BM25Index
+import data_events
+from db_routing import read_only
 
 logger = logging.getLogger(__name__)
 
@@ -20,47 +31,80 @@ class PrescriptionClassifier:
         self.model = RandomForestClassifier(n_estimators=100, random_state=42)
         self.material_encoder = None
         self.efficacy_encoder = None
-        self.scaler = StandardScaler()
+        # Sparse feature matrices cannot be centered
+        self.scaler = StandardScaler(with_mean=False)
+        self.vocabulary = {}  # material name -> feature column
         self.is_trained = False
     
+    @read_only
     def _prepare_data(self):
         """Prepare training data from the database"""
-        # Get all prescriptions and their materials
-        prescriptions = Prescription.query.all()
+        # Get all prescriptions and their labels
+        prescriptions = db.session.query(
+            Prescription.id, Prescription.efficacy
+        ).order_by(Prescription.id).all()
         
         if not prescriptions:
             logger.warning("No prescriptions found in database for training")
             return None, None
         
-        # Get all unique materials
-        materials = MedicinalMaterial.query.all()
-        material_names = [m.name for m in materials]
-        
-        # Create feature vectors for each prescription
-        X = []
-        y = []
-        
-        for prescription in prescriptions:
-            # Create binary feature vector (1 if material is in prescription, 0 otherwise)
-            feature_vector = [1 if material.name in [m.name for m in prescription.materials] else 0 
-                             for material in materials]
-            
-            X.append(feature_vector)
-            y.append(prescription.efficacy)
+        # Build the material vocabulary (one feature column per material)
+        materials = db.session.query(
+            MedicinalMaterial.id, MedicinalMaterial.name
+        ).order_by(MedicinalMaterial.id).all()
+        self.vocabulary = {name: column for column, (_, name) in enumerate(materials)}
+        column_of = {material_id: column for column, (material_id, _) in enumerate(materials)}
+        row_of = {prescription_id: row for row, (prescription_id, _) in enumerate(prescriptions)}
+        
+        # Binary prescription x material matrix straight from the association table
+        rows, columns = [], []
+        pairs = db.session.query(
+            prescription_material.c.prescription_id, prescription_material.c.material_id
+        ).all()
+        for prescription_id, material_id in pairs:
+            if prescription_id in row_of and material_id in column_of:
+                rows.append(row_of[prescription_id])
+                columns.append(column_of[material_id])
+        
+        X = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)),
+            shape=(len(prescriptions), len(materials))
+        )
+        # Duplicate association rows are summed; keep the features binary
+        X.data[:] = 1
+        y = [efficacy for _, efficacy in prescriptions]
         
-        if not X or not y:
+        if X.shape[1] == 0 or not y:
             logger.warning("Empty feature vectors or labels")
             return None, None
         
-        # Convert to numpy arrays
-        X = np.array(X)
-        
         # One-hot encode the efficacy labels
-        self.efficacy_encoder = OneHotEncoder(sparse=False, handle_unknown='ignore')
+        self.efficacy_encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
         y_encoded = self.efficacy_encoder.fit_transform(np.array(y).reshape(-1, 1))
         
         return X, y_encoded
     
+    def transform(self, material_lists):
+        """
+        Build the sparse feature matrix for prescriptions given as material names
+        
+        Args:
+            material_lists (list): One list of material names per prescription
+            
+        Returns:
+            scipy.sparse.csr_matrix: Binary feature matrix using the training vocabulary
+        """
+        rows, columns = [], []
+        for row, materials in enumerate(material_lists):
+            for column in {self.vocabulary[name] for name in materials if name in self.vocabulary}:
+                rows.append(row)
+                columns.append(column)
+        
+        return sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)),
+            shape=(len(material_lists), len(self.vocabulary))
+        )
+    
     def train(self):
         """Train the model on prescription data"""
         X, y = self._prepare_data()
@@ -84,7 +128,8 @@ class PrescriptionClassifier:
         Predict the efficacy of a prescription based on its materials
         
         Args:
-            materials (list): List of material names in the prescription
+            materials (list or sparse matrix): List of material names in the prescription,
+                or a feature row built with transform()
             
         Returns:
             str: Predicted efficacy
@@ -94,15 +139,14 @@ class PrescriptionClassifier:
             if not success:
                 return "Unable to predict due to training issues"
         
-        # Get all unique materials
-        all_materials = MedicinalMaterial.query.all()
-        material_names = [m.name for m in all_materials]
-        
-        # Create feature vector
-        feature_vector = [1 if material in materials else 0 for material in material_names]
+        # Create feature vector from the vocabulary captured at training time
+        if sparse.issparse(materials) or isinstance(materials, np.ndarray):
+            feature_vector = materials
+        else:
+            feature_vector = self.transform([materials])
         
         # Scale the feature vector
-        feature_vector_scaled = self.scaler.transform([feature_vector])
+        feature_vector_scaled = self.scaler.transform(feature_vector)
         
         # Predict
         prediction = self.model.predict(feature_vector_scaled)
@@ -119,13 +163,24 @@ class FormulaOptimizer:
     def __init__(self):
         self.material_profiles = {}
         self.prescription_profiles = {}
-        self.interaction_matrix = None
+        self.material_ids = np.zeros(0, dtype=np.int64)  # material id of each matrix row
+        self.material_index = {}  # material name -> matrix row
+        self.interaction_matrix = None  # symmetric material x material score matrix
+        self.text_index = BM25Index()  # prescription name -> efficacy text
         self._build_profiles()
     
+    @read_only
     def _build_profiles(self):
         """Build profiles for materials and prescriptions"""
         # Get all materials and their properties
-        materials = MedicinalMaterial.query.all()
+        materials = db.session.query(
+            MedicinalMaterial.id, MedicinalMaterial.name, MedicinalMaterial.property,
+            MedicinalMaterial.flavor, MedicinalMaterial.meridian, MedicinalMaterial.usage_frequency
+        ).order_by(MedicinalMaterial.id).all()
+        
+        # Matrix rows follow material ids
+        self.material_ids = np.array([material.id for material in materials], dtype=np.int64)
+        self.material_index = {material.name: row for row, material in enumerate(materials)}
         
         for material in materials:
             self.material_profiles[material.name] = {
@@ -136,58 +191,94 @@ class FormulaOptimizer:
             }
         
         # Get all prescriptions and their efficacies
-        prescriptions = Prescription.query.all()
+        prescriptions = db.session.query(
+            Prescription.id, Prescription.name, Prescription.efficacy, Prescription.description
+        ).all()
+        
+        # Material names per prescription in one join instead of a lazy load per prescription
+        material_names = {}
+        pairs = db.session.query(
+            prescription_material.c.prescription_id, MedicinalMaterial.name
+        ).join(MedicinalMaterial, MedicinalMaterial.id == prescription_material.c.material_id).all()
+        for prescription_id, material_name in pairs:
+            material_names.setdefault(prescription_id, []).append(material_name)
         
         for prescription in prescriptions:
-            material_names = [m.name for m in prescription.materials]
             self.prescription_profiles[prescription.name] = {
-                'materials': material_names,
+                'materials': material_names.get(prescription.id, []),
                 'efficacy': prescription.efficacy
             }
         
+        # Index efficacy, description and efficacy categories for symptom retrieval
+        category_names = {}
+        pairs = db.session.query(
+            prescription_efficacy.c.prescription_id, EfficacyCategory.name
+        ).join(EfficacyCategory, EfficacyCategory.id == prescription_efficacy.c.efficacy_category_id).all()
+        for prescription_id, category_name in pairs:
+            category_names.setdefault(prescription_id, []).append(category_name)
+        
+        self.text_index = BM25Index()
+        for prescription in prescriptions:
+            text = ' '.join(filter(None, [
+                prescription.efficacy,
+                prescription.description,
+                *category_names.get(prescription.id, [])
+            ]))
+            self.text_index.add(prescription.name, text)
+        
         # Build interaction matrix
         self._build_interaction_matrix()
     
     def _build_interaction_matrix(self):
         """Build interaction matrix between materials"""
-        interactions = MaterialInteraction.query.all()
+        interactions = db.session.query(
+            MaterialInteraction.material1_id, MaterialInteraction.material2_id,
+            MaterialInteraction.interaction_type
+        ).all()
         
         if not interactions:
             logger.warning("No material interactions found in database")
             return
         
-        # Create a dictionary to store interaction scores
-        interaction_dict = {}
+        # Dense symmetric matrix indexed like material_ids
+        row_of = {material_id: row for row, material_id in enumerate(self.material_ids.tolist())}
+        matrix = np.zeros((len(row_of), len(row_of)), dtype=np.float32)
         
-        for interaction in interactions:
-            mat1 = interaction.material1.name
-            mat2 = interaction.material2.name
+        for material1_id, material2_id, interaction_type in interactions:
+            i = row_of.get(material1_id)
+            j = row_of.get(material2_id)
+            if i is None or j is None or i == j:
+                continue
             
             # Assign score based on interaction type (simplified)
             score = 1.0  # default
-            if interaction.interaction_type == 'synergistic':
+            if interaction_type == 'synergistic':
                 score = 2.0
-            elif interaction.interaction_type == 'antagonistic':
+            elif interaction_type == 'antagonistic':
                 score = -1.0
             
             # Store both directions
-            if mat1 not in interaction_dict:
-                interaction_dict[mat1] = {}
-            if mat2 not in interaction_dict:
-                interaction_dict[mat2] = {}
-            
-            interaction_dict[mat1][mat2] = score
-            interaction_dict[mat2][mat1] = score
+            matrix[i, j] = score
+            matrix[j, i] = score
         
-        self.interaction_matrix = interaction_dict
+        self.interaction_matrix = matrix
+    
+    def _indicator(self, materials):
+        """Indicator vector over matrix rows for a list of material names"""
+        x = np.zeros(len(self.material_index), dtype=np.float32)
+        rows = [self.material_index[name] for name in materials if name in self.material_index]
+        x[rows] = 1.0
+        return x
     
-    def optimize_formula(self, symptoms, base_formula=None):
+    def optimize_formula(self, symptoms, base_formula=None, max_additions=2, beam_width=1):
         """
         Optimize a formula based on symptoms and optionally a base formula
         
         Args:
             symptoms (str): Description of symptoms
             base_formula (list, optional): List of material names to start with
+            max_additions (int): Maximum number of materials to add
+            beam_width (int): Number of candidate formulas kept per step (1 = greedy)
             
         Returns:
             dict: Optimized formula with explanation
@@ -215,7 +306,7 @@ class FormulaOptimizer:
             optimized_formula = [material for material, _ in material_counts.most_common(5)]
         
         # Optimize the formula by adding/removing materials based on interactions
-        optimized_formula = self._refine_formula(optimized_formula, symptoms)
+        optimized_formula = self._refine_formula(optimized_formula, symptoms, max_additions, beam_width)
         
         # Generate explanation
         explanation = self._generate_explanation(optimized_formula, symptoms)
@@ -241,61 +332,67 @@ class FormulaOptimizer:
             "explanation": explanation
         }
     
-    def _find_relevant_prescriptions(self, symptoms):
-        """Find prescriptions with efficacy relevant to symptoms"""
-        relevant = []
-        
-        for name, profile in self.prescription_profiles.items():
-            efficacy = profile['efficacy']
-            
-            # Simple keyword matching (could be improved with NLP)
-            if any(keyword in symptoms.lower() for keyword in efficacy.lower().split()):
-                relevant.append(name)
-        
-        return relevant
+    def _find_relevant_prescriptions(self, symptoms, limit=None):
+        """Find prescriptions with efficacy relevant to symptoms, best match first"""
+        return [name for name, _ in self.text_index.search(symptoms, limit)]
     
-    def _refine_formula(self, formula, symptoms):
-        """Refine formula by adding/removing materials based on interactions"""
-        if not self.interaction_matrix:
-            return formula
-        
-        # Calculate interaction scores for current formula
-        current_score = self._calculate_interaction_score(formula)
-        
-        # Try adding materials to improve score
-        potential_additions = []
-        
-        for material in self.material_profiles:
-            if material not in formula:
-                test_formula = formula + [material]
-                new_score = self._calculate_interaction_score(test_formula)
-                
-                if new_score > current_score:
-                    potential_additions.append((material, new_score - current_score))
-        
-        # Sort by improvement score and add top materials
-        potential_additions.sort(key=lambda x: x[1], reverse=True)
+    def _refine_formula(self, formula, symptoms, max_additions=2, beam_width=1):
+        """
+        Refine formula by adding materials based on interactions
         
-        refined_formula = formula.copy()
-        for material, _ in potential_additions[:2]:  # Add up to 2 new materials
-            refined_formula.append(material)
+        The score gain of adding each candidate is one matrix-vector product
+        against the formula's indicator vector. Additions are chosen greedily,
+        or with a beam search when beam_width > 1.
+        """
+        if self.interaction_matrix is None or max_additions <= 0:
+            return formula
         
-        return refined_formula
+        matrix = self.interaction_matrix
+        x = self._indicator(formula)
+        
+        # Each beam entry: (total gain, indicator vector, gains of adding each material, added rows)
+        beams = [(0.0, x, matrix @ x, [])]
+        for _ in range(max_additions):
+            candidates = []
+            for total, indicator, gains, added in beams:
+                available = np.where(indicator > 0, -np.inf, gains)
+                top = np.argsort(available)[::-1][:beam_width]
+                for row in top:
+                    if available[row] <= 0:
+                        break
+                    candidates.append((total + float(available[row]), indicator, gains, added, int(row)))
+            
+            if not candidates:
+                break
+            
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+            beams = []
+            seen = set()
+            for total, indicator, gains, added, row in candidates:
+                # The same set of additions can be reached in different orders
+                key = frozenset(added + [row])
+                if key in seen:
+                    continue
+                seen.add(key)
+                if len(beams) == beam_width:
+                    break
+                indicator = indicator.copy()
+                indicator[row] = 1.0
+                # Adding a material shifts every other candidate's gain by its matrix column
+                beams.append((total, indicator, gains + matrix[:, row], added + [row]))
+        
+        names = list(self.material_index)
+        _, _, _, added = max(beams, key=lambda beam: beam[0])
+        return formula.copy() + [names[row] for row in added]
     
     def _calculate_interaction_score(self, materials):
         """Calculate interaction score for a set of materials"""
-        if not self.interaction_matrix:
+        if self.interaction_matrix is None:
             return 0
         
-        score = 0
-        
-        # Look at all pairs of materials
-        for i, mat1 in enumerate(materials):
-            for mat2 in materials[i+1:]:
-                if mat1 in self.interaction_matrix and mat2 in self.interaction_matrix.get(mat1, {}):
-                    score += self.interaction_matrix[mat1][mat2]
-        
-        return score
+        # Sum over all pairs of materials: x^T M x counts every pair twice
+        x = self._indicator(materials)
+        return float(x @ self.interaction_matrix @ x) / 2
     
     def _generate_explanation(self, formula, symptoms):
         """Generate explanation for the optimized formula"""
@@ -311,14 +408,16 @@ class FormulaOptimizer:
                                f"affects {profile.get('meridian', 'N/A')} meridian\n"
         
         # Explain interactions if available
-        if self.interaction_matrix:
+        if self.interaction_matrix is not None:
             explanation += "\nKey material interactions:\n"
             interactions_explained = 0
             
             for i, mat1 in enumerate(formula):
                 for mat2 in formula[i+1:]:
-                    if mat1 in self.interaction_matrix and mat2 in self.interaction_matrix.get(mat1, {}):
-                        score = self.interaction_matrix[mat1][mat2]
+                    row1 = self.material_index.get(mat1)
+                    row2 = self.material_index.get(mat2)
+                    if row1 is not None and row2 is not None and self.interaction_matrix[row1, row2] != 0:
+                        score = self.interaction_matrix[row1, row2]
                         interaction_type = "synergistic" if score > 0 else "antagonistic" if score < 0 else "neutral"
                         explanation += f"- {mat1} and {mat2}: {interaction_type} interaction\n"
                         interactions_explained += 1
@@ -342,11 +441,17 @@ class MaterialClusterer:
         self.scaler = StandardScaler()
         self.is_trained = False
         self.feature_columns = ['property_encoded', 'flavor_encoded', 'meridian_encoded', 'usage_frequency']
+        self.value_maps = {}  # categorical column -> {value: code} captured at training time
+        self.results = None   # training data with cluster and PCA coordinates
     
-    def _prepare_data(self):
+    @read_only
+    def _prepare_data(self, fit=True):
         """Prepare training data from the database"""
         # Get all materials
-        materials = MedicinalMaterial.query.all()
+        materials = db.session.query(
+            MedicinalMaterial.name, MedicinalMaterial.property, MedicinalMaterial.flavor,
+            MedicinalMaterial.meridian, MedicinalMaterial.usage_frequency
+        ).all()
         
         if not materials:
             logger.warning("No materials found in database for clustering")
@@ -367,10 +472,11 @@ class MaterialClusterer:
         
         # Encode categorical features
         for col in ['property', 'flavor', 'meridian']:
-            # Simple label encoding
-            unique_values = df[col].unique()
-            value_map = {val: i for i, val in enumerate(unique_values)}
-            df[f'{col}_encoded'] = df[col].map(value_map)
+            # Simple label encoding, reusing the training codes once fitted
+            if fit or col not in self.value_maps:
+                unique_values = df[col].unique()
+                self.value_maps[col] = {val: i for i, val in enumerate(unique_values)}
+            df[f'{col}_encoded'] = df[col].map(self.value_maps[col])
         
         # Fill NaN values
         for col in self.feature_columns:
@@ -407,6 +513,7 @@ class MaterialClusterer:
         df['cluster'] = self.model.labels_
         df['pca_x'] = pca_result[:, 0]
         df['pca_y'] = pca_result[:, 1]
+        self.results = df
         
         logger.info("Material clustering model trained successfully")
         return df
@@ -417,8 +524,10 @@ class MaterialClusterer:
             df = self.train()
             if df is None:
                 return {"success": False, "message": "Failed to train clustering model"}
+        elif self.results is not None:
+            df = self.results
         else:
-            df, X = self._prepare_data()
+            df, X = self._prepare_data(fit=False)
             X_scaled = self.scaler.transform(X)
             df['cluster'] = self.model.predict(X_scaled)
             pca_result = self.pca.transform(X_scaled)
@@ -456,3 +565,116 @@ class MaterialClusterer:
             "success": True,
             "clusters": result
         }
+
+
+def _build_prescription_classifier():
+    classifier = PrescriptionClassifier()
+    return classifier if classifier.train() else None
+
+
+def _build_material_clusterer():
+    clusterer = MaterialClusterer()
+    return clusterer if clusterer.train() is not None else None
+
+
+# Trained models are persisted and reused until the training data changes.
+# Bump a version whenever the model's features change.
+model_registry.register('prescription_classifier', _build_prescription_classifier, version=1)
+model_registry.register('material_clusterer', _build_material_clusterer, version=1)
+model_registry.register('formula_optimizer', FormulaOptimizer, version=3)
+
+
+# Seconds after which the shared optimizer rechecks the database for changes
+# made by other processes
+OPTIMIZER_REFRESH_INTERVAL = int(os.environ.get("OPTIMIZER_REFRESH_INTERVAL", "300"))
+
+# Tables whose in-place edits change the optimizer's profiles without changing any row counts
+OPTIMIZER_ATTRIBUTE_TABLES = {'medicinal_material', 'material_interaction', 'efficacy_category'}
+
+
+class FormulaOptimizerService:
+    """
+    Shared, thread-safe FormulaOptimizer for all requests
+
+    Requests read the current optimizer without locking. Data changes
+    schedule a rebuild in a background thread, and the new optimizer
+    replaces the old one with a single reference swap, so in-flight
+    requests keep using the profiles they started with.
+    """
+    def __init__(self, refresh_interval=OPTIMIZER_REFRESH_INTERVAL, debounce=1.0):
+        self.refresh_interval = refresh_interval
+        self.debounce = debounce  # wait this long so bursts of edits cause one rebuild
+        self._optimizer = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self._stale = threading.Event()
+        self._retrain = False  # the pending refresh must retrain, not reuse a model with the same fingerprint
+        self._refresh_thread = None
+
+    def get(self):
+        """
+        Get the current optimizer, building it on first use
+
+        Returns:
+            FormulaOptimizer: The shared optimizer
+        """
+        optimizer = self._optimizer
+        if optimizer is None:
+            with self._lock:
+                if self._optimizer is None:
+                    self._optimizer = model_registry.get('formula_optimizer')
+                    self._loaded_at = time.monotonic()
+                optimizer = self._optimizer
+        elif time.monotonic() - self._loaded_at > self.refresh_interval:
+            self.request_refresh()
+        return optimizer
+
+    def request_refresh(self, retrain=False):
+        """
+        Schedule a background rebuild of the optimizer
+
+        Args:
+            retrain (bool): Retrain even if the data fingerprint is unchanged
+        """
+        self._stale.set()
+        with self._lock:
+            self._retrain = self._retrain or retrain
+            if self._refresh_thread is None:
+                self._refresh_thread = threading.Thread(
+                    target=self._refresh_loop, name='formula-optimizer-refresh', daemon=True
+                )
+                self._refresh_thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.debounce)
+            with self._lock:
+                if not self._stale.is_set():
+                    self._refresh_thread = None
+                    return
+                self._stale.clear()
+                retrain, self._retrain = self._retrain, False
+
+            try:
+                with app.app_context():
+                    model_registry.expire_fingerprint()
+                    optimizer = model_registry.get('formula_optimizer', retrain=retrain)
+                if optimizer is not None:
+                    self._optimizer = optimizer
+                self._loaded_at = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error refreshing formula optimizer: {e}")
+
+    def apply_changes(self, changes):
+        """Schedule a rebuild when the optimizer's source data changes"""
+        if self._optimizer is None or not any(change.table in MODEL_TABLES for change in changes):
+            return
+        retrain = any(
+            change.table in OPTIMIZER_ATTRIBUTE_TABLES and change.op in ('update', 'bulk') and not change.remote
+            for change in changes
+        )
+        self.request_refresh(retrain=retrain)
+
+
+formula_optimizer_service = FormulaOptimizerService()
+data_events.subscribe(formula_optimizer_service.apply_changes)
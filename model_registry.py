@@ -0,0 +1,200 @@
+"""
+Registry of trained ML models persisted to disk
+
+Trained models are pickled together with the version of their feature
+layout and a fingerprint of the data they were trained on. A model is
+loaded from disk the first time it is requested and only retrained when
+the data fingerprint (row counts, max ids, max updated_at) or the model
+version changes.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+from app import app, db
+from models import (
+    MedicinalMaterial, Prescription, MaterialInteraction, EfficacyCategory, DataVersion,
+    prescription_material, prescription_efficacy
+)
+import data_events
+from db_routing import read_only
+
+logger = logging.getLogger(__name__)
+
+# Directory for model artifacts (defaults to the Flask instance folder)
+MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(app.instance_path, 'models'))
+
+# Seconds to reuse a fingerprint before checking the database again
+FINGERPRINT_TTL = int(os.environ.get("MODEL_FINGERPRINT_TTL", "30"))
+
+# Tables the registered models are trained from
+MODEL_TABLES = {
+    'medicinal_material', 'prescription', 'prescription_material', 'material_interaction',
+    'efficacy_category', 'prescription_efficacy'
+}
+
+
+@read_only
+def data_fingerprint():
+    """
+    Fingerprint the training data with a single aggregate query
+
+    The shared data version (see data_version) covers in-place edits of
+    trained columns, such as a material's property or an interaction's
+    type, which leave the counts and maximum ids unchanged.
+
+    Returns:
+        str: Hex digest that changes when materials, prescriptions or interactions change
+    """
+    pm = prescription_material.c
+    statement = select(
+        select(DataVersion.version).where(DataVersion.id == 1).scalar_subquery(),
+        select(func.count(MedicinalMaterial.id)).scalar_subquery(),
+        select(func.max(MedicinalMaterial.id)).scalar_subquery(),
+        select(func.coalesce(func.sum(MedicinalMaterial.usage_frequency), 0)).scalar_subquery(),
+        select(func.count(Prescription.id)).scalar_subquery(),
+        select(func.max(Prescription.id)).scalar_subquery(),
+        select(func.max(Prescription.updated_at)).scalar_subquery(),
+        select(func.count()).select_from(prescription_material).scalar_subquery(),
+        select(func.coalesce(func.sum(pm.material_id), 0)).scalar_subquery(),
+        select(func.count(MaterialInteraction.id)).scalar_subquery(),
+        select(func.max(MaterialInteraction.id)).scalar_subquery(),
+        select(func.count()).select_from(prescription_efficacy).scalar_subquery(),
+        select(func.max(EfficacyCategory.id)).scalar_subquery()
+    )
+    values = db.session.execute(statement).one()
+    return hashlib.sha1(repr(tuple(str(value) for value in values)).encode('utf-8')).hexdigest()
+
+
+class ModelRegistry:
+    """
+    Lazily loads, trains and persists named models
+
+    Each model is registered with a builder that returns a trained instance
+    (or None if there is not enough data) and a version number that must be
+    bumped whenever the model's features change.
+    """
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+        self._specs = {}       # name -> (builder, version)
+        self._models = {}      # name -> (fingerprint, model)
+        self._locks = {}
+        self._fingerprint = None
+        self._fingerprint_checked_at = 0
+        self._lock = threading.Lock()
+
+    def register(self, name, builder, version=1):
+        """
+        Register a model
+
+        Args:
+            name (str): Registry key, also used for the artifact file name
+            builder (callable): Returns a trained model, or None on failure
+            version (int): Version of the model's feature layout
+        """
+        with self._lock:
+            self._specs[name] = (builder, version)
+            self._locks[name] = threading.Lock()
+            self._models.pop(name, None)
+
+    def _artifact_path(self, name):
+        return os.path.join(self.model_dir, f"{name}.pkl")
+
+    def current_fingerprint(self):
+        """Data fingerprint, rechecked at most every FINGERPRINT_TTL seconds"""
+        now = time.monotonic()
+        if self._fingerprint is None or now - self._fingerprint_checked_at > FINGERPRINT_TTL:
+            self._fingerprint = data_fingerprint()
+            self._fingerprint_checked_at = now
+        return self._fingerprint
+
+    def expire_fingerprint(self):
+        """Force the next get() to recheck the data fingerprint"""
+        self._fingerprint = None
+
+    def get(self, name, retrain=False):
+        """
+        Get a trained model, loading or retraining it if needed
+
+        Args:
+            name (str): Registry key
+            retrain (bool): Train a new model even if the fingerprint is unchanged
+
+        Returns:
+            object: The trained model, or None if it could not be trained
+        """
+        if name not in self._specs:
+            raise KeyError(f"Unknown model: {name}")
+        builder, version = self._specs[name]
+
+        with self._locks[name]:
+            fingerprint = self.current_fingerprint()
+
+            entry = self._models.get(name)
+            if entry is not None and entry[0] == fingerprint and not retrain:
+                return entry[1]
+
+            model = None if retrain else self._load(name, version, fingerprint)
+            if model is None:
+                logger.info(f"Training model '{name}' (version {version})")
+                model = builder()
+                if model is None:
+                    return None
+                self._save(name, version, fingerprint, model)
+
+            self._models[name] = (fingerprint, model)
+            return model
+
+    def _load(self, name, version, fingerprint):
+        path = self._artifact_path(name)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                artifact = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load model artifact {path}: {e}")
+            return None
+
+        if artifact.get('version') != version or artifact.get('fingerprint') != fingerprint:
+            return None
+
+        logger.info(f"Loaded model '{name}' trained at {artifact.get('trained_at')}")
+        return artifact['model']
+
+    def _save(self, name, version, fingerprint, model):
+        path = self._artifact_path(name)
+        artifact = {
+            'name': name,
+            'version': version,
+            'fingerprint': fingerprint,
+            'trained_at': datetime.now(timezone.utc).isoformat(),
+            'model': model
+        }
+
+        try:
+            os.makedirs(self.model_dir, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial artifact
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not save model artifact {path}: {e}")
+
+    def apply_changes(self, changes):
+        """Recheck the fingerprint as soon as this process commits training data"""
+        if any(change.table in MODEL_TABLES for change in changes):
+            self.expire_fingerprint()
+
+
+# Shared registry; models are registered in ml_models
+model_registry = ModelRegistry()
+data_events.subscribe(model_registry.apply_changes)
@@ -4,13 +4,17 @@ from sqlalchemy.dialects.postgresql import JSONB
 from uuid import uuid4
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# JSON column type: JSONB on PostgreSQL, JSON (text) on SQLite
+JSONType = db.JSON().with_variant(JSONB(), 'postgresql')
+
 # Association tables for many-to-many relationships
 prescription_material = db.Table(
     'prescription_material',
-    db.Column('prescription_id', db.Integer, db.ForeignKey('prescription.id')),
-    db.Column('material_id', db.Integer, db.ForeignKey('medicinal_material.id')),
+    db.Column('prescription_id', db.Integer, db.ForeignKey('prescription.id'), primary_key=True),
+    db.Column('material_id', db.Integer, db.ForeignKey('medicinal_material.id'), primary_key=True),
     db.Column('amount', db.String(50)),  # Amount of the material in the prescription
-    db.Column('unit', db.String(20))     # Unit of measurement
+    db.Column('unit', db.String(20)),    # Unit of measurement
+    db.Index('ix_prescription_material_material_id', 'material_id')
 )
 
 # Model for medicinal material
@@ -33,7 +37,7 @@ class MedicinalMaterial(db.Model):
     meridian = db.Column(db.String(100))
 
     description = db.Column(db.Text)
-    usage_frequency = db.Column(db.Integer, default=0)  # How often the material is used in prescriptions
+    usage_frequency = db.Column(db.Integer, default=0, index=True)  # How often the material is used in prescriptions
 
     # Relationship to prescriptions
     prescriptions = db.relationship('Prescription', secondary=prescription_material, back_populates='materials')
@@ -41,6 +45,21 @@ class MedicinalMaterial(db.Model):
     def __repr__(self):
         return f"<MedicinalMaterial {self.name}>"
 
+# Normalized flavors and meridians of a material, one row per value (e.g. 'bitter/sweet' -> bitter, sweet)
+material_flavor = db.Table(
+    'material_flavor',
+    db.Column('material_id', db.Integer, db.ForeignKey('medicinal_material.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('flavor', db.String(50), primary_key=True),
+    db.Index('ix_material_flavor_flavor', 'flavor')
+)
+
+material_meridian = db.Table(
+    'material_meridian',
+    db.Column('material_id', db.Integer, db.ForeignKey('medicinal_material.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('meridian', db.String(50), primary_key=True),
+    db.Index('ix_material_meridian_meridian', 'meridian')
+)
+
 # Model for prescription (formula)
 class Prescription(db.Model):
     __tablename__ = 'prescription'
@@ -51,13 +70,13 @@ class Prescription(db.Model):
     efficacy = db.Column(db.String(200))  # What the prescription treats
 
     # Store the evolution history as JSON
-    evolution_history = db.Column(JSONB)
+    evolution_history = db.Column(JSONType)
 
     # Relationship to medicinal materials
     materials = db.relationship('MedicinalMaterial', secondary=prescription_material, back_populates='prescriptions')
 
     # Metadata
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
     def __repr__(self):
@@ -82,8 +101,9 @@ class EfficacyCategory(db.Model):
 # Association table for prescriptions and efficacy categories
 prescription_efficacy = db.Table(
     'prescription_efficacy',
-    db.Column('prescription_id', db.Integer, db.ForeignKey('prescription.id')),
-    db.Column('efficacy_category_id', db.Integer, db.ForeignKey('efficacy_category.id'))
+    db.Column('prescription_id', db.Integer, db.ForeignKey('prescription.id'), primary_key=True),
+    db.Column('efficacy_category_id', db.Integer, db.ForeignKey('efficacy_category.id'), primary_key=True),
+    db.Index('ix_prescription_efficacy_efficacy_category_id', 'efficacy_category_id')
 )
 
 # Add the relationship to Prescription model
@@ -97,7 +117,7 @@ class FormulaOptimization(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     user_symptoms = db.Column(db.Text)
-    recommended_formula = db.Column(JSONB)  # Stores the optimized formula as JSON
+    recommended_formula = db.Column(JSONType)  # Stores the optimized formula as JSON
     explanation = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
@@ -109,8 +129,8 @@ class MaterialInteraction(db.Model):
     __tablename__ = 'material_interaction'
 
     id = db.Column(db.Integer, primary_key=True)
-    material1_id = db.Column(db.Integer, db.ForeignKey('medicinal_material.id'))
-    material2_id = db.Column(db.Integer, db.ForeignKey('medicinal_material.id'))
+    material1_id = db.Column(db.Integer, db.ForeignKey('medicinal_material.id'), index=True)
+    material2_id = db.Column(db.Integer, db.ForeignKey('medicinal_material.id'), index=True)
     interaction_type = db.Column(db.String(50))  # e.g., synergistic, antagonistic, etc.
     description = db.Column(db.Text)
 
@@ -130,12 +150,49 @@ class DataImport(db.Model):
     import_type = db.Column(db.String(50))  # What kind of data was imported
     rows_imported = db.Column(db.Integer)
     import_date = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    status = db.Column(db.String(20))  # success, error, etc.
+    status = db.Column(db.String(20), index=True)  # success, error, etc.
     error_message = db.Column(db.Text, nullable=True)
 
+    # Progress of streamed imports, committed with each chunk so they can resume
+    rows_processed = db.Column(db.Integer, default=0)
+    checkpoint_offset = db.Column(db.BigInteger, default=0)  # Byte offset of the next unread row
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
     def __repr__(self):
         return f"<DataImport {self.import_type} - {self.filename}>"
 
+# Uploaded file of a queued import, kept in the database so a worker on any host can read it
+class ImportUpload(db.Model):
+    __tablename__ = 'import_upload'
+
+    import_id = db.Column(db.Integer, db.ForeignKey('data_import.id', ondelete='CASCADE'), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"<ImportUpload {self.import_id}>"
+
+# Summary counts of medicinal materials per property value, kept current by material_stats
+class MaterialStatistic(db.Model):
+    __tablename__ = 'material_statistic'
+
+    dimension = db.Column(db.String(20), primary_key=True)  # province, property, flavor or meridian
+    value = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<MaterialStatistic {self.dimension}={self.value}: {self.count}>"
+
+# Counter bumped by every committed change to the prescription data, shared by all processes (see data_version)
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+
+    id = db.Column(db.Integer, primary_key=True)  # Always 1
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"<DataVersion {self.version}>"
+
 # Helper functions for token generation
 def generate_uuid():
     """Generate a UUID string"""
@@ -156,7 +213,7 @@ class User(db.Model):
     last_login = db.Column(db.DateTime, nullable=True)
 
     # User preferences
-    preferences = db.Column(JSONB, default=lambda: {'language': 'zh', 'theme': 'light'})
+    preferences = db.Column(JSONType, default=lambda: {'language': 'zh', 'theme': 'light'})
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -0,0 +1,206 @@
+"""
+Shared read queries with result caching
+
+The dashboard and statistics queries used by the Flask routes and by both
+Streamlit apps live here, so they are written once; their SQL is in the
+sql_statements registry. The module only needs a SQLAlchemy engine (the
+Streamlit apps do not load the Flask app).
+
+Results are cached per process and keyed on the data_version counter
+maintained by every writer (see data_version): a cached result is reused
+while the version is unchanged and its TTL has not expired. The version is
+itself read at most every VERSION_TTL seconds, so a burst of reads (a
+Streamlit rerun, a page with several charts) costs at most one round trip.
+Databases without a data_version table fall back to the TTL alone.
+
+Cached values are shared between callers and must not be modified.
+"""
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import sql_statements
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached result is reused even if the data version cannot be read
+RESULT_TTL = float(os.environ.get("REPOSITORY_CACHE_TTL", "300"))
+
+# Seconds the data version is reused before it is read again
+VERSION_TTL = float(os.environ.get("REPOSITORY_VERSION_TTL", "2"))
+
+
+class Repository:
+    """
+    Cached read queries on one database
+
+    Args:
+        get_engine (callable): Returns the engine to query
+        ttl (float): Seconds a result is reused at most
+        version_ttl (float): Seconds the data version is reused
+    """
+
+    def __init__(self, get_engine, ttl=RESULT_TTL, version_ttl=VERSION_TTL):
+        self.get_engine = get_engine
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self._lock = threading.Lock()
+        self._results = {}
+        self._version = (0.0, None)  # (monotonic time read, version)
+
+    def clear(self):
+        """Drop all cached results"""
+        with self._lock:
+            self._results.clear()
+            self._version = (0.0, None)
+
+    def apply_changes(self, changes):
+        """data_events subscriber: any committed change invalidates the cache"""
+        self.clear()
+
+    def data_version(self):
+        """
+        Current data version, or None if the database has no data_version table
+
+        Returns:
+            int: Version read within the last version_ttl seconds
+        """
+        read_at, version = self._version
+        if time.monotonic() - read_at < self.version_ttl:
+            return version
+
+        try:
+            with self.get_engine().connect() as conn:
+                version = sql_statements.execute(conn, 'data_version').scalar() or 0
+        except SQLAlchemyError as e:
+            logger.debug(f"Data version unavailable, caching by TTL only: {e}")
+            version = None
+
+        self._version = (time.monotonic(), version)
+        return version
+
+    def cached(self, name, loader, *args):
+        """
+        Result of loader(*args), cached under (name, args) for the current data version
+
+        Args:
+            name (str): Cache key prefix, unique per loader
+            loader (callable): Computes the result
+            *args: Hashable arguments passed to the loader
+
+        Returns:
+            The (possibly cached) result
+        """
+        key = (name,) + args
+        version = self.data_version()
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._results.get(key)
+        if entry is not None:
+            entry_version, expires_at, value = entry
+            if entry_version == version and now < expires_at:
+                return value
+
+        value = loader(*args)
+        with self._lock:
+            self._results[key] = (version, now + self.ttl, value)
+        return value
+
+    def _fetch(self, name, params=None):
+        with self.get_engine().connect() as conn:
+            return [dict(row._mapping) for row in sql_statements.execute(conn, name, params)]
+
+    def dashboard(self, recent_limit=5, top_limit=5):
+        """
+        Everything the dashboard shows, from a single statement
+
+        The three counts, the most recent prescriptions and the most used
+        materials are fetched as one UNION ALL, so a cold dashboard costs one
+        round trip to the database instead of five.
+
+        Args:
+            recent_limit (int): Number of recent prescriptions
+            top_limit (int): Number of top materials
+
+        Returns:
+            dict: counts (materials, prescriptions, efficacy_categories),
+                recent_prescriptions (dicts with id, name, efficacy, created_at) and
+                top_materials (dicts with id, name, property, flavor, usage_frequency)
+        """
+        return self.cached('dashboard', self._load_dashboard, recent_limit, top_limit)
+
+    def _load_dashboard(self, recent_limit, top_limit):
+        rows = self._fetch('dashboard', {'recent_limit': recent_limit, 'top_limit': top_limit})
+
+        snapshot = {
+            'counts': {'materials': 0, 'prescriptions': 0, 'efficacy_categories': 0},
+            'recent_prescriptions': [],
+            'top_materials': [],
+        }
+        for row in rows:
+            section = row['section']
+            if section == 'recent':
+                snapshot['recent_prescriptions'].append({
+                    'id': row['id'], 'name': row['name'], 'efficacy': row['detail'],
+                    'created_at': row['created_at']
+                })
+            elif section == 'top':
+                snapshot['top_materials'].append({
+                    'id': row['id'], 'name': row['name'], 'property': row['detail'],
+                    'flavor': row['flavor'], 'usage_frequency': row['number']
+                })
+            else:
+                snapshot['counts'][section] = row['number']
+        return snapshot
+
+    def material_usage(self, limit=None):
+        """
+        Usage frequency of materials, most used first
+
+        Args:
+            limit (int, optional): Number of materials (all if None)
+
+        Returns:
+            list: Dicts with name and usage_frequency
+        """
+        return self.cached('material_usage', self._load_material_usage, limit)
+
+    def _load_material_usage(self, limit):
+        if limit is None:
+            return self._fetch('material_usage')
+        return self._fetch('material_usage_top', {'limit': limit})
+
+    def distribution(self, dimension):
+        """
+        Number of materials per value of an attribute
+
+        Reads the material_statistic summary table and falls back to a
+        GROUP BY if it has not been filled.
+
+        Args:
+            dimension (str): 'province', 'property', 'flavor' or 'meridian'
+
+        Returns:
+            dict: Value -> count, largest first
+        """
+        if dimension not in sql_statements.DISTRIBUTION_SOURCES:
+            raise ValueError(f"Unknown statistic dimension: {dimension}")
+        return self.cached('distribution', self._load_distribution, dimension)
+
+    def _load_distribution(self, dimension):
+        with self.get_engine().connect() as conn:
+            try:
+                result = sql_statements.execute(conn, 'material_statistic', {'dimension': dimension})
+                counts = {row[0]: row[1] for row in result}
+            except SQLAlchemyError:
+                conn.rollback()
+                counts = {}
+            if counts:
+                return counts
+
+            result = sql_statements.execute(conn, f'distribution_{dimension}')
+            return {row[0]: row[1] for row in result}
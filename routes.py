@@ -1,4 +1,4 @@
-from flask import render_template, request, jsonify, redirect, url_for, flash, session, g
+from flask import render_template, request, jsonify, redirect, url_for, flash, session, g, abort
 from datetime import datetime, timezone
 from functools import wraps
 from app import app, db
@@ -12,9 +12,17 @@ from data_processing import (
     get_province_statistics, get_material_usage_frequency,
     get_property_distribution, get_flavor_distribution, get_meridian_distribution,
     get_top_prescriptions_by_efficacy, get_top_materials_by_efficacy,
-    process_material_upload, process_prescription_upload, search_prescriptions
+    search_prescriptions, repository
 )
-from ml_models import FormulaOptimizer, MaterialClusterer
+from ml_models import model_registry, formula_optimizer_service
+from import_jobs import enqueue_upload, import_worker, job_to_dict, JOB_KINDS
+from serializers import (
+    parse_fields, parse_ids, serialize_prescriptions, serialize_materials,
+    PRESCRIPTION_FIELDS, DEFAULT_PRESCRIPTION_FIELDS, MATERIAL_FIELDS, DEFAULT_MATERIAL_FIELDS
+)
+from http_cache import cached_response
+from db_routing import read_only
+import material_usage  # noqa: F401  (keeps usage_frequency in step with prescription edits)
 from knowledge_graph import (
     build_knowledge_graph, get_material_subgraph,
     get_prescription_subgraph
@@ -23,6 +31,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Pick up import jobs queued before this process started
+import_worker.start()
+
 # User loader from session
 @app.before_request
 def load_logged_in_user():
@@ -300,19 +311,15 @@ def test_auth():
 
 # Home route
 @app.route("/")
+@read_only
 def index():
-    # Get some basic statistics for dashboard
-    total_materials = MedicinalMaterial.query.count()
-    total_prescriptions = Prescription.query.count()
-    total_efficacies = EfficacyCategory.query.count()
-
-    # Get recent prescriptions
-    recent_prescriptions = Prescription.query.order_by(Prescription.created_at.desc()).limit(5).all()
-
-    # Get top used materials
-    top_materials = db.session.query(MedicinalMaterial).order_by(
-        MedicinalMaterial.usage_frequency.desc()
-    ).limit(5).all()
+    # Counts, recent prescriptions and top materials in one query
+    snapshot = repository.dashboard()
+    total_materials = snapshot['counts']['materials']
+    total_prescriptions = snapshot['counts']['prescriptions']
+    total_efficacies = snapshot['counts']['efficacy_categories']
+    recent_prescriptions = snapshot['recent_prescriptions']
+    top_materials = snapshot['top_materials']
 
     # Get current language
     lang = get_language()
@@ -331,6 +338,7 @@ def index():
 
 # Province statistics route
 @app.route("/province-stats")
+@read_only
 def province_stats():
     stats = get_province_statistics()
     lang = get_language()
@@ -353,14 +361,38 @@ def material_stats():
         t=lambda key, *args: get_text(key, lang, *args)
     )
 
+# API endpoint for the dashboard snapshot
+@app.route("/api/dashboard")
+@read_only
+@cached_response
+def api_dashboard():
+    snapshot = repository.dashboard(
+        recent_limit=min(max(request.args.get('recent', 5, type=int), 1), 50),
+        top_limit=min(max(request.args.get('top', 5, type=int), 1), 50)
+    )
+    recent_prescriptions = []
+    for prescription in snapshot['recent_prescriptions']:
+        created_at = prescription['created_at']
+        if isinstance(created_at, datetime):
+            created_at = created_at.isoformat()
+        recent_prescriptions.append(dict(prescription, created_at=created_at))
+    return jsonify({
+        'counts': snapshot['counts'],
+        'recent_prescriptions': recent_prescriptions,
+        'top_materials': snapshot['top_materials']
+    })
+
 # API endpoint for material usage data
 @app.route("/api/material-usage")
+@read_only
+@cached_response
 def api_material_usage():
     data = get_material_usage_frequency()
     return jsonify(data)
 
 # Property, flavor, and meridian distribution route
 @app.route("/property-distribution")
+@read_only
 def property_distribution():
     properties = get_property_distribution()
     flavors = get_flavor_distribution()
@@ -379,6 +411,7 @@ def property_distribution():
 
 # Top prescriptions by efficacy route
 @app.route("/top-prescriptions")
+@read_only
 def top_prescriptions():
     # Get all efficacy categories
     categories = EfficacyCategory.query.all()
@@ -432,10 +465,8 @@ def prescription_entry():
             material_names = request.form.getlist("materials")
             for material_name in material_names:
                 material = MedicinalMaterial.query.filter_by(name=material_name).first()
-                if material:
+                if material and material not in prescription.materials:
                     prescription.materials.append(material)
-                    # Increment usage frequency
-                    material.usage_frequency += 1
 
             # Add efficacy categories
             efficacy_cats = request.form.get("efficacy_categories", "").split(",")
@@ -446,7 +477,8 @@ def prescription_entry():
                     if not category:
                         category = EfficacyCategory(name=cat_name)
                         db.session.add(category)
-                    prescription.efficacy_categories.append(category)
+                    if category not in prescription.efficacy_categories:
+                        prescription.efficacy_categories.append(category)
 
             db.session.add(prescription)
             db.session.commit()
@@ -474,18 +506,22 @@ def prescription_entry():
 
 # Prescription search route
 @app.route("/prescription-search")
+@read_only
 def prescription_search():
     query_params = {
         'name': request.args.get('name', ''),
         'efficacy': request.args.get('efficacy', ''),
         'material': request.args.get('material', ''),
-        'category': request.args.get('category', '')
+        'category': request.args.get('category', ''),
+        'flavor': request.args.get('flavor', ''),
+        'meridian': request.args.get('meridian', '')
     }
+    page = request.args.get('page', 1, type=int)
 
     # Only search if at least one parameter is provided
-    results = []
+    results = None
     if any(query_params.values()):
-        results = search_prescriptions(query_params)
+        results = search_prescriptions(query_params, page=page)
 
     # Get all materials and categories for the search form
     materials = MedicinalMaterial.query.order_by(MedicinalMaterial.name).all()
@@ -514,40 +550,14 @@ def data_import():
             flash("No file selected", "danger")
             return redirect(url_for("data_import"))
 
-        try:
-            file_data = file.read()
-            filename = file.filename
-
-            if import_type == "materials":
-                success_count, error_count, error_messages = process_material_upload(file_data)
-            elif import_type == "prescriptions":
-                success_count, error_count, error_messages = process_prescription_upload(file_data)
-            else:
-                flash("Invalid import type", "danger")
-                return redirect(url_for("data_import"))
-
-            # Log the import
-            status = "success" if error_count == 0 else "partial" if success_count > 0 else "error"
-            error_message = "\n".join(error_messages) if error_messages else None
-
-            import_log = DataImport(
-                filename=filename,
-                import_type=import_type,
-                rows_imported=success_count,
-                status=status,
-                error_message=error_message
-            )
-            db.session.add(import_log)
-            db.session.commit()
-
-            # Flash message
-            if error_count == 0:
-                flash(f"Successfully imported {success_count} {import_type}", "success")
-            else:
-                flash(f"Imported {success_count} {import_type} with {error_count} errors", "warning")
-                for error in error_messages:
-                    flash(error, "danger")
+        if import_type not in JOB_KINDS:
+            flash("Invalid import type", "danger")
+            return redirect(url_for("data_import"))
 
+        try:
+            # Save the file and import it in the background; progress is on the DataImport row
+            job = enqueue_upload(file.read(), file.filename, import_type)
+            flash(f"Import of {file.filename} queued (job #{job.id})", "info")
             return redirect(url_for("data_import"))
 
         except Exception as e:
@@ -580,8 +590,8 @@ def formula_optimization():
             return redirect(url_for("formula_optimization"))
 
         try:
-            # Initialize optimizer
-            optimizer = FormulaOptimizer()
+            # Shared optimizer, refreshed in the background when the data changes
+            optimizer = formula_optimizer_service.get()
 
             # Optimize formula
             result = optimizer.optimize_formula(symptoms, base_materials)
@@ -633,16 +643,23 @@ def knowledge_graph():
 
 # API endpoint for knowledge graph data
 @app.route("/api/knowledge-graph")
+@read_only
+@cached_response
 def api_knowledge_graph():
     material_id = request.args.get('material_id')
     prescription_id = request.args.get('prescription_id')
 
+    # Optional neighborhood controls for subgraph requests
+    hops = min(max(request.args.get('hops', 1, type=int), 1), 3)
+    max_nodes = request.args.get('max_nodes', type=int)
+    edge_types = [t for t in request.args.get('edge_types', '').split(',') if t] or None
+
     if material_id:
         # Get subgraph centered on material
-        graph_data = get_material_subgraph(int(material_id))
+        graph_data = get_material_subgraph(int(material_id), hops, edge_types, max_nodes)
     elif prescription_id:
         # Get subgraph centered on prescription
-        graph_data = get_prescription_subgraph(int(prescription_id))
+        graph_data = get_prescription_subgraph(int(prescription_id), max_nodes)
     else:
         # Get full graph (with limit to avoid browser hanging)
         full_graph = build_knowledge_graph()
@@ -687,62 +704,112 @@ def api_knowledge_graph():
 
 # API endpoint for material clustering
 @app.route("/api/material-clusters")
+@read_only
+@cached_response
 def api_material_clusters():
-    clusterer = MaterialClusterer()
+    clusterer = model_registry.get('material_clusterer')
+    if clusterer is None:
+        return jsonify({"success": False, "message": "Failed to train clustering model"})
     cluster_data = clusterer.get_cluster_data()
     return jsonify(cluster_data)
 
-# API endpoint to get prescription details
-@app.route("/api/prescription/<int:prescription_id>")
-def api_prescription_details(prescription_id):
-    prescription = Prescription.query.get_or_404(prescription_id)
-
-    materials = [
-        {
-            'id': material.id,
-            'name': material.name,
-            'property': material.property,
-            'flavor': material.flavor,
-            'meridian': material.meridian
-        }
-        for material in prescription.materials
-    ]
+# API endpoint to get the status of a background import
+@app.route("/api/import-jobs/<int:job_id>")
+def api_import_job(job_id):
+    job = DataImport.query.get_or_404(job_id)
+    return jsonify(job_to_dict(job))
+
+# API endpoint for paged prescription search
+@app.route("/api/prescriptions/search")
+@read_only
+@cached_response
+def api_prescription_search():
+    query_params = {
+        key: request.args.get(key, '')
+        for key in ('name', 'efficacy', 'material', 'category', 'flavor', 'meridian')
+    }
+    try:
+        results = search_prescriptions(
+            query_params,
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', 20, type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
-    efficacy_categories = [
+    items = [
         {
-            'id': category.id,
-            'name': category.name
+            'id': prescription.id,
+            'name': prescription.name,
+            'efficacy': prescription.efficacy,
+            'materials': [{'id': m.id, 'name': m.name} for m in prescription.materials],
+            'efficacy_categories': [{'id': c.id, 'name': c.name} for c in prescription.efficacy_categories]
         }
-        for category in prescription.efficacy_categories
+        for prescription in results['items']
     ]
 
     return jsonify({
-        'id': prescription.id,
-        'name': prescription.name,
-        'description': prescription.description,
-        'efficacy': prescription.efficacy,
-        'materials': materials,
-        'efficacy_categories': efficacy_categories,
-        'created_at': prescription.created_at.isoformat() if prescription.created_at else None
+        'items': items,
+        'total': results['total'],
+        'page': results['page'],
+        'per_page': results['per_page'],
+        'pages': results['pages'],
+        'next_cursor': results['next_cursor']
     })
 
+# API endpoint to get prescription details
+@app.route("/api/prescription/<int:prescription_id>")
+@read_only
+@cached_response
+def api_prescription_details(prescription_id):
+    try:
+        fields = parse_fields(request.args.get('fields'), PRESCRIPTION_FIELDS, DEFAULT_PRESCRIPTION_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    items = serialize_prescriptions([prescription_id], fields)
+    if not items:
+        abort(404)
+    return jsonify(items[0])
+
+# API endpoint to get the details of several prescriptions: /api/prescriptions?ids=1,2,3
+@app.route("/api/prescriptions")
+@read_only
+@cached_response
+def api_prescriptions():
+    try:
+        ids = parse_ids(request.args.get('ids'))
+        fields = parse_fields(request.args.get('fields'), PRESCRIPTION_FIELDS, DEFAULT_PRESCRIPTION_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    return jsonify(serialize_prescriptions(ids, fields))
+
 # API endpoint to get material details
 @app.route("/api/material/<int:material_id>")
+@read_only
+@cached_response
 def api_material_details(material_id):
-    material = MedicinalMaterial.query.get_or_404(material_id)
-
-    prescription_count = len(material.prescriptions)
+    try:
+        fields = parse_fields(request.args.get('fields'), MATERIAL_FIELDS, DEFAULT_MATERIAL_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    items = serialize_materials([material_id], fields)
+    if not items:
+        abort(404)
+    return jsonify(items[0])
+
+# API endpoint to get the details of several materials: /api/materials?ids=1,2,3
+@app.route("/api/materials")
+@read_only
+@cached_response
+def api_materials():
+    try:
+        ids = parse_ids(request.args.get('ids'))
+        fields = parse_fields(request.args.get('fields'), MATERIAL_FIELDS, DEFAULT_MATERIAL_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
-    return jsonify({
-        'id': material.id,
-        'name': material.name,
-        'pinyin': material.pinyin,
-        'english_name': material.english_name,
-        'province_origin': material.province_origin,
-        'property': material.property,
-        'flavor': material.flavor,
-        'meridian': material.meridian,
-        'description': material.description,
-        'usage_frequency': material.usage_frequency,
-        'prescription_count': prescription_count
-    })
+    return jsonify(serialize_materials(ids, fields))
@@ -0,0 +1,366 @@
+"""
+Indexed, ranked prescription search
+
+Leading-wildcard ILIKE filters cannot use B-tree indexes, so the search
+runs on text indexes instead:
+
+- Postgres: pg_trgm GIN indexes on the searched name columns (ILIKE
+  '%term%' becomes an index lookup) and a generated tsvector column on
+  prescription for ranking efficacy and description matches.
+- SQLite: FTS5 tables with the trigram tokenizer, kept in sync with their
+  base tables by triggers. Terms shorter than three characters cannot use
+  a trigram index and fall back to LIKE.
+
+Other databases, or databases where install() has not run yet, use plain
+ILIKE filters. Every backend returns ranked, paginated results.
+"""
+import base64
+import binascii
+import json
+import logging
+import threading
+
+from sqlalchemy import Float, Integer, and_, bindparam, exists, func, literal, literal_column, or_, select, text
+from sqlalchemy.orm import selectinload
+
+from app import db
+from models import (
+    MedicinalMaterial, Prescription, EfficacyCategory,
+    prescription_material, prescription_efficacy
+)
+from material_attributes import material_ids_with
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+# Text search configuration for the tsvector column; 'simple' does not stem, which suits Chinese names
+TS_CONFIG = 'simple'
+
+POSTGRES_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_prescription_name_trgm ON prescription USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_prescription_efficacy_trgm ON prescription USING gin (efficacy gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_medicinal_material_name_trgm ON medicinal_material USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_efficacy_category_name_trgm ON efficacy_category USING gin (name gin_trgm_ops)",
+    f"""ALTER TABLE prescription ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('{TS_CONFIG}',
+            coalesce(name, '') || ' ' || coalesce(efficacy, '') || ' ' || coalesce(description, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_prescription_search_vector ON prescription USING gin (search_vector)",
+]
+
+# FTS5 tables: name -> (base table, indexed columns)
+SQLITE_FTS_TABLES = {
+    'prescription_fts': ('prescription', ('name', 'efficacy', 'description')),
+    'medicinal_material_fts': ('medicinal_material', ('name',)),
+    'efficacy_category_fts': ('efficacy_category', ('name',)),
+}
+
+
+def _sqlite_statements():
+    statements = []
+    for fts, (table, columns) in SQLITE_FTS_TABLES.items():
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        delete_old = (f"INSERT INTO {fts}({fts}, rowid, {column_list}) "
+                      f"VALUES ('delete', old.id, {old_values});")
+        insert_new = f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values});"
+
+        statements += [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{column_list}, content='{table}', content_rowid='id', tokenize='trigram')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete_old} END",
+            # Only updates of indexed columns touch the index (usage_frequency is rewritten per link insert);
+            # dropped first so databases with the older every-column trigger get this one
+            f"DROP TRIGGER IF EXISTS {fts}_au",
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {column_list} ON {table} BEGIN {delete_old} {insert_new} END",
+            f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+        ]
+    return statements
+
+
+def install(connection):
+    """
+    Create the search indexes for the connection's database (idempotent)
+
+    Args:
+        connection: Connection of the transaction to run the DDL in
+
+    Returns:
+        bool: False if the database has no supported text index
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        statements = POSTGRES_STATEMENTS
+    elif dialect == 'sqlite':
+        statements = _sqlite_statements()
+    else:
+        return False
+
+    for statement in statements:
+        connection.execute(text(statement))
+    _backend_cache.clear()
+    return True
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _contains(column, term):
+    return column.ilike(f"%{_escape_like(term)}%", escape='\\')
+
+
+class LikeSearch:
+    """ILIKE filters; the fallback when no text index is installed"""
+    name = 'like'
+
+    def prescription_filter(self, term, column):
+        return _contains(column, term), literal(0.0)
+
+    def material_filter(self, term):
+        return _contains(MedicinalMaterial.name, term)
+
+    def category_filter(self, term):
+        return _contains(EfficacyCategory.name, term)
+
+
+class PostgresSearch(LikeSearch):
+    """pg_trgm indexes for substring filters, the tsvector column for ranking"""
+    name = 'postgresql'
+
+    def prescription_filter(self, term, column):
+        if column is Prescription.name:
+            return _contains(column, term), func.similarity(column, term)
+
+        # The vector also covers name and description, so it only ranks; the trigram index filters
+        vector = literal_column('prescription.search_vector')
+        query = func.plainto_tsquery(TS_CONFIG, term)
+        return _contains(column, term), func.ts_rank(vector, query) + func.word_similarity(term, column)
+
+
+class SqliteSearch(LikeSearch):
+    """FTS5 trigram tables ranked by bm25; terms under three characters fall back to LIKE"""
+    name = 'sqlite'
+
+    @staticmethod
+    def _match_expression(column, term):
+        return f'{column} : "' + term.replace('"', '""') + '"'
+
+    def _matching_ids(self, fts, column, term):
+        return text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :match").bindparams(
+            bindparam('match', self._match_expression(column, term), unique=True)
+        ).columns(rowid=Integer)
+
+    def prescription_filter(self, term, column):
+        if len(term) < 3:
+            return super().prescription_filter(term, column)
+
+        matched = Prescription.id.in_(self._matching_ids('prescription_fts', column.key, term))
+        # bm25() is negative, lower is better; it is only available in a query on the FTS table
+        score = text(
+            "SELECT -bm25(prescription_fts) FROM prescription_fts "
+            "WHERE prescription_fts MATCH :match AND rowid = prescription.id"
+        ).bindparams(
+            bindparam('match', self._match_expression(column.key, term), unique=True)
+        ).columns(score=Float).scalar_subquery()
+        return matched, score
+
+    def material_filter(self, term):
+        if len(term) < 3:
+            return super().material_filter(term)
+        return MedicinalMaterial.id.in_(self._matching_ids('medicinal_material_fts', 'name', term))
+
+    def category_filter(self, term):
+        if len(term) < 3:
+            return super().category_filter(term)
+        return EfficacyCategory.id.in_(self._matching_ids('efficacy_category_fts', 'name', term))
+
+
+_backend_cache = {}
+_backend_lock = threading.Lock()
+
+
+def _detect_backend():
+    bind = db.session.get_bind()
+    dialect = bind.dialect.name
+
+    if dialect == 'postgresql':
+        installed = db.session.execute(text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = 'prescription' AND column_name = 'search_vector'"
+        )).scalar()
+        return PostgresSearch() if installed else LikeSearch()
+
+    if dialect == 'sqlite':
+        # FTS tables are cheap to create, so local databases get them on first use
+        try:
+            with bind.begin() as connection:
+                installed = connection.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'prescription_fts'"
+                )).scalar()
+                if not installed:
+                    install(connection)
+            return SqliteSearch()
+        except Exception as e:
+            logger.warning(f"SQLite FTS5 trigram search unavailable, using LIKE: {e}")
+            return LikeSearch()
+
+    return LikeSearch()
+
+
+def get_backend():
+    """Search backend for the current database, detected once per engine"""
+    key = db.session.get_bind().url
+    with _backend_lock:
+        backend = _backend_cache.get(key)
+        if backend is None:
+            backend = _backend_cache[key] = _detect_backend()
+            logger.info(f"Prescription search backend: {backend.name}")
+        return backend
+
+
+def _attribute_filter(attribute, value):
+    pm = prescription_material.c
+    return exists().where(
+        pm.prescription_id == Prescription.id,
+        pm.material_id.in_(material_ids_with(attribute, value))
+    )
+
+
+def ranked_search(query_params):
+    """
+    Select of (id, rank) for the prescriptions matching the query parameters
+
+    Args:
+        query_params (dict): name, efficacy, material, category, flavor, meridian
+
+    Returns:
+        Select: Columns id and rank (higher is better), or None if no parameter is set
+    """
+    backend = get_backend()
+    conditions = []
+    rank = literal(0.0)
+
+    for key, column in (('name', Prescription.name), ('efficacy', Prescription.efficacy)):
+        term = (query_params.get(key) or '').strip()
+        if term:
+            matched, score = backend.prescription_filter(term, column)
+            conditions.append(matched)
+            rank = rank + score
+
+    material = (query_params.get('material') or '').strip()
+    if material:
+        pm = prescription_material.c
+        conditions.append(exists().where(
+            pm.prescription_id == Prescription.id,
+            pm.material_id == MedicinalMaterial.id,
+            backend.material_filter(material)
+        ))
+
+    category = (query_params.get('category') or '').strip()
+    if category:
+        pe = prescription_efficacy.c
+        conditions.append(exists().where(
+            pe.prescription_id == Prescription.id,
+            pe.efficacy_category_id == EfficacyCategory.id,
+            backend.category_filter(category)
+        ))
+
+    for attribute in ('flavor', 'meridian'):
+        value = (query_params.get(attribute) or '').strip()
+        if value:
+            conditions.append(_attribute_filter(attribute, value))
+
+    if not conditions:
+        return None
+
+    return select(Prescription.id.label('id'), rank.label('rank')).where(and_(*conditions))
+
+
+def encode_cursor(rank, prescription_id):
+    """Opaque cursor for the position after a result"""
+    return base64.urlsafe_b64encode(json.dumps([rank, prescription_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Position encoded by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        rank, prescription_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(prescription_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"Invalid search cursor: {cursor}") from e
+
+
+def search_prescriptions(query_params, page=1, per_page=DEFAULT_PER_PAGE, cursor=None, with_total=True):
+    """
+    Ranked, paginated prescription search
+
+    Results are ordered by (rank desc, id). Pages can be addressed by
+    number (OFFSET) or, for deep or streamed paging, by the cursor of the
+    previous page (keyset: cost independent of the position). Materials and
+    efficacy categories of the returned prescriptions are loaded with one
+    query each. Matches use EXISTS subqueries, so no prescription appears twice.
+
+    Args:
+        query_params (dict): name, efficacy, material, category, flavor, meridian
+        page (int): 1-based page number, ignored when a cursor is given
+        per_page (int): Results per page (at most MAX_PER_PAGE)
+        cursor (str): next_cursor of the previous page
+        with_total (bool): Whether to count all matches (an extra query)
+
+    Returns:
+        dict: items (Prescription objects, best match first), total, page,
+            per_page, pages and next_cursor (None on the last page); total
+            and pages are None without with_total
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    page = max(int(page or 1), 1)
+    per_page = min(max(int(per_page or DEFAULT_PER_PAGE), 1), MAX_PER_PAGE)
+    result = {'items': [], 'total': 0, 'page': page, 'per_page': per_page, 'pages': 0, 'next_cursor': None}
+
+    matches = ranked_search(query_params)
+    if matches is None:
+        return result
+
+    matches = matches.subquery()
+    if with_total:
+        result['total'] = db.session.execute(select(func.count()).select_from(matches)).scalar()
+        result['pages'] = (result['total'] + per_page - 1) // per_page
+    else:
+        result['total'] = result['pages'] = None
+
+    query = select(matches.c.id, matches.c.rank).order_by(matches.c.rank.desc(), matches.c.id)
+    if cursor:
+        after_rank, after_id = decode_cursor(cursor)
+        query = query.where(or_(
+            matches.c.rank < after_rank,
+            and_(matches.c.rank == after_rank, matches.c.id > after_id)
+        ))
+    else:
+        query = query.offset((page - 1) * per_page)
+
+    # One extra row tells whether there is a next page
+    rows = db.session.execute(query.limit(per_page + 1)).all()
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        result['next_cursor'] = encode_cursor(float(rows[-1].rank), rows[-1].id)
+
+    ids = [row.id for row in rows]
+    if ids:
+        prescriptions = {p.id: p for p in Prescription.query.options(
+            selectinload(Prescription.materials),
+            selectinload(Prescription.efficacy_categories)
+        ).filter(Prescription.id.in_(ids))}
+        result['items'] = [prescriptions[i] for i in ids if i in prescriptions]
+    return result
@@ -0,0 +1,173 @@
+"""
+JSON serialization of prescriptions and medicinal materials for the API
+
+Serializers work on batches of ids with a fixed number of queries: one for
+the rows (with COUNT subqueries for the count fields) and one selectinload
+per requested relationship. Callers choose the fields to return, so a
+client that only needs names does not pay for relationships.
+"""
+from sqlalchemy import func, null, select
+from sqlalchemy.orm import selectinload
+
+from app import db
+from models import MedicinalMaterial, Prescription, prescription_material
+
+# Largest number of ids accepted by a batch request
+MAX_BATCH = 100
+
+PRESCRIPTION_FIELDS = (
+    'id', 'name', 'description', 'efficacy', 'materials', 'efficacy_categories',
+    'material_count', 'created_at',
+)
+DEFAULT_PRESCRIPTION_FIELDS = (
+    'id', 'name', 'description', 'efficacy', 'materials', 'efficacy_categories', 'created_at',
+)
+
+MATERIAL_FIELDS = (
+    'id', 'name', 'pinyin', 'english_name', 'province_origin', 'property', 'flavor',
+    'meridian', 'description', 'usage_frequency', 'prescription_count',
+)
+DEFAULT_MATERIAL_FIELDS = MATERIAL_FIELDS
+
+
+def parse_fields(value, allowed, default):
+    """
+    Parse a ?fields= parameter
+
+    Args:
+        value (str): Comma-separated field names, or empty for the defaults
+        allowed (tuple): Names that may be requested
+        default (tuple): Fields returned when none are requested
+
+    Returns:
+        tuple: Requested field names ('id' is always included)
+
+    Raises:
+        ValueError: If an unknown field is requested
+    """
+    if not value:
+        return default
+
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(['id'] + [field for field in fields if field != 'id'])
+
+
+def parse_ids(value):
+    """
+    Parse an ?ids= parameter
+
+    Args:
+        value (str): Comma-separated ids, e.g. '1,2,3'
+
+    Returns:
+        list: Distinct ids in the requested order
+
+    Raises:
+        ValueError: If an id is not an integer or too many ids are requested
+    """
+    ids = []
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            item = int(part)
+        except ValueError:
+            raise ValueError(f"Invalid id: {part}")
+        if item not in ids:
+            ids.append(item)
+
+    if len(ids) > MAX_BATCH:
+        raise ValueError(f"At most {MAX_BATCH} ids can be requested at once")
+    return ids
+
+
+def _material_summary(material):
+    return {
+        'id': material.id,
+        'name': material.name,
+        'property': material.property,
+        'flavor': material.flavor,
+        'meridian': material.meridian
+    }
+
+
+def serialize_prescriptions(ids, fields=DEFAULT_PRESCRIPTION_FIELDS):
+    """
+    Serialize prescriptions by id
+
+    Args:
+        ids (list): Prescription ids
+        fields (tuple): Field names from PRESCRIPTION_FIELDS
+
+    Returns:
+        list: One dict per existing prescription, in the order of ids
+    """
+    if not ids:
+        return []
+
+    options = []
+    if 'materials' in fields:
+        options.append(selectinload(Prescription.materials))
+    if 'efficacy_categories' in fields:
+        options.append(selectinload(Prescription.efficacy_categories))
+
+    pm = prescription_material.c
+    material_count = (
+        select(func.count()).where(pm.prescription_id == Prescription.id).scalar_subquery()
+        if 'material_count' in fields else null()
+    )
+    query = select(Prescription, material_count).options(*options).where(Prescription.id.in_(ids))
+    rows = {row[0].id: row for row in db.session.execute(query)}
+
+    result = []
+    for prescription_id in ids:
+        if prescription_id not in rows:
+            continue
+        prescription, material_count = rows[prescription_id]
+        data = {}
+        for field in fields:
+            if field == 'materials':
+                data[field] = [_material_summary(material) for material in prescription.materials]
+            elif field == 'efficacy_categories':
+                data[field] = [{'id': category.id, 'name': category.name}
+                               for category in prescription.efficacy_categories]
+            elif field == 'material_count':
+                data[field] = material_count
+            elif field == 'created_at':
+                data[field] = prescription.created_at.isoformat() if prescription.created_at else None
+            else:
+                data[field] = getattr(prescription, field)
+        result.append(data)
+    return result
+
+
+def serialize_materials(ids, fields=DEFAULT_MATERIAL_FIELDS):
+    """
+    Serialize medicinal materials by id
+
+    Args:
+        ids (list): Material ids
+        fields (tuple): Field names from MATERIAL_FIELDS
+
+    Returns:
+        list: One dict per existing material, in the order of ids
+    """
+    if not ids:
+        return []
+
+    columns = [getattr(MedicinalMaterial, field) for field in fields if field != 'prescription_count']
+    if 'prescription_count' in fields:
+        pm = prescription_material.c
+        columns.append(
+            select(func.count()).where(pm.material_id == MedicinalMaterial.id)
+            .scalar_subquery().label('prescription_count')
+        )
+
+    rows = {row.id: row._mapping for row in db.session.execute(
+        select(*columns).where(MedicinalMaterial.id.in_(ids))
+    )}
+    return [{field: rows[material_id][field] for field in fields} for material_id in ids if material_id in rows]
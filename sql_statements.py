@@ -0,0 +1,197 @@
+"""
+Registry of named, parameterized SQL statements
+
+Raw SQL used by the shared read queries (repository.py) is declared here
+once, with bound parameters only; no value is ever formatted into the SQL.
+Each statement is turned into a single text() construct at import time, so
+SQLAlchemy compiles it once and reuses the compiled form from its cache.
+
+On PostgreSQL the statements can additionally be prepared on the server,
+once per connection (PREPARE ... / EXECUTE ...), which skips parsing and
+planning on every later call. This is off by default: set SQL_PREPARE=1 to
+enable it. Server-side prepared statements belong to a database session, so
+they do not work through a pgbouncer in transaction pooling mode (such as
+the Neon '-pooler' endpoint) unless it tracks prepared statements
+(pgbouncer >= 1.21 with max_prepared_statements); use a direct connection
+when enabling it.
+"""
+import logging
+import os
+import re
+
+from sqlalchemy import DateTime, text
+
+logger = logging.getLogger(__name__)
+
+# Prepare statements on the PostgreSQL server (see the module docstring)
+PREPARE = os.environ.get("SQL_PREPARE", "0").lower() in ('1', 'true', 'yes')
+
+# Key in the DBAPI connection's info dict holding the names prepared on it
+_PREPARED_KEY = 'sql_statements.prepared'
+
+_PARAM = re.compile(r"(?<!:):(\w+)")
+
+
+class Statement:
+    """
+    A named SQL statement with bound parameters
+
+    Args:
+        name (str): Registry name, also used as the server-side statement name
+        sql (str): SQL with :name parameters
+        params (tuple): (parameter name, PostgreSQL type) pairs, in any order
+        column_types (dict): Result column name -> SQLAlchemy type, for columns
+            the driver does not convert itself (e.g. timestamps on SQLite)
+    """
+
+    def __init__(self, name, sql, params=(), column_types=None):
+        self.name = name
+        self.sql = sql
+        self.params = tuple(params)
+        self.clause = text(sql)
+        if column_types:
+            self.clause = self.clause.columns(**column_types)
+
+        # Positional form for PREPARE: :name -> $n
+        positions = {param: i + 1 for i, (param, _) in enumerate(self.params)}
+        self.prepare_sql = _PARAM.sub(lambda m: f"${positions[m.group(1)]}", sql)
+
+    def __repr__(self):
+        return f"<Statement {self.name}>"
+
+
+_statements = {}
+
+
+def register(name, sql, params=(), column_types=None):
+    """
+    Add a statement to the registry
+
+    Returns:
+        Statement: The registered statement
+    """
+    if name in _statements:
+        raise ValueError(f"Statement already registered: {name}")
+    statement = _statements[name] = Statement(name, sql, params, column_types)
+    return statement
+
+
+def get(name):
+    """Registered statement by name"""
+    return _statements[name]
+
+
+def names():
+    """Names of all registered statements"""
+    return sorted(_statements)
+
+
+def _prepared_names(connection):
+    return connection.connection.info.setdefault(_PREPARED_KEY, set())
+
+
+def execute(connection, name, params=None, prepare=None):
+    """
+    Execute a registered statement
+
+    Args:
+        connection: SQLAlchemy connection
+        name (str): Registered statement name
+        params (dict, optional): Parameter values by name
+        prepare (bool, optional): Use a server-side prepared statement on
+            PostgreSQL (defaults to the SQL_PREPARE setting)
+
+    Returns:
+        CursorResult: Result of the statement
+    """
+    statement = _statements[name]
+    params = params or {}
+    if prepare is None:
+        prepare = PREPARE
+
+    if not prepare or connection.dialect.name != 'postgresql':
+        return connection.execute(statement.clause, params)
+
+    prepared = _prepared_names(connection)
+    if name not in prepared:
+        types = ", ".join(pg_type for _, pg_type in statement.params)
+        signature = f"({types})" if types else ""
+        connection.exec_driver_sql(f"PREPARE {name}{signature} AS {statement.prepare_sql}")
+        prepared.add(name)
+
+    if not statement.params:
+        return connection.exec_driver_sql(f"EXECUTE {name}")
+    placeholders = ", ".join(f"%({param})s" for param, _ in statement.params)
+    return connection.exec_driver_sql(
+        f"EXECUTE {name}({placeholders})", {param: params[param] for param, _ in statement.params}
+    )
+
+
+register('data_version', "SELECT version FROM data_version WHERE id = 1")
+
+# Dashboard snapshot as one statement. Every branch has the same columns:
+# section, position, id, name, detail (efficacy or property), flavor,
+# number (count or usage_frequency), created_at
+register('dashboard', """
+    SELECT 'materials' AS section, 0 AS position, CAST(NULL AS INTEGER) AS id,
+           CAST(NULL AS VARCHAR) AS name, CAST(NULL AS VARCHAR) AS detail, CAST(NULL AS VARCHAR) AS flavor,
+           COUNT(*) AS number, CAST(NULL AS TIMESTAMP) AS created_at
+    FROM medicinal_material
+    UNION ALL
+    SELECT 'prescriptions', 0, NULL, NULL, NULL, NULL, COUNT(*), NULL FROM prescription
+    UNION ALL
+    SELECT 'efficacy_categories', 0, NULL, NULL, NULL, NULL, COUNT(*), NULL FROM efficacy_category
+    UNION ALL
+    SELECT 'recent', position, id, name, efficacy, NULL, NULL, created_at FROM (
+        SELECT ROW_NUMBER() OVER (ORDER BY created_at DESC) AS position, id, name, efficacy, created_at
+        FROM prescription
+        ORDER BY created_at DESC
+        LIMIT :recent_limit
+    ) AS recent
+    UNION ALL
+    SELECT 'top', position, id, name, property, flavor, usage_frequency, NULL FROM (
+        SELECT ROW_NUMBER() OVER (ORDER BY usage_frequency DESC) AS position, id, name, property, flavor,
+               usage_frequency
+        FROM medicinal_material
+        ORDER BY usage_frequency DESC
+        LIMIT :top_limit
+    ) AS top_materials
+    ORDER BY section, position
+""", (('recent_limit', 'integer'), ('top_limit', 'integer')), {'created_at': DateTime()})
+
+register('material_usage', """
+    SELECT name, usage_frequency
+    FROM medicinal_material
+    ORDER BY usage_frequency DESC
+""")
+
+register('material_usage_top', """
+    SELECT name, usage_frequency
+    FROM medicinal_material
+    ORDER BY usage_frequency DESC
+    LIMIT :limit
+""", (('limit', 'integer'),))
+
+register('material_statistic', """
+    SELECT value, count
+    FROM material_statistic
+    WHERE dimension = :dimension AND count > 0
+    ORDER BY count DESC, value
+""", (('dimension', 'varchar'),))
+
+# Counts per value when material_statistic has not been filled: dimension -> (table, column)
+DISTRIBUTION_SOURCES = {
+    'province': ('medicinal_material', 'province_origin'),
+    'property': ('medicinal_material', 'property'),
+    'flavor': ('material_flavor', 'flavor'),
+    'meridian': ('material_meridian', 'meridian'),
+}
+
+for _dimension, (_table, _column) in DISTRIBUTION_SOURCES.items():
+    register(f'distribution_{_dimension}', f"""
+        SELECT {_column}, COUNT(*) AS count
+        FROM {_table}
+        WHERE {_column} IS NOT NULL AND {_column} != ''
+        GROUP BY {_column}
+        ORDER BY count DESC
+    """)
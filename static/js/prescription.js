@@ -54,6 +54,47 @@ function initSearchForm() {
     });
 }
 
+// Prescription details already fetched, by id
+const prescriptionCache = new Map();
+
+/**
+ * Fetches the details of several prescriptions in one request
+ * @param {Array<number>} prescriptionIds - IDs of the prescriptions to fetch
+ * @returns {Promise<Map>} Prescription details by id (missing prescriptions are left out)
+ */
+function fetchPrescriptions(prescriptionIds) {
+    const ids = [...new Set(prescriptionIds.map(Number))];
+    const missing = ids.filter(id => !prescriptionCache.has(id));
+
+    // The API accepts at most 100 ids per request
+    const requests = [];
+    for (let i = 0; i < missing.length; i += 100) {
+        const batch = missing.slice(i, i + 100);
+        requests.push(
+            fetch(`/api/prescriptions?ids=${batch.join(',')}`)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(getTranslation('network_error'));
+                    }
+                    return response.json();
+                })
+                .then(prescriptions => {
+                    prescriptions.forEach(prescription => prescriptionCache.set(prescription.id, prescription));
+                })
+        );
+    }
+
+    return Promise.all(requests).then(() => {
+        const result = new Map();
+        ids.forEach(id => {
+            if (prescriptionCache.has(id)) {
+                result.set(id, prescriptionCache.get(id));
+            }
+        });
+        return result;
+    });
+}
+
 /**
  * Loads prescription details via AJAX
  * @param {number} prescriptionId - ID of the prescription to load
@@ -71,15 +112,13 @@ function loadPrescriptionDetails(prescriptionId) {
         </div>
     `;
 
-    // Fetch prescription details
-    fetch(`/api/prescription/${prescriptionId}`)
-        .then(response => {
-            if (!response.ok) {
+    // Fetch prescription details (served from the cache if the search results were prefetched)
+    fetchPrescriptions([prescriptionId])
+        .then(prescriptions => {
+            const prescription = prescriptions.get(Number(prescriptionId));
+            if (!prescription) {
                 throw new Error(getTranslation('network_error'));
             }
-            return response.json();
-        })
-        .then(prescription => {
             // Generate HTML for materials
             const materialsHtml = prescription.materials.map(material => `
                 <div class="col-md-6 mb-2">
@@ -189,6 +228,13 @@ document.addEventListener('DOMContentLoaded', function() {
     initFormulaForm();
     validateFileUpload();
 
+    // Prefetch the details of all listed prescriptions in one round trip
+    const listedIds = Array.from(document.querySelectorAll('[data-prescription-id]'))
+        .map(element => element.dataset.prescriptionId);
+    if (listedIds.length > 0) {
+        fetchPrescriptions(listedIds).catch(error => console.error('Error prefetching prescriptions:', error));
+    }
+
     // Check if we need to load prescription details
     const prescriptionId = new URLSearchParams(window.location.search).get('view_prescription');
     if (prescriptionId) {
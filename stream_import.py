@@ -0,0 +1,218 @@
+"""
+Streaming, resumable CSV importer
+
+The file is read once, a chunk of rows at a time, so memory use does not
+grow with the size of the input. Each chunk is written with the set-based
+functions from bulk_import and committed in one transaction together with
+a checkpoint in its DataImport row: the byte offset of the next unread
+row. If the process dies, running the import again continues from the
+last committed checkpoint.
+
+Usage:
+    python stream_import.py materials data/medicinal_materials.csv
+    python stream_import.py prescriptions data/prescriptions.csv --chunk-size 200
+"""
+import argparse
+import csv
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from app import app, db
+from models import MedicinalMaterial, DataImport
+import bulk_import
+import data_events
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+# Error messages kept on the DataImport row; later ones are only counted
+MAX_ERROR_MESSAGES = 100
+
+# Import kinds: name -> (DataImport.import_type, tables written)
+IMPORT_KINDS = {
+    'materials': ('Medicinal Materials', ('medicinal_material',)),
+    'prescriptions': ('Prescriptions', bulk_import.PRESCRIPTION_TABLES),
+}
+
+
+def read_rows(file, offset=0):
+    """
+    Stream CSV rows from a binary file together with their end offsets
+
+    The first line is the header. Reading starts at the header when offset
+    is 0 and at the given byte offset otherwise; rows are parsed like
+    csv.DictReader (extra values are kept under the None key).
+
+    Args:
+        file: File opened in binary mode
+        offset (int): Byte offset of the first row to read
+
+    Yields:
+        tuple: (row dict, byte offset just past the row)
+    """
+    file.seek(0)
+    header_line = file.readline()
+    header = next(csv.reader([header_line.decode('utf-8-sig')]), [])
+    position = {'offset': max(offset, len(header_line))}
+    file.seek(position['offset'])
+
+    def lines():
+        # csv.reader pulls lines lazily, so the offset always ends at the current row
+        for line in iter(file.readline, b''):
+            position['offset'] += len(line)
+            yield line.decode('utf-8')
+
+    for record in csv.reader(lines()):
+        if not record:
+            continue
+        row = dict(zip(header, record))
+        for field in header[len(record):]:
+            row[field] = None
+        if len(record) > len(header):
+            row[None] = record[len(header):]
+        yield row, position['offset']
+
+
+def read_chunks(file, offset=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Group streamed rows into chunks
+
+    Yields:
+        tuple: (list of row dicts, byte offset just past the last row)
+    """
+    chunk = []
+    end = offset
+    for row, end in read_rows(file, offset):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk, end
+            chunk = []
+    if chunk:
+        yield chunk, end
+
+
+def find_checkpoint(filename, import_type):
+    """Most recent unfinished import of a file, or None"""
+    return DataImport.query.filter_by(
+        filename=filename, import_type=import_type, status='running'
+    ).order_by(DataImport.id.desc()).first()
+
+
+def stream_import(file_path, kind, chunk_size=DEFAULT_CHUNK_SIZE, resume=True, on_progress=None):
+    """
+    Import a CSV file chunk by chunk with a checkpoint after every chunk
+
+    Args:
+        file_path (str): Path to the CSV file
+        kind (str): 'materials' or 'prescriptions'
+        chunk_size (int): Rows per transaction
+        resume (bool): Continue an unfinished import of the same file
+        on_progress (callable, optional): Called after every chunk with
+            (rows processed, bytes read, total bytes, seconds elapsed)
+
+    Returns:
+        tuple: (success_count, error_count, error_messages, DataImport id)
+    """
+    import_type, tables = IMPORT_KINDS[kind]
+    filename = os.path.basename(file_path)
+    total_bytes = os.path.getsize(file_path)
+
+    job = find_checkpoint(filename, import_type) if resume else None
+    if job is not None and (job.checkpoint_offset or 0) > total_bytes:
+        logger.warning(f"Checkpoint of import {job.id} is past the end of {file_path}; starting over")
+        job.status = 'error'
+        job = None
+
+    if job is None:
+        job = DataImport(filename=filename, import_type=import_type, rows_imported=0,
+                         rows_processed=0, checkpoint_offset=0, status='running')
+        db.session.add(job)
+    else:
+        logger.info(f"Resuming import {job.id} of {filename} at byte {job.checkpoint_offset}")
+    db.session.commit()
+
+    error_messages = job.error_message.split('\n') if job.error_message else []
+    error_count = (job.rows_processed or 0) - (job.rows_imported or 0)  # Rows rejected so far
+    start_offset = job.checkpoint_offset or 0
+    started = time.monotonic()
+
+    material_ids = bulk_import.load_name_map(MedicinalMaterial) if kind == 'prescriptions' else None
+
+    try:
+        with open(file_path, 'rb') as file:
+            for chunk, end_offset in read_chunks(file, start_offset, chunk_size):
+                if kind == 'materials':
+                    success, errors, messages = bulk_import.import_material_rows(chunk)
+                else:
+                    success, errors, messages, touched = bulk_import.import_prescription_rows(chunk, material_ids)
+                    bulk_import.recompute_usage_frequency(touched)
+
+                error_count += errors
+                error_messages.extend(messages[:max(MAX_ERROR_MESSAGES - len(error_messages), 0)])
+
+                job.rows_imported = (job.rows_imported or 0) + success
+                job.rows_processed = (job.rows_processed or 0) + len(chunk)
+                job.checkpoint_offset = end_offset
+                job.error_message = '\n'.join(error_messages) or None
+                db.session.commit()
+
+                elapsed = time.monotonic() - started
+                if on_progress is not None:
+                    on_progress(job.rows_processed, end_offset, total_bytes, elapsed)
+                logger.debug(f"Import {job.id}: {job.rows_processed} rows, byte {end_offset}/{total_bytes}")
+    except Exception as e:
+        # The last committed checkpoint stays valid; leave the job running so it can resume
+        db.session.rollback()
+        logger.error(f"Import {job.id} of {filename} stopped at byte {job.checkpoint_offset}: {e}")
+        raise
+    finally:
+        data_events.notify_bulk_change(*tables)
+
+    job.status = 'success' if error_count == 0 else 'partial' if job.rows_imported else 'error'
+    job.import_date = datetime.now(timezone.utc)
+    db.session.commit()
+
+    elapsed = time.monotonic() - started
+    read_bytes = (job.checkpoint_offset or 0) - start_offset
+    logger.info(f"Imported {filename}: {job.rows_imported} rows in {elapsed:.1f}s "
+                f"({read_bytes / max(elapsed, 1e-9) / 1024:.1f} KiB/s)")
+
+    return job.rows_imported, error_count, error_messages, job.id
+
+
+def print_progress(rows_processed, offset, total_bytes, elapsed):
+    """Progress callback for the command line"""
+    percent = 100.0 * offset / total_bytes if total_bytes else 100.0
+    rate = rows_processed / elapsed if elapsed > 0 else 0.0
+    print(f"{rows_processed} rows ({percent:.1f}%) - {rate:.0f} rows/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a CSV file into the database with checkpoints")
+    parser.add_argument('kind', choices=sorted(IMPORT_KINDS))
+    parser.add_argument('file_path')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--restart', action='store_true', help="Ignore any unfinished import of the file")
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        print(f"Importing {args.kind} from {args.file_path}...")
+        success, errors, messages, import_id = stream_import(
+            args.file_path, args.kind, chunk_size=args.chunk_size,
+            resume=not args.restart, on_progress=print_progress
+        )
+        print(f"Import {import_id}: successfully imported {success} {args.kind} with {errors} errors")
+
+        if messages:
+            print("Errors:")
+            for msg in messages:
+                print(f"- {msg}")
+            if errors > len(messages):
+                print(f"... and {errors - len(messages)} more")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,7 @@ print(f"Python path: {sys.path}")
 try:
     import plotly.express as px
     from sqlalchemy import create_engine, text
+    from repository import Repository
 except ImportError as e:
     if 'language' in st.session_state and st.session_state.language == 'zh':
         st.error(f"导入所需包时出错：{e}")
@@ -456,114 +457,37 @@ def get_engine():
             st.error(f"Database connection error: {e}")
         return None
 
-# Database helper functions
-def get_total_materials():
-    engine = get_engine()
-    if not engine:
-        return 0
-    try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("SELECT COUNT(*) FROM medicinal_material"))
-            return result.scalar()
-    except Exception as e:
-        if 'language' in st.session_state and st.session_state.language == 'zh':
-            st.error(f"查询药材时出错：{e}")
-        else:
-            st.error(f"Error querying materials: {e}")
-        return 0
-
-def get_total_prescriptions():
-    engine = get_engine()
-    if not engine:
-        return 0
-    try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("SELECT COUNT(*) FROM prescription"))
-            return result.scalar()
-    except Exception as e:
-        if 'language' in st.session_state and st.session_state.language == 'zh':
-            st.error(f"查询处方时出错：{e}")
-        else:
-            st.error(f"Error querying prescriptions: {e}")
-        return 0
-
-def get_total_efficacy_categories():
-    engine = get_engine()
-    if not engine:
-        return 0
-    try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("SELECT COUNT(*) FROM efficacy_category"))
-            return result.scalar()
-    except Exception as e:
-        if 'language' in st.session_state and st.session_state.language == 'zh':
-            st.error(f"查询功效类别时出错：{e}")
-        else:
-            st.error(f"Error querying efficacy categories: {e}")
-        return 0
-
-def get_recent_prescriptions(limit=5):
-    engine = get_engine()
-    if not engine:
-        return []
-    try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text(f"""
-                SELECT id, name, efficacy, created_at
-                FROM prescription
-                ORDER BY created_at DESC
-                LIMIT {limit}
-            """))
-            # Convert rows to dictionaries using _mapping attribute
-            return [dict(row._mapping) for row in result]
-    except Exception as e:
-        if 'language' in st.session_state and st.session_state.language == 'zh':
-            st.error(f"查询最近处方时出错：{e}")
-        else:
-            st.error(f"Error querying recent prescriptions: {e}")
-        return []
+# Shared, cached queries (see repository.py); reruns reuse results until the data changes
+@st.cache_resource
+def get_repository():
+    return Repository(get_engine)
 
-def get_top_materials(limit=5):
+# Database helper functions
+def get_dashboard():
+    """Counts, recent prescriptions and top materials, fetched in one query"""
+    empty = {
+        'counts': {'materials': 0, 'prescriptions': 0, 'efficacy_categories': 0},
+        'recent_prescriptions': [],
+        'top_materials': []
+    }
     engine = get_engine()
     if not engine:
-        return []
+        return empty
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text(f"""
-                SELECT id, name, property, flavor, usage_frequency
-                FROM medicinal_material
-                ORDER BY usage_frequency DESC
-                LIMIT {limit}
-            """))
-            # Convert rows to dictionaries using _mapping attribute
-            return [dict(row._mapping) for row in result]
+        return get_repository().dashboard()
     except Exception as e:
         if 'language' in st.session_state and st.session_state.language == 'zh':
-            st.error(f"查询热门药材时出错：{e}")
+            st.error(f"查询仪表板数据时出错：{e}")
         else:
-            st.error(f"Error querying top materials: {e}")
-        return []
+            st.error(f"Error querying dashboard data: {e}")
+        return empty
 
 def get_province_statistics():
     engine = get_engine()
     if not engine:
         return {}
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("""
-                SELECT province_origin, COUNT(*) as count
-                FROM medicinal_material
-                WHERE province_origin IS NOT NULL AND province_origin != ''
-                GROUP BY province_origin
-                ORDER BY count DESC
-            """))
-            return {row[0]: row[1] for row in result}
+        return get_repository().distribution('province')
     except Exception as e:
         if 'language' in st.session_state and st.session_state.language == 'zh':
             st.error(f"查询省份统计时出错：{e}")
@@ -576,16 +500,7 @@ def get_material_usage_frequency(limit=20):
     if not engine:
         return []
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text(f"""
-                SELECT name, usage_frequency
-                FROM medicinal_material
-                ORDER BY usage_frequency DESC
-                LIMIT {limit}
-            """))
-            # Convert rows to dictionaries using _mapping attribute
-            return [dict(row._mapping) for row in result]
+        return get_repository().material_usage(limit)
     except Exception as e:
         if 'language' in st.session_state and st.session_state.language == 'zh':
             st.error(f"查询药材使用频率时出错：{e}")
@@ -598,16 +513,7 @@ def get_property_distribution():
     if not engine:
         return {}
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("""
-                SELECT property, COUNT(*) as count
-                FROM medicinal_material
-                WHERE property IS NOT NULL AND property != ''
-                GROUP BY property
-                ORDER BY count DESC
-            """))
-            return {row[0]: row[1] for row in result}
+        return get_repository().distribution('property')
     except Exception as e:
         if 'language' in st.session_state and st.session_state.language == 'zh':
             st.error(f"查询性质分布时出错：{e}")
@@ -620,16 +526,7 @@ def get_flavor_distribution():
     if not engine:
         return {}
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("""
-                SELECT flavor, COUNT(*) as count
-                FROM medicinal_material
-                WHERE flavor IS NOT NULL AND flavor != ''
-                GROUP BY flavor
-                ORDER BY count DESC
-            """))
-            return {row[0]: row[1] for row in result}
+        return get_repository().distribution('flavor')
     except Exception as e:
         if 'language' in st.session_state and st.session_state.language == 'zh':
             st.error(f"查询味道分布时出错：{e}")
@@ -642,16 +539,7 @@ def get_meridian_distribution():
     if not engine:
         return {}
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("""
-                SELECT meridian, COUNT(*) as count
-                FROM medicinal_material
-                WHERE meridian IS NOT NULL AND meridian != ''
-                GROUP BY meridian
-                ORDER BY count DESC
-            """))
-            return {row[0]: row[1] for row in result}
+        return get_repository().distribution('meridian')
     except Exception as e:
         if 'language' in st.session_state and st.session_state.language == 'zh':
             st.error(f"查询归经分布时出错：{e}")
@@ -805,20 +693,21 @@ def dashboard_page():
         st.success(get_text('health_check_ok'))
 
     # Statistics
+    snapshot = get_dashboard()
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric(get_text('total_materials'), get_total_materials())
+        st.metric(get_text('total_materials'), snapshot['counts']['materials'])
     with col2:
-        st.metric(get_text('total_prescriptions'), get_total_prescriptions())
+        st.metric(get_text('total_prescriptions'), snapshot['counts']['prescriptions'])
     with col3:
-        st.metric(get_text('total_efficacies'), get_total_efficacy_categories())
+        st.metric(get_text('total_efficacies'), snapshot['counts']['efficacy_categories'])
 
     # Recent prescriptions and top materials
     col1, col2 = st.columns(2)
 
     with col1:
         st.subheader(get_text('recent_prescriptions'))
-        prescriptions = get_recent_prescriptions()
+        prescriptions = snapshot['recent_prescriptions']
         if prescriptions:
             df = pd.DataFrame(prescriptions)
             df = df.rename(columns={
@@ -831,7 +720,7 @@ def dashboard_page():
 
     with col2:
         st.subheader(get_text('top_materials'))
-        materials = get_top_materials()
+        materials = snapshot['top_materials']
         if materials:
             df = pd.DataFrame(materials)
             df = df.rename(columns={
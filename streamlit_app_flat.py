@@ -20,6 +20,7 @@ try:
     import plotly.graph_objects as go
     import numpy as np
     from sqlalchemy import create_engine, text
+    from repository import Repository
     from chinese_converter import to_simplified, to_traditional
 except ImportError as e:
     st.error(f"Error importing required packages: {e}")
@@ -139,99 +140,34 @@ def get_engine():
         st.error(f"Database connection error: {e}")
         return None
 
-# Database helper functions
-def get_total_materials():
-    engine = get_engine()
-    if not engine:
-        return 0
-    try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("SELECT COUNT(*) FROM medicinal_material"))
-            return result.scalar()
-    except Exception as e:
-        st.error(f"Error querying materials: {e}")
-        return 0
-
-def get_total_prescriptions():
-    engine = get_engine()
-    if not engine:
-        return 0
-    try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("SELECT COUNT(*) FROM prescription"))
-            return result.scalar()
-    except Exception as e:
-        st.error(f"Error querying prescriptions: {e}")
-        return 0
-
-def get_total_efficacy_categories():
-    engine = get_engine()
-    if not engine:
-        return 0
-    try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("SELECT COUNT(*) FROM efficacy_category"))
-            return result.scalar()
-    except Exception as e:
-        st.error(f"Error querying efficacy categories: {e}")
-        return 0
-
-def get_recent_prescriptions(limit=5):
-    engine = get_engine()
-    if not engine:
-        return []
-    try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text(f"""
-                SELECT id, name, efficacy, created_at
-                FROM prescription
-                ORDER BY created_at DESC
-                LIMIT {limit}
-            """))
-            # Convert rows to dictionaries using _mapping attribute
-            return [dict(row._mapping) for row in result]
-    except Exception as e:
-        st.error(f"Error querying recent prescriptions: {e}")
-        return []
+# Shared, cached queries (see repository.py); reruns reuse results until the data changes
+@st.cache_resource
+def get_repository():
+    return Repository(get_engine)
 
-def get_top_materials(limit=5):
+# Database helper functions
+def get_dashboard():
+    """Counts, recent prescriptions and top materials, fetched in one query"""
+    empty = {
+        'counts': {'materials': 0, 'prescriptions': 0, 'efficacy_categories': 0},
+        'recent_prescriptions': [],
+        'top_materials': []
+    }
     engine = get_engine()
     if not engine:
-        return []
+        return empty
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text(f"""
-                SELECT id, name, property, flavor, usage_frequency
-                FROM medicinal_material
-                ORDER BY usage_frequency DESC
-                LIMIT {limit}
-            """))
-            # Convert rows to dictionaries using _mapping attribute
-            return [dict(row._mapping) for row in result]
+        return get_repository().dashboard()
     except Exception as e:
-        st.error(f"Error querying top materials: {e}")
-        return []
+        st.error(f"Error querying dashboard data: {e}")
+        return empty
 
 def get_province_statistics():
     engine = get_engine()
     if not engine:
         return {}
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("""
-                SELECT province_origin, COUNT(*) as count
-                FROM medicinal_material
-                WHERE province_origin IS NOT NULL AND province_origin != ''
-                GROUP BY province_origin
-                ORDER BY count DESC
-            """))
-            return {row[0]: row[1] for row in result}
+        return get_repository().distribution('province')
     except Exception as e:
         st.error(f"Error querying province statistics: {e}")
         return {}
@@ -241,16 +177,7 @@ def get_material_usage_frequency(limit=20):
     if not engine:
         return []
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text(f"""
-                SELECT name, usage_frequency
-                FROM medicinal_material
-                ORDER BY usage_frequency DESC
-                LIMIT {limit}
-            """))
-            # Convert rows to dictionaries using _mapping attribute
-            return [dict(row._mapping) for row in result]
+        return get_repository().material_usage(limit)
     except Exception as e:
         st.error(f"Error querying material usage frequency: {e}")
         return []
@@ -260,16 +187,7 @@ def get_property_distribution():
     if not engine:
         return {}
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("""
-                SELECT property, COUNT(*) as count
-                FROM medicinal_material
-                WHERE property IS NOT NULL AND property != ''
-                GROUP BY property
-                ORDER BY count DESC
-            """))
-            return {row[0]: row[1] for row in result}
+        return get_repository().distribution('property')
     except Exception as e:
         st.error(f"Error querying property distribution: {e}")
         return {}
@@ -279,16 +197,7 @@ def get_flavor_distribution():
     if not engine:
         return {}
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("""
-                SELECT flavor, COUNT(*) as count
-                FROM medicinal_material
-                WHERE flavor IS NOT NULL AND flavor != ''
-                GROUP BY flavor
-                ORDER BY count DESC
-            """))
-            return {row[0]: row[1] for row in result}
+        return get_repository().distribution('flavor')
     except Exception as e:
         st.error(f"Error querying flavor distribution: {e}")
         return {}
@@ -298,16 +207,7 @@ def get_meridian_distribution():
     if not engine:
         return {}
     try:
-        with engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text("""
-                SELECT meridian, COUNT(*) as count
-                FROM medicinal_material
-                WHERE meridian IS NOT NULL AND meridian != ''
-                GROUP BY meridian
-                ORDER BY count DESC
-            """))
-            return {row[0]: row[1] for row in result}
+        return get_repository().distribution('meridian')
     except Exception as e:
         st.error(f"Error querying meridian distribution: {e}")
         return {}
@@ -364,20 +264,21 @@ def dashboard_page():
         st.success("Health check: OK")
 
     # Statistics
+    snapshot = get_dashboard()
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric(get_text('total_materials'), get_total_materials())
+        st.metric(get_text('total_materials'), snapshot['counts']['materials'])
     with col2:
-        st.metric(get_text('total_prescriptions'), get_total_prescriptions())
+        st.metric(get_text('total_prescriptions'), snapshot['counts']['prescriptions'])
     with col3:
-        st.metric(get_text('total_efficacies'), get_total_efficacy_categories())
+        st.metric(get_text('total_efficacies'), snapshot['counts']['efficacy_categories'])
 
     # Recent prescriptions and top materials
     col1, col2 = st.columns(2)
 
     with col1:
         st.subheader(get_text('recent_prescriptions'))
-        prescriptions = get_recent_prescriptions()
+        prescriptions = snapshot['recent_prescriptions']
         if prescriptions:
             df = pd.DataFrame(prescriptions)
             df = df.rename(columns={
@@ -390,7 +291,7 @@ def dashboard_page():
 
     with col2:
         st.subheader(get_text('top_materials'))
-        materials = get_top_materials()
+        materials = snapshot['top_materials']
         if materials:
             df = pd.DataFrame(materials)
             df = df.rename(columns={
@@ -0,0 +1,37 @@
+"""Regression tests for the CSV chunker in csv_rows"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csv_rows import parse_chunk, split_lines  # noqa: E402
+
+HEADER = ['name', 'property', 'description']
+
+
+def test_parse_chunk_keeps_unicode_line_separators_in_fields():
+    text = '甘草,Neutral,Harmonizes\u2028herbs\n黄芪,Warm,Tonifies\x0cqi\n'
+
+    rows, errors = parse_chunk('materials', HEADER, 2, text)
+
+    assert errors == []
+    assert [values['name'] for _, values in rows] == ['甘草', '黄芪']
+    assert rows[0][1]['description'] == 'Harmonizes\u2028herbs'
+    assert [line for line, _ in rows] == [2, 3]
+
+
+def test_split_lines_only_cuts_at_newlines():
+    text = 'a,Warm,x\u2029y\nb,Cold,z\x1ew\nc,Hot,v\n'
+
+    chunks = list(split_lines(text, 1))
+
+    assert [start for start, _ in chunks] == [0, 1, 2]
+    assert ''.join(chunk for _, chunk in chunks) == text
+
+
+def test_split_lines_keeps_quoted_multiline_fields_together():
+    text = 'a,Warm,"first\nsecond"\nb,Cold,plain\n'
+
+    chunks = list(split_lines(text, 1))
+
+    assert chunks == [(0, 'a,Warm,"first\nsecond"\n'), (2, 'b,Cold,plain\n')]
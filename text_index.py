@@ -0,0 +1,121 @@
+"""
+BM25 text index for short Chinese and English documents
+
+Chinese text is segmented with jieba; Latin text is lowercased and split
+into words. Queries only touch the posting lists of their own terms, so
+lookups do not scan the whole corpus.
+"""
+import logging
+import math
+import re
+from collections import Counter
+
+import jieba
+
+jieba.setLogLevel(logging.WARNING)
+
+# Tokens worth indexing: at least one letter, digit or CJK character
+_WORD = re.compile(r"[0-9a-z一-鿿]")
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'as', 'at', 'by', 'for', 'from', 'in', 'is', 'of', 'on', 'or', 'the', 'to', 'with',
+    '的', '和', '与', '及', '或'
+}
+
+
+def tokenize(text):
+    """
+    Split text into index terms
+
+    Args:
+        text (str): Chinese and/or English text
+
+    Returns:
+        list: Lowercased terms, with stop words and punctuation removed
+    """
+    if not text:
+        return []
+
+    terms = []
+    for token in jieba.cut_for_search(text.lower()):
+        token = token.strip()
+        if token and token not in STOP_WORDS and _WORD.search(token):
+            terms.append(token)
+    return terms
+
+
+class BM25Index:
+    """
+    Inverted index with Okapi BM25 ranking
+
+    Args:
+        k1 (float): Term frequency saturation
+        b (float): Document length normalization
+    """
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}      # term -> {doc_id: term frequency}
+        self.doc_lengths = {}   # doc_id -> number of terms
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id, text):
+        """
+        Index a document, replacing any previous version of it
+
+        Args:
+            doc_id: Document key returned by search()
+            text (str): Document text
+        """
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+
+        terms = tokenize(text)
+        for term, frequency in Counter(terms).items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.doc_lengths[doc_id] = len(terms)
+        self._total_length += len(terms)
+
+    def remove(self, doc_id):
+        """Remove a document from the index"""
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in list(self.postings):
+            docs = self.postings[term]
+            if docs.pop(doc_id, None) is not None and not docs:
+                del self.postings[term]
+
+    def search(self, query, limit=None):
+        """
+        Rank documents against a query
+
+        Args:
+            query (str): Query text
+            limit (int, optional): Maximum number of results
+
+        Returns:
+            list: (doc_id, score) tuples, best match first
+        """
+        if not self.doc_lengths:
+            return []
+
+        doc_count = len(self.doc_lengths)
+        average_length = self._total_length / doc_count or 1.0
+        scores = Counter()
+
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, frequency in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return scores.most_common(limit)
@@ -126,6 +126,8 @@ translations = {
         'status': 'Status',
         'success': 'Success',
         'partial': 'Partial',
+        'queued': 'Queued',
+        'processing': 'Processing',
         'error': 'Error',
         'import_errors': 'Import Errors',
         'close': 'Close',
@@ -279,6 +281,9 @@ translations = {
         'search_by_category': 'Search by Category',
         'search_results': 'Search Results',
         'no_results': 'No results found for your search criteria.',
+        'results_found': '{0} found',
+        'previous_page': 'Previous',
+        'next_page': 'Next',
         'property_label': 'Property',
         'flavor_label': 'Flavor',
         'meridian_label': 'Meridian',
@@ -474,6 +479,8 @@ translations = {
         'status': '状态',
         'success': '成功',
         'partial': '部分成功',
+        'queued': '排队中',
+        'processing': '处理中',
         'error': '错误',
         'import_errors': '导入错误',
         'close': '关闭',
@@ -627,6 +634,9 @@ translations = {
         'search_by_category': '按类别搜索',
         'search_results': '搜索结果',
         'no_results': '没有找到符合您搜索条件的结果。',
+        'results_found': '共 {0} 条',
+        'previous_page': '上一页',
+        'next_page': '下一页',
         'property_label': '性质',
         'flavor_label': '味道',
         'meridian_label': '归经',